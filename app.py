@@ -1,6 +1,5 @@
 from flask import Flask, jsonify
-from flask_mysqldb import MySQL
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, get_jwt_identity
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 import os
@@ -9,11 +8,31 @@ from datetime import timedelta
 from auth_routes import init_auth_routes
 from avatar_routes import init_avatar_routes
 from garment_routes import init_garment_routes
+from batch_routes import init_batch_routes
+from db_pool import PooledMySQL
+from metrics import Metrics
+from query_inspector import QueryInspector
+from health import HealthMonitor
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from compression import Compression
+from json_provider import FastJSONProvider
+from profile_documents import ProfileDocuments
+from popularity import PopularityCounters
+from recommendations import GarmentSimilarity
+from fit import FitEngine
+from feeds import PersonalizedFeeds
+from dimensions import GarmentDimensions
+from archive import GarmentArchiver
+from totals import ListingTotals
+from suggest import GarmentSuggestions
+from price_stats import PriceStatistics
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # CORS Configuration
 CORS(app, resources={
@@ -35,16 +54,180 @@ app.config['MYSQL_DB'] = os.getenv('MYSQL_DB', 'mydb')
 app.config['MYSQL_PORT'] = int(os.getenv('MYSQL_PORT', 3306))
 app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
 
+# Connection pool configuration. Every waitress worker thread holds at most
+# one connection per request, so the pool is sized to the thread count.
+app.config['WAITRESS_THREADS'] = int(os.getenv('WAITRESS_THREADS', 4))
+app.config['MYSQL_POOL_MIN_SIZE'] = int(os.getenv('MYSQL_POOL_MIN_SIZE', 1))
+app.config['MYSQL_POOL_MAX_SIZE'] = int(os.getenv('MYSQL_POOL_MAX_SIZE', app.config['WAITRESS_THREADS']))
+app.config['MYSQL_POOL_MAX_OVERFLOW'] = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 2))
+app.config['MYSQL_POOL_TIMEOUT'] = float(os.getenv('MYSQL_POOL_TIMEOUT', 10))
+app.config['MYSQL_POOL_RECYCLE'] = int(os.getenv('MYSQL_POOL_RECYCLE', 3600))
+app.config['MYSQL_POOL_VALIDATE_AFTER'] = float(os.getenv('MYSQL_POOL_VALIDATE_AFTER', 30))
+
+# Read replicas (comma-separated host[:port]); reads stay on the primary for
+# MYSQL_STICKY_SECONDS after a client writes, on every worker through the
+# MYSQL_STICKY_COOKIE cookie set on the write's response
+app.config['MYSQL_REPLICA_HOSTS'] = os.getenv('MYSQL_REPLICA_HOSTS', '')
+app.config['MYSQL_REPLICA_CHECKOUT_TIMEOUT'] = float(os.getenv('MYSQL_REPLICA_CHECKOUT_TIMEOUT', 1))
+app.config['MYSQL_STICKY_SECONDS'] = float(os.getenv('MYSQL_STICKY_SECONDS', 5))
+app.config['MYSQL_STICKY_COOKIE'] = os.getenv('MYSQL_STICKY_COOKIE', 'db_sticky_until')
+
 # JWT Configuration
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', '')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=4)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 app.config['JWT_ALGORITHM'] = 'HS256'
 
+# Health probe configuration (probes run in the background, never per request)
+app.config['HEALTH_PROBE_INTERVAL'] = float(os.getenv('HEALTH_PROBE_INTERVAL', 5))
+app.config['HEALTH_STALE_AFTER'] = float(os.getenv('HEALTH_STALE_AFTER', 15))
+app.config['HEALTH_PROBE_TIMEOUT'] = float(os.getenv('HEALTH_PROBE_TIMEOUT', 2))
+app.config['HEALTH_MAX_REPLICA_LAG'] = float(os.getenv('HEALTH_MAX_REPLICA_LAG', 30))
+
+# Response cache for anonymous catalog GETs (process-local)
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'True') == 'True'
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Don't repopulate from replicas that may not have seen the write yet
+app.config['RESPONSE_CACHE_SETTLE_SECONDS'] = float(os.getenv(
+    'RESPONSE_CACHE_SETTLE_SECONDS',
+    app.config['MYSQL_STICKY_SECONDS'] if app.config['MYSQL_REPLICA_HOSTS'] else 0
+))
+
+# Response compression for /api/*
+app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'True') == 'True'
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 5))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+# Coalescing of identical concurrent catalog queries
+app.config['SINGLEFLIGHT_TIMEOUT'] = float(os.getenv('SINGLEFLIGHT_TIMEOUT', 10))
+
+# Batch endpoint (POST /api/batch). Concurrent sub-requests each hold a pool
+# connection, so keep the workers within the pool's overflow headroom.
+app.config['BATCH_MAX_REQUESTS'] = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+app.config['BATCH_MAX_WORKERS'] = int(os.getenv('BATCH_MAX_WORKERS', 4))
+
+# Materialized profile documents: served while they match the source rows and
+# are younger than PROFILE_DOC_MAX_AGE seconds (bounds staleness after
+# garment edits); rebuilt in the background after changes
+app.config['PROFILE_DOCS_ENABLED'] = os.getenv('PROFILE_DOCS_ENABLED', 'True') == 'True'
+app.config['PROFILE_DOC_MAX_AGE'] = int(os.getenv('PROFILE_DOC_MAX_AGE', 300))
+app.config['PROFILE_DOC_REBUILD_DELAY'] = float(os.getenv('PROFILE_DOC_REBUILD_DELAY', 0.05))
+
+# Wardrobe popularity counters: deltas flushed every POPULARITY_FLUSH_INTERVAL
+# seconds, drift corrected every POPULARITY_RECONCILE_INTERVAL seconds (and by
+# `flask reconcile-popularity`)
+app.config['POPULARITY_FLUSH_INTERVAL'] = float(os.getenv('POPULARITY_FLUSH_INTERVAL', 2.0))
+app.config['POPULARITY_RECONCILE_INTERVAL'] = int(os.getenv('POPULARITY_RECONCILE_INTERVAL', 3600))
+app.config['POPULARITY_RECONCILE_CHUNK'] = int(os.getenv('POPULARITY_RECONCILE_CHUNK', 5000))
+
+# "Frequently saved together" index behind GET /api/garments/<id>/similar
+app.config['SIMILAR_TOP_K'] = int(os.getenv('SIMILAR_TOP_K', 50))
+app.config['SIMILAR_MIN_SUPPORT'] = int(os.getenv('SIMILAR_MIN_SUPPORT', 2))
+app.config['SIMILAR_UPDATE_DELAY'] = float(os.getenv('SIMILAR_UPDATE_DELAY', 1.0))
+app.config['SIMILAR_REBUILD_INTERVAL'] = int(os.getenv('SIMILAR_REBUILD_INTERVAL', 3600))
+
+# Size chart refresh delay of the fit engine (sort=fit on garment listings)
+app.config['FIT_REFRESH_DELAY'] = float(os.getenv('FIT_REFRESH_DELAY', 0.5))
+
+# Personalized feeds (GET /api/avatar/feed), built by `flask build-feeds`:
+# the top FEED_SIZE garments of avatars active within FEED_ACTIVE_DAYS,
+# scored FEED_CHUNK avatars at a time on FEED_WORKERS processes (default: one
+# per CPU). Unchanged feeds are rebuilt once older than FEED_MAX_AGE seconds
+# if the catalog changed.
+app.config['FEED_SIZE'] = int(os.getenv('FEED_SIZE', 200))
+app.config['FEED_ACTIVE_DAYS'] = int(os.getenv('FEED_ACTIVE_DAYS', 30))
+app.config['FEED_MAX_AGE'] = int(os.getenv('FEED_MAX_AGE', 6 * 3600))
+app.config['FEED_CHUNK'] = int(os.getenv('FEED_CHUNK', 64))
+app.config['FEED_WORKERS'] = int(os.getenv('FEED_WORKERS', 0)) or None
+
+# Id-range chunk of `flask migrate-dimensions` (brand/category/style keys)
+app.config['DIMENSION_MIGRATION_CHUNK'] = int(os.getenv('DIMENSION_MIGRATION_CHUNK', 5000))
+
+# Archival of garments unavailable for ARCHIVE_AFTER_DAYS days
+# (`flask archive-garments`), ARCHIVE_BATCH garments per transaction with
+# ARCHIVE_PAUSE seconds between batches
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+app.config['ARCHIVE_BATCH'] = int(os.getenv('ARCHIVE_BATCH', 500))
+app.config['ARCHIVE_PAUSE'] = float(os.getenv('ARCHIVE_PAUSE', 0.5))
+
+# Listing totals (withTotal=true): exact up to TOTALS_EXACT_LIMIT matches,
+# estimated beyond from per-filter counts cached for TOTALS_TTL seconds
+app.config['TOTALS_EXACT_LIMIT'] = int(os.getenv('TOTALS_EXACT_LIMIT', 1000))
+app.config['TOTALS_TTL'] = int(os.getenv('TOTALS_TTL', 300))
+app.config['TOTALS_MAX_ENTRIES'] = int(os.getenv('TOTALS_MAX_ENTRIES', 1024))
+
+# Typeahead index behind GET /api/garments/suggest: keys of up to
+# SUGGEST_KEY_LENGTH characters at the first SUGGEST_MAX_WORDS words of each
+# name; prefixes matching more than SUGGEST_SCAN_LIMIT keys ranked ahead of time
+app.config['SUGGEST_KEY_LENGTH'] = int(os.getenv('SUGGEST_KEY_LENGTH', 24))
+app.config['SUGGEST_MAX_WORDS'] = int(os.getenv('SUGGEST_MAX_WORDS', 3))
+app.config['SUGGEST_SCAN_LIMIT'] = int(os.getenv('SUGGEST_SCAN_LIMIT', 256))
+app.config['SUGGEST_UPDATE_DELAY'] = float(os.getenv('SUGGEST_UPDATE_DELAY', 0.5))
+app.config['SUGGEST_REBUILD_INTERVAL'] = int(os.getenv('SUGGEST_REBUILD_INTERVAL', 3600))
+
+# Price sketches behind GET /api/garments/stats: write deltas flushed every
+# STATS_FLUSH_INTERVAL seconds, summaries reloaded every
+# STATS_REFRESH_INTERVAL seconds, rebuilt from garments every
+# STATS_REBUILD_INTERVAL seconds (and by `flask rebuild-price-stats`)
+app.config['STATS_FLUSH_INTERVAL'] = float(os.getenv('STATS_FLUSH_INTERVAL', 5.0))
+app.config['STATS_REFRESH_INTERVAL'] = int(os.getenv('STATS_REFRESH_INTERVAL', 60))
+app.config['STATS_REBUILD_INTERVAL'] = int(os.getenv('STATS_REBUILD_INTERVAL', 24 * 3600))
+
+# Metrics Configuration
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'True') == 'True'
+
+# SQL inspector (development/staging): N+1 and slow query detection
+app.config['QUERY_INSPECTOR_ENABLED'] = os.getenv('QUERY_INSPECTOR_ENABLED', 'False') == 'True'
+app.config['QUERY_INSPECTOR_SLOW_MS'] = float(os.getenv('QUERY_INSPECTOR_SLOW_MS', 100))
+app.config['QUERY_INSPECTOR_N_PLUS_ONE'] = int(os.getenv('QUERY_INSPECTOR_N_PLUS_ONE', 3))
+# Statements per request on the common path (profile documents served,
+# dimension names cached), as measured with X-Query-Count; more is logged
+app.config['QUERY_BUDGETS'] = {
+    'avatar.get_avatar_profile': 1,
+    'avatar.get_wardrobe': 3,
+    'avatar.get_avatar_by_id': 1,
+    'avatar.get_feed': 2,
+    'garment.get_garments': 1,
+    'garment.get_garment': 1,
+    'garment.get_top_rated': 1
+}
+
 # Initialize extensions
-mysql = MySQL(app)
+mysql = PooledMySQL(app)
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
+metrics = Metrics(app, mysql)
+query_inspector = QueryInspector(app, mysql)
+health_monitor = HealthMonitor(app, mysql)
+response_cache = ResponseCache(app)
+compression = Compression(app, response_cache)
+profile_documents = ProfileDocuments(app, mysql, metrics)
+popularity = PopularityCounters(app, mysql)
+similar_garments = GarmentSimilarity(app, mysql)
+fit_engine = FitEngine(app, mysql)
+feeds = PersonalizedFeeds(app, mysql)
+dimensions = GarmentDimensions(app, mysql)
+archiver = GarmentArchiver(app, mysql)
+totals = ListingTotals(app, mysql)
+suggestions = GarmentSuggestions(app, mysql)
+price_stats = PriceStatistics(app, mysql)
+catalog_singleflight = SingleFlight(timeout=app.config['SINGLEFLIGHT_TIMEOUT'])
+
+
+@mysql.sticky_key_loader
+def database_sticky_key():
+    """
+    Pin authenticated clients by identity, as already verified by the route
+    (the token is not decoded again here). Other requests rely on the sticky
+    cookie alone: addresses are shared behind NATs and proxies.
+    """
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        return None  # the route did not verify a token
+    return f'user:{identity}' if identity is not None else None
 
 
 # JWT error handlers
@@ -76,38 +259,61 @@ def missing_token_callback(error):
 auth_bp = init_auth_routes(mysql)
 app.register_blueprint(auth_bp)
 
-avatar_bp = init_avatar_routes(mysql)
+avatar_bp = init_avatar_routes(mysql, response_cache, profile_documents, feeds, totals)
 app.register_blueprint(avatar_bp)
 
-garment_bp = init_garment_routes(mysql)
+garment_bp = init_garment_routes(
+    mysql, response_cache, catalog_singleflight, similar_garments, fit_engine, totals,
+    suggestions, price_stats
+)
 app.register_blueprint(garment_bp)
 
+batch_bp = init_batch_routes(app.config['BATCH_MAX_REQUESTS'], app.config['BATCH_MAX_WORKERS'])
+app.register_blueprint(batch_bp)
+
+
+@app.route('/livez', methods=['GET'])
+def liveness_check():
+    """
+    Liveness probe: the process is up and serving requests (no DB access)
+    """
+    return jsonify({'status': 'alive'}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe served from the cached background database probe
+    """
+    payload, ready = health_monitor.readiness()
+    return jsonify(payload), 200 if ready else 503
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """
-    Health check endpoint that verifies both application and database connectivity
+    Health check endpoint reporting application and database connectivity
+    (served from the cached background probe, like /readyz)
     """
-    try:
-        # Test database connection
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        cursor.close()
-        
+    payload, ready = health_monitor.readiness()
+
+    if ready:
         return jsonify({
             'status': 'healthy',
             'message': 'Application is running and database is connected',
-            'database': 'connected'
+            'database': 'connected',
+            'pool': mysql.pool.stats(),
+            'readiness': payload
         }), 200
-        
-    except Exception as e:
-        return jsonify({
-            'status': 'unhealthy',
-            'message': 'Database connection failed',
-            'database': 'disconnected',
-            'error': str(e)
-        }), 503
+
+    return jsonify({
+        'status': 'unhealthy',
+        'message': payload.get('message', 'Database connection failed'),
+        'database': payload.get('database', 'unknown'),
+        'pool': mysql.pool.stats(),
+        'error': payload.get('error'),
+        'readiness': payload
+    }), 503
 
 
 @app.route('/', methods=['GET'])
@@ -120,6 +326,10 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             'health': '/health',
+            'liveness': '/livez',
+            'readiness': '/readyz',
+            'metrics': '/metrics',
+            'batch': 'POST /api/batch',
             'root': '/',
             'auth': {
                 'register': 'POST /api/auth/register',
@@ -138,6 +348,7 @@ def index():
                 'add_garment': 'POST /api/avatar/garments',
                 'remove_garment': 'DELETE /api/avatar/garments/<garment_id>',
                 'get_wardrobe': 'GET /api/avatar/garments',
+                'feed': 'GET /api/avatar/feed',
                 'get_public_avatars': 'GET /api/avatar/public',
                 'get_avatar_by_id': 'GET /api/avatar/<avatar_id>'
             },
@@ -148,6 +359,11 @@ def index():
                 'by_brand': 'GET /api/garments/brands/<brand>',
                 'by_category': 'GET /api/garments/categories/<category>',
                 'top_rated': 'GET /api/garments/top-rated',
+                'suggest': 'GET /api/garments/suggest?prefix=<text>',
+                'stats': 'GET /api/garments/stats',
+                'similar': 'GET /api/garments/<garment_id>/similar',
+                'sizes': 'GET /api/garments/<garment_id>/sizes',
+                'changes': 'GET /api/garments/changes?since=<token>',
                 'create': 'POST /api/garments/',
                 'update': 'PUT /api/garments/<garment_id>',
                 'delete': 'DELETE /api/garments/<garment_id>'
@@ -0,0 +1,120 @@
+"""
+Archival of long-unavailable garments (hot/cold catalog split)
+
+``delete_garment`` only marks a garment unavailable. ``flask
+archive-garments`` moves the garments unavailable for more than
+``ARCHIVE_AFTER_DAYS`` days (by ``updated_at``, which the soft delete bumps)
+from ``garments`` to ``garments_archive``, so the hot table and its indexes
+only hold the live catalog.
+
+It runs online: batches of ``ARCHIVE_BATCH`` garments, each copied and
+deleted in one short transaction that locks only its rows, with a pause of
+``ARCHIVE_PAUSE`` seconds between batches. Every batch commits on its own
+and the selection is the same on every run, so an interrupted run is simply
+started again.
+
+Wardrobes keep their archived garments: ``get_avatar_garments`` resolves
+them from the archive. Archived garments cannot be added to a wardrobe or
+edited.
+"""
+import logging
+import time
+from datetime import timedelta
+
+import click
+
+from db_types import current_timestamp
+
+logger = logging.getLogger(__name__)
+
+# garments columns copied to garments_archive
+ARCHIVED_COLUMNS = (
+    'id', 'name', 'brand_id', 'price', 'rating', 'image_url', 'description',
+    'category_id', 'style_id', 'available', 'wardrobe_count', 'created_at', 'updated_at'
+)
+
+
+class GarmentArchiver:
+    """Flask extension registering the garment archival job"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.after_days = 180
+        self.batch_size = 500
+        self.pause = 0.5
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.after_days = app.config.get('ARCHIVE_AFTER_DAYS', 180)
+        self.batch_size = app.config.get('ARCHIVE_BATCH', 500)
+        self.pause = app.config.get('ARCHIVE_PAUSE', 0.5)
+        app.extensions['archiver'] = self
+
+        @app.cli.command('archive-garments')
+        @click.option('--after-days', type=int, default=None,
+                      help='Archive garments unavailable for longer than this')
+        @click.option('--max-batches', type=int, default=None,
+                      help='Stop after this many batches (resume with the next run)')
+        def archive_garments_command(after_days, max_batches):
+            """Move long-unavailable garments to garments_archive"""
+            click.echo(f'{self.archive(after_days, max_batches)} garments archived')
+
+    def archive(self, after_days=None, max_batches=None):
+        """Archive the garments unavailable since the cutoff; returns how many moved"""
+        days = self.after_days if after_days is None else after_days
+        cutoff = current_timestamp(self.mysql.connection) - timedelta(days=days)
+        archived = 0
+        batches = 0
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            moved, last_id = self._archive_batch(cutoff, last_id)
+            if last_id is None:
+                break
+            archived += moved
+            batches += 1
+            time.sleep(self.pause)
+        if archived:
+            logger.info('archive: moved %d garments in %d batches', archived, batches)
+        return archived
+
+    def _archive_batch(self, cutoff, after_id):
+        """
+        Move the next batch of candidates after ``after_id``; returns
+        ``(garments moved, last id examined)`` or ``(0, None)`` when done
+        """
+        columns = ', '.join(ARCHIVED_COLUMNS)
+        cursor = self.mysql.connection.cursor()
+        try:
+            # Locks the batch: a garment made available again meanwhile is
+            # either seen available here or waits for the batch to commit
+            cursor.execute("""
+                SELECT id FROM garments
+                WHERE id > %s AND available = FALSE AND updated_at < %s
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE
+            """, (after_id, cutoff, self.batch_size))
+            garment_ids = [row['id'] for row in cursor.fetchall()]
+            if not garment_ids:
+                self.mysql.rollback()
+                return 0, None
+
+            placeholders = ', '.join(['%s'] * len(garment_ids))
+            cursor.execute(
+                f"INSERT INTO garments_archive ({columns}, archived_at) "
+                f"SELECT {columns}, CURRENT_TIMESTAMP FROM garments WHERE id IN ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE archived_at = VALUES(archived_at)",
+                tuple(garment_ids)
+            )
+            cursor.execute(f"DELETE FROM garments WHERE id IN ({placeholders})",
+                           tuple(garment_ids))
+            moved = cursor.rowcount
+            self.mysql.commit()
+        except Exception:
+            self.mysql.rollback()
+            raise
+        finally:
+            cursor.close()
+        return moved, garment_ids[-1]
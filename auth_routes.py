@@ -7,7 +7,7 @@ from flask_jwt_extended import (
     get_jwt_identity, get_jwt
 )
 from email_validator import validate_email, EmailNotValidError
-from models import User, UserRepository
+from models import EmailAlreadyRegistered, User, UserRepository
 from datetime import datetime, timedelta
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
@@ -49,13 +49,12 @@ def init_auth_routes(mysql):
             if len(full_name) < 2:
                 return jsonify({'error': 'Full name must be at least 2 characters long'}), 400
             
-            # Check if email already exists
-            if user_repo.email_exists(email):
+            # Create user (duplicate emails are rejected by the unique index)
+            try:
+                user = user_repo.create_user(email, full_name, password)
+            except EmailAlreadyRegistered:
                 return jsonify({'error': 'Email already registered'}), 409
             
-            # Create user
-            user = user_repo.create_user(email, full_name, password)
-            
             # Generate tokens
             access_token = create_access_token(identity=str(user.id))
             refresh_token = create_refresh_token(identity=str(user.id))
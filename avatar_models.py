@@ -2,6 +2,21 @@
 Avatar models for database operations
 """
 from datetime import datetime
+from MySQLdb import IntegrityError
+from db_types import as_stored, current_timestamp, is_duplicate_key
+from dimensions import decode_garment
+from signals import avatar_changed, measurements_changed, wardrobe_changed
+
+AVATAR_DECIMAL_FIELDS = ('height', 'weight')
+AVATAR_BOOLEAN_FIELDS = (
+    'biometric_verified', 'auto_estimated', 'share_with_world', 'create_assistant',
+    'create_greeting_cards', 'public_profile', 'allow_connections'
+)
+MEASUREMENT_FIELDS = ('chest', 'waist', 'hips', 'shoulder_width', 'inseam',
+                      'arm_length', 'neck_size')
+
+# avatar_garments columns also present in garments
+_LINK_COLUMNS = ('id', 'created_at')
 
 
 class Avatar:
@@ -185,50 +200,61 @@ class AvatarRepository:
         """Create a new avatar profile"""
         try:
             cursor = self.mysql.connection.cursor()
+            now = current_timestamp(self.mysql.connection)
             
             query = """
                 INSERT INTO avatars (
                     user_id, full_name, bio, age, height, height_unit, weight, weight_unit,
                     avatar_type, generic_avatar_style, biometric_verified, measurement_mode,
                     auto_estimated, share_with_world, create_assistant, create_greeting_cards,
-                    public_profile, allow_connections, selected_greeting_template
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    public_profile, allow_connections, selected_greeting_template,
+                    created_at, updated_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                          %s, %s)
             """
             
-            cursor.execute(query, (
-                user_id,
-                avatar_data.get('full_name'),
-                avatar_data.get('bio'),
-                avatar_data.get('age'),
-                avatar_data.get('height'),
-                avatar_data.get('height_unit'),
-                avatar_data.get('weight'),
-                avatar_data.get('weight_unit'),
-                avatar_data.get('avatar_type'),
-                avatar_data.get('generic_avatar_style'),
-                avatar_data.get('biometric_verified', False),
-                avatar_data.get('measurement_mode'),
-                avatar_data.get('auto_estimated', False),
-                avatar_data.get('share_with_world', False),
-                avatar_data.get('create_assistant', False),
-                avatar_data.get('create_greeting_cards', False),
-                avatar_data.get('public_profile', False),
-                avatar_data.get('allow_connections', True),
-                avatar_data.get('selected_greeting_template')
-            ))
+            row = as_stored({
+                'user_id': user_id,
+                'full_name': avatar_data.get('full_name'),
+                'bio': avatar_data.get('bio'),
+                'age': avatar_data.get('age'),
+                'height': avatar_data.get('height'),
+                'height_unit': avatar_data.get('height_unit'),
+                'weight': avatar_data.get('weight'),
+                'weight_unit': avatar_data.get('weight_unit'),
+                'avatar_type': avatar_data.get('avatar_type'),
+                'generic_avatar_style': avatar_data.get('generic_avatar_style'),
+                'biometric_verified': avatar_data.get('biometric_verified', False),
+                'measurement_mode': avatar_data.get('measurement_mode'),
+                'auto_estimated': avatar_data.get('auto_estimated', False),
+                'share_with_world': avatar_data.get('share_with_world', False),
+                'create_assistant': avatar_data.get('create_assistant', False),
+                'create_greeting_cards': avatar_data.get('create_greeting_cards', False),
+                'public_profile': avatar_data.get('public_profile', False),
+                'allow_connections': avatar_data.get('allow_connections', True),
+                'selected_greeting_template': avatar_data.get('selected_greeting_template'),
+                'created_at': now,
+                'updated_at': now
+            }, AVATAR_DECIMAL_FIELDS, AVATAR_BOOLEAN_FIELDS)
+            cursor.execute(query, tuple(row.values()))
             
-            self.mysql.connection.commit()
+            self.mysql.commit()
             avatar_id = cursor.lastrowid
             cursor.close()
             
-            return self.get_avatar_by_id(avatar_id)
+            self.mysql.after_commit(
+                avatar_changed.send, self, avatar_id=avatar_id, action='create',
+                fields=set(avatar_data),
+                public=bool(avatar_data.get('public_profile', False))
+            )
+            return Avatar.from_dict(dict(row, id=avatar_id))
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def get_avatar_by_id(self, avatar_id):
         """Get avatar by ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM avatars WHERE id = %s"
         cursor.execute(query, (avatar_id,))
         result = cursor.fetchone()
@@ -240,7 +266,7 @@ class AvatarRepository:
     
     def get_avatar_by_user_id(self, user_id):
         """Get avatar by user ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM avatars WHERE user_id = %s"
         cursor.execute(query, (user_id,))
         result = cursor.fetchone()
@@ -250,8 +276,11 @@ class AvatarRepository:
             return Avatar.from_dict(result)
         return None
     
-    def update_avatar(self, avatar_id, avatar_data):
-        """Update avatar profile"""
+    def update_avatar(self, avatar_id, avatar_data, current=None):
+        """
+        Update avatar profile. Pass the ``current`` Avatar when the caller
+        already loaded it so the result is built without reading it back.
+        """
         allowed_fields = [
             'full_name', 'bio', 'age', 'height', 'height_unit', 'weight', 'weight_unit',
             'avatar_type', 'generic_avatar_style', 'biometric_verified', 'measurement_mode',
@@ -270,36 +299,67 @@ class AvatarRepository:
         if not update_fields:
             return None
         
-        values.append(avatar_id)
-        query = f"UPDATE avatars SET {', '.join(update_fields)} WHERE id = %s"
+        written = as_stored(
+            dict(zip((f.split(' ')[0] for f in update_fields), values)),
+            AVATAR_DECIMAL_FIELDS, AVATAR_BOOLEAN_FIELDS
+        )
+        query = (f"UPDATE avatars SET {', '.join(update_fields)}, updated_at = %s, "
+                 "version = version + 1 WHERE id = %s")
         
         try:
             cursor = self.mysql.connection.cursor()
-            cursor.execute(query, tuple(values))
-            self.mysql.connection.commit()
+            now = current_timestamp(self.mysql.connection)
+            cursor.execute(query, tuple(written.values()) + (now, avatar_id))
+            self.mysql.commit()
             cursor.close()
             
-            return self.get_avatar_by_id(avatar_id)
+            if current is not None:
+                avatar = Avatar.from_dict(dict(vars(current), **written, updated_at=now))
+            else:
+                avatar = self.get_avatar_by_id(avatar_id)
+            self.mysql.after_commit(
+                avatar_changed.send, self, avatar_id=avatar_id, action='update',
+                fields={f.split(' ')[0] for f in update_fields},
+                public=bool(avatar.public_profile) if avatar else None
+            )
+            return avatar
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def delete_avatar(self, avatar_id):
         """Delete avatar"""
         try:
             cursor = self.mysql.connection.cursor()
+            # The wardrobe goes with the avatar (ON DELETE CASCADE); lock and
+            # collect it so subscribers see it cleared
+            cursor.execute(
+                "SELECT garment_id FROM avatar_garments WHERE avatar_id = %s FOR UPDATE",
+                (avatar_id,)
+            )
+            garment_ids = tuple(row['garment_id'] for row in cursor.fetchall())
             query = "DELETE FROM avatars WHERE id = %s"
             cursor.execute(query, (avatar_id,))
-            self.mysql.connection.commit()
+            self.mysql.commit()
             cursor.close()
+            
+            if garment_ids:
+                self.mysql.after_commit(
+                    wardrobe_changed.send, self, avatar_id=avatar_id, garment_id=None,
+                    action='clear', garment_ids=garment_ids
+                )
+            self.mysql.after_commit(
+                avatar_changed.send, self, avatar_id=avatar_id, action='delete',
+                fields=set(), public=None
+            )
             return True
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def get_public_avatars(self, limit=20, offset=0):
         """Get public avatars"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = """
             SELECT * FROM avatars 
             WHERE public_profile = TRUE 
@@ -311,6 +371,22 @@ class AvatarRepository:
         cursor.close()
         
         return [Avatar.from_dict(row) for row in results]
+    
+    def count_public_avatars(self, limit=None):
+        """Number of public avatars, counting at most ``limit`` of them (None counts all)"""
+        cursor = self.mysql.read_connection.cursor()
+        if limit is None:
+            cursor.execute("SELECT COUNT(*) AS total FROM avatars WHERE public_profile = TRUE")
+        else:
+            query = """
+                SELECT COUNT(*) AS total
+                FROM (SELECT 1 FROM avatars WHERE public_profile = TRUE LIMIT %s) t
+            """
+            cursor.execute(query, (limit,))
+        result = cursor.fetchone()
+        cursor.close()
+        
+        return result['total']
 
 
 class BodyMeasurementRepository:
@@ -324,36 +400,44 @@ class BodyMeasurementRepository:
         try:
             cursor = self.mysql.connection.cursor()
             
+            now = current_timestamp(self.mysql.connection)
+            
             query = """
                 INSERT INTO body_measurements (
                     avatar_id, chest, waist, hips, shoulder_width, 
-                    inseam, arm_length, neck_size
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    inseam, arm_length, neck_size, created_at, updated_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
             
-            cursor.execute(query, (
-                avatar_id,
-                measurements_data.get('chest'),
-                measurements_data.get('waist'),
-                measurements_data.get('hips'),
-                measurements_data.get('shoulder_width'),
-                measurements_data.get('inseam'),
-                measurements_data.get('arm_length'),
-                measurements_data.get('neck_size')
-            ))
+            row = as_stored({
+                'avatar_id': avatar_id,
+                'chest': measurements_data.get('chest'),
+                'waist': measurements_data.get('waist'),
+                'hips': measurements_data.get('hips'),
+                'shoulder_width': measurements_data.get('shoulder_width'),
+                'inseam': measurements_data.get('inseam'),
+                'arm_length': measurements_data.get('arm_length'),
+                'neck_size': measurements_data.get('neck_size'),
+                'created_at': now,
+                'updated_at': now
+            }, MEASUREMENT_FIELDS)
+            cursor.execute(query, tuple(row.values()))
             
-            self.mysql.connection.commit()
+            self.mysql.commit()
             measurement_id = cursor.lastrowid
             cursor.close()
             
-            return self.get_measurements_by_id(measurement_id)
+            self.mysql.after_commit(
+                measurements_changed.send, self, avatar_id=avatar_id, action='create'
+            )
+            return BodyMeasurement.from_dict(dict(row, id=measurement_id))
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def get_measurements_by_id(self, measurement_id):
         """Get measurements by ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM body_measurements WHERE id = %s"
         cursor.execute(query, (measurement_id,))
         result = cursor.fetchone()
@@ -365,7 +449,7 @@ class BodyMeasurementRepository:
     
     def get_measurements_by_avatar_id(self, avatar_id):
         """Get measurements by avatar ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM body_measurements WHERE avatar_id = %s"
         cursor.execute(query, (avatar_id,))
         result = cursor.fetchone()
@@ -375,10 +459,13 @@ class BodyMeasurementRepository:
             return BodyMeasurement.from_dict(result)
         return None
     
-    def update_measurements(self, avatar_id, measurements_data):
-        """Update body measurements"""
-        allowed_fields = ['chest', 'waist', 'hips', 'shoulder_width', 
-                         'inseam', 'arm_length', 'neck_size']
+    def update_measurements(self, avatar_id, measurements_data, current=None):
+        """
+        Update body measurements. Pass the ``current`` BodyMeasurement when
+        the caller already loaded it so the result is built without reading
+        it back.
+        """
+        allowed_fields = MEASUREMENT_FIELDS
         
         update_fields = []
         values = []
@@ -391,18 +478,27 @@ class BodyMeasurementRepository:
         if not update_fields:
             return None
         
-        values.append(avatar_id)
-        query = f"UPDATE body_measurements SET {', '.join(update_fields)} WHERE avatar_id = %s"
+        written = as_stored(
+            dict(zip((f.split(' ')[0] for f in update_fields), values)), MEASUREMENT_FIELDS
+        )
+        query = (f"UPDATE body_measurements SET {', '.join(update_fields)}, updated_at = %s, "
+                 "version = version + 1 WHERE avatar_id = %s")
         
         try:
             cursor = self.mysql.connection.cursor()
-            cursor.execute(query, tuple(values))
-            self.mysql.connection.commit()
+            now = current_timestamp(self.mysql.connection)
+            cursor.execute(query, tuple(written.values()) + (now, avatar_id))
+            self.mysql.commit()
             cursor.close()
             
+            self.mysql.after_commit(
+                measurements_changed.send, self, avatar_id=avatar_id, action='update'
+            )
+            if current is not None:
+                return BodyMeasurement.from_dict(dict(vars(current), **written, updated_at=now))
             return self.get_measurements_by_avatar_id(avatar_id)
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
 
 
@@ -413,35 +509,52 @@ class AvatarGarmentRepository:
         self.mysql = mysql
     
     def add_garment(self, avatar_id, garment_id):
-        """Add garment to avatar wardrobe"""
+        """
+        Add garment to avatar wardrobe (no-op if it is already there).
+        Raises LookupError if the garment is not in the catalog or no
+        longer available.
+        """
         try:
             cursor = self.mysql.connection.cursor()
+            now = current_timestamp(self.mysql.connection)
             
-            # Check if already exists
-            check_query = """
-                SELECT id FROM avatar_garments 
-                WHERE avatar_id = %s AND garment_id = %s
+            # Only available garments of the live catalog (archived ones are
+            # not in garments); the shared lock keeps the garment from being
+            # deleted or archived before commit
+            query = """
+                INSERT INTO avatar_garments (avatar_id, garment_id, created_at)
+                SELECT %s, id, %s FROM garments WHERE id = %s AND available = TRUE
             """
-            cursor.execute(check_query, (avatar_id, garment_id))
-            existing = cursor.fetchone()
-            
-            if existing:
+            try:
+                cursor.execute(query, (avatar_id, now, garment_id))
+            except IntegrityError as e:
+                # unique_avatar_garment: already in the wardrobe
+                if not is_duplicate_key(e):
+                    raise
+                check_query = """
+                    SELECT * FROM avatar_garments 
+                    WHERE avatar_id = %s AND garment_id = %s
+                """
+                cursor.execute(check_query, (avatar_id, garment_id))
+                existing = cursor.fetchone()
                 cursor.close()
                 return AvatarGarment.from_dict(existing)
-            
-            query = """
-                INSERT INTO avatar_garments (avatar_id, garment_id)
-                VALUES (%s, %s)
-            """
-            cursor.execute(query, (avatar_id, garment_id))
-            self.mysql.connection.commit()
-            
+            if not cursor.rowcount:
+                cursor.close()
+                raise LookupError(f'Garment {garment_id} not found')
             garment_link_id = cursor.lastrowid
+            self._record_change(cursor, avatar_id, garment_id, 'add')
+            self.mysql.commit()
             cursor.close()
             
-            return self.get_garment_link_by_id(garment_link_id)
+            self.mysql.after_commit(
+                wardrobe_changed.send, self, avatar_id=avatar_id, garment_id=garment_id,
+                action='add'
+            )
+            return AvatarGarment(id=garment_link_id, avatar_id=avatar_id,
+                                 garment_id=garment_id, created_at=now)
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def remove_garment(self, avatar_id, garment_id):
@@ -450,16 +563,25 @@ class AvatarGarmentRepository:
             cursor = self.mysql.connection.cursor()
             query = "DELETE FROM avatar_garments WHERE avatar_id = %s AND garment_id = %s"
             cursor.execute(query, (avatar_id, garment_id))
-            self.mysql.connection.commit()
+            removed = cursor.rowcount
+            if removed:
+                self._record_change(cursor, avatar_id, garment_id, 'remove')
+            self.mysql.commit()
             cursor.close()
+            
+            if removed:
+                self.mysql.after_commit(
+                    wardrobe_changed.send, self, avatar_id=avatar_id, garment_id=garment_id,
+                    action='remove'
+                )
             return True
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def get_garment_link_by_id(self, garment_link_id):
         """Get garment link by ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM avatar_garments WHERE id = %s"
         cursor.execute(query, (garment_link_id,))
         result = cursor.fetchone()
@@ -469,30 +591,156 @@ class AvatarGarmentRepository:
             return AvatarGarment.from_dict(result)
         return None
     
-    def get_avatar_garments(self, avatar_id):
-        """Get all garments for an avatar"""
-        cursor = self.mysql.connection.cursor()
+    def get_avatar_garments(self, avatar_id, garment_ids=None):
+        """Get all garments for an avatar (only ``garment_ids`` if given)"""
+        cursor = self.mysql.read_connection.cursor()
         query = """
             SELECT ag.*, g.* 
             FROM avatar_garments ag
             LEFT JOIN garments g ON ag.garment_id = g.id
             WHERE ag.avatar_id = %s
         """
-        cursor.execute(query, (avatar_id,))
+        params = [avatar_id]
+        if garment_ids is not None:
+            if not garment_ids:
+                cursor.close()
+                return ()
+            query += f" AND ag.garment_id IN ({', '.join(['%s'] * len(garment_ids))})"
+            params.extend(garment_ids)
+        cursor.execute(query, tuple(params))
         results = cursor.fetchall()
+        
+        # Garments moved to the archive (see archive.py) are read from there
+        archived_ids = [row['garment_id'] for row in results if row.get('name') is None]
+        if archived_ids:
+            query = (
+                "SELECT * FROM garments_archive "
+                f"WHERE id IN ({', '.join(['%s'] * len(archived_ids))})"
+            )
+            cursor.execute(query, tuple(archived_ids))
+            archived = {row['id']: row for row in cursor.fetchall()}
+            for row in results:
+                if row['garment_id'] in archived:
+                    self._fill_garment(row, archived[row['garment_id']])
+        
+        for row in results:
+            decode_garment(row, cursor)
         cursor.close()
         
         return results
     
+    @staticmethod
+    def _fill_garment(row, garment):
+        """Fill the garment columns of a wardrobe row from an archived garment"""
+        for column, value in garment.items():
+            if column == 'archived_at':
+                continue
+            # Columns named like avatar_garments ones come back table-qualified
+            qualified = f'g.{column}'
+            if qualified in row:
+                row[qualified] = value
+            elif column not in _LINK_COLUMNS:
+                row[column] = value
+    
+    @staticmethod
+    def _record_change(cursor, avatar_id, garment_id, action):
+        """
+        Bump the avatar's wardrobe version and log the change, in the
+        writer's transaction. The version row stays locked until commit,
+        so versions are committed in order.
+        """
+        cursor.execute("""
+            INSERT INTO wardrobe_versions (avatar_id, version) VALUES (%s, LAST_INSERT_ID(1))
+            ON DUPLICATE KEY UPDATE version = LAST_INSERT_ID(version + 1)
+        """, (avatar_id,))
+        cursor.execute("""
+            INSERT INTO wardrobe_changes (avatar_id, version, garment_id, action)
+            VALUES (%s, LAST_INSERT_ID(), %s, %s)
+        """, (avatar_id, garment_id, action))
+    
+    def get_wardrobe_version(self, avatar_id):
+        """Current wardrobe version of an avatar (0 before its first change)"""
+        cursor = self.mysql.read_connection.cursor()
+        query = "SELECT version FROM wardrobe_versions WHERE avatar_id = %s"
+        cursor.execute(query, (avatar_id,))
+        result = cursor.fetchone()
+        cursor.close()
+        
+        return result['version'] if result else 0
+    
+    def get_wardrobe_changes(self, avatar_id, since_version):
+        """
+        Net wardrobe changes after ``since_version``.
+        
+        Returns a dict with the current ``version`` and either ``added`` /
+        ``removed`` garment ids plus the rows of the added garments, or
+        ``reset=True`` with the full wardrobe in ``garments`` when the
+        client cannot catch up from the log (no version yet, wardrobe
+        cleared, or a version this server never issued).
+        """
+        cursor = self.mysql.read_connection.cursor()
+        query = """
+            SELECT v.version AS current_version, c.version, c.garment_id, c.action
+            FROM wardrobe_versions v
+            LEFT JOIN wardrobe_changes c
+                ON c.avatar_id = v.avatar_id AND c.version > %s
+            WHERE v.avatar_id = %s
+            ORDER BY c.version
+        """
+        cursor.execute(query, (since_version, avatar_id))
+        results = cursor.fetchall()
+        cursor.close()
+        
+        version = results[0]['current_version'] if results else 0
+        changes = [row for row in results if row['version'] is not None]
+        
+        if (since_version <= 0 or since_version > version
+                or any(row['action'] == 'clear' for row in changes)):
+            return {
+                'version': version, 'reset': True, 'added': [], 'removed': [],
+                'garments': self.get_avatar_garments(avatar_id)
+            }
+        
+        # Adds and removes are only logged when they change the wardrobe, so
+        # a garment's first action tells whether the client had it and its
+        # last whether it is there now
+        first = {}
+        last = {}
+        for row in changes:
+            first.setdefault(row['garment_id'], row['action'])
+            last[row['garment_id']] = row['action']
+        added = [garment_id for garment_id, action in last.items()
+                 if action == 'add' and first[garment_id] == 'add']
+        removed = [garment_id for garment_id, action in last.items()
+                   if action == 'remove' and first[garment_id] == 'remove']
+        
+        return {
+            'version': version, 'reset': False,
+            'added': added, 'removed': removed,
+            'garments': self.get_avatar_garments(avatar_id, added) if added else ()
+        }
+    
     def clear_avatar_garments(self, avatar_id):
         """Remove all garments from avatar"""
         try:
             cursor = self.mysql.connection.cursor()
+            cursor.execute(
+                "SELECT garment_id FROM avatar_garments WHERE avatar_id = %s FOR UPDATE",
+                (avatar_id,)
+            )
+            garment_ids = tuple(row['garment_id'] for row in cursor.fetchall())
             query = "DELETE FROM avatar_garments WHERE avatar_id = %s"
             cursor.execute(query, (avatar_id,))
-            self.mysql.connection.commit()
+            if cursor.rowcount:
+                self._record_change(cursor, avatar_id, None, 'clear')
+            self.mysql.commit()
             cursor.close()
+            
+            self.mysql.after_commit(
+                wardrobe_changed.send, self, avatar_id=avatar_id, garment_id=None,
+                action='clear', garment_ids=garment_ids
+            )
             return True
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
\ No newline at end of file
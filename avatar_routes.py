@@ -7,18 +7,27 @@ from avatar_models import (
     AvatarRepository, BodyMeasurementRepository, 
     AvatarGarmentRepository
 )
+from garment_models import GarmentRepository
+from profile_documents import owner_profile, public_profile
+from totals import wants_total
 
 avatar_bp = Blueprint('avatar', __name__, url_prefix='/api/avatar')
 
 
-def init_avatar_routes(mysql):
-    """Initialize avatar routes with database connection"""
+def init_avatar_routes(mysql, response_cache, profile_documents=None, feeds=None,
+                       totals=None):
+    """
+    Initialize avatar routes with database connection, response cache,
+    profile documents, personalized feeds and listing totals
+    """
     avatar_repo = AvatarRepository(mysql)
     measurements_repo = BodyMeasurementRepository(mysql)
     garments_repo = AvatarGarmentRepository(mysql)
+    garment_repo = GarmentRepository(mysql)
     
     @avatar_bp.route('/setup', methods=['POST'])
     @jwt_required()
+    @mysql.transactional
     def setup_avatar():
         try:
             current_user_id = get_jwt_identity()
@@ -116,6 +125,12 @@ def init_avatar_routes(mysql):
             current_user_id = get_jwt_identity()
             current_user_id = int(current_user_id)
             
+            # Precomputed document, if fresh
+            if profile_documents is not None:
+                document = profile_documents.owner_document(current_user_id)
+                if document is not None:
+                    return document, 200
+            
             # Get avatar
             avatar = avatar_repo.get_avatar_by_user_id(current_user_id)
             
@@ -128,16 +143,8 @@ def init_avatar_routes(mysql):
             # Get garments
             garments = garments_repo.get_avatar_garments(avatar.id)
             
-            # Build response
-            avatar_response = avatar.to_dict()
-            
-            if measurements:
-                avatar_response['bodyMeasurements'] = measurements.to_dict()
-            
-            avatar_response['garments'] = garments
-            
             return jsonify({
-                'avatar': avatar_response
+                'avatar': owner_profile(avatar, measurements, garments)
             }), 200
             
         except Exception as e:
@@ -189,7 +196,7 @@ def init_avatar_routes(mysql):
                     update_data[backend_field] = data[frontend_field]
             
             # Update avatar
-            updated_avatar = avatar_repo.update_avatar(avatar.id, update_data)
+            updated_avatar = avatar_repo.update_avatar(avatar.id, update_data, current=avatar)
             
             return jsonify({
                 'message': 'Avatar updated successfully',
@@ -201,6 +208,7 @@ def init_avatar_routes(mysql):
     
     @avatar_bp.route('/measurements', methods=['PUT'])
     @jwt_required()
+    @mysql.transactional
     def update_measurements():
         try:
             current_user_id = get_jwt_identity()
@@ -233,7 +241,7 @@ def init_avatar_routes(mysql):
             if existing_measurements:
                 # Update existing measurements
                 updated_measurements = measurements_repo.update_measurements(
-                    avatar.id, measurements_data
+                    avatar.id, measurements_data, current=existing_measurements
                 )
             else:
                 # Create new measurements
@@ -275,6 +283,8 @@ def init_avatar_routes(mysql):
                 'message': 'Garment added to wardrobe successfully'
             }), 201
             
+        except LookupError:
+            return jsonify({'error': 'Garment not found'}), 404
         except Exception as e:
             return jsonify({'error': f'Failed to add garment: {str(e)}'}), 500
     
@@ -304,6 +314,14 @@ def init_avatar_routes(mysql):
     @avatar_bp.route('/garments', methods=['GET'])
     @jwt_required()
     def get_wardrobe():
+        """
+        Get the wardrobe
+        
+        Query params:
+        - since_version: wardrobe version the client already has; returns
+          only added/removed garment ids and the rows of added garments
+          (or the full wardrobe with reset=true when it cannot catch up)
+        """
         try:
             current_user_id = get_jwt_identity()
             current_user_id = int(current_user_id)
@@ -314,17 +332,85 @@ def init_avatar_routes(mysql):
             if not avatar:
                 return jsonify({'error': 'Avatar not found'}), 404
             
-            # Get garments
+            since_version = request.args.get('since_version', type=int)
+            
+            if since_version is not None:
+                # Delta sync: only what changed after the client's version
+                changes = garments_repo.get_wardrobe_changes(avatar.id, since_version)
+                return jsonify({
+                    'version': changes['version'],
+                    'sinceVersion': since_version,
+                    'reset': changes['reset'],
+                    'added': changes['added'],
+                    'removed': changes['removed'],
+                    'garments': changes['garments']
+                }), 200
+            
+            # Version first: a change racing with the read is then replayed
+            # by the next delta (adds and removes are idempotent)
+            version = garments_repo.get_wardrobe_version(avatar.id)
             garments = garments_repo.get_avatar_garments(avatar.id)
             
             return jsonify({
-                'garments': garments
+                'garments': garments,
+                'version': version
             }), 200
             
         except Exception as e:
             return jsonify({'error': f'Failed to get garments: {str(e)}'}), 500
     
+    @avatar_bp.route('/feed', methods=['GET'])
+    @jwt_required()
+    def get_feed():
+        """
+        Personalized "for you" garments, precomputed by `flask build-feeds`
+        
+        Until the avatar's first feed is built, popular garments are returned
+        with personalized=false.
+        
+        Query params:
+        - limit: Number of garments to return (default: 20, max: 100)
+        - offset: Offset for pagination (default: 0)
+        """
+        try:
+            current_user_id = get_jwt_identity()
+            current_user_id = int(current_user_id)
+            
+            limit = request.args.get('limit', 20, type=int)
+            offset = request.args.get('offset', 0, type=int)
+            
+            if limit > 100:
+                limit = 100
+            
+            stored = feeds.stored_feed(current_user_id) if feeds is not None else None
+            if stored is None and not avatar_repo.get_avatar_by_user_id(current_user_id):
+                return jsonify({'error': 'Avatar not found'}), 404
+            
+            if stored is not None and stored[1] is not None:
+                _, garment_ids, built_at = stored
+                garments = garment_repo.get_garments_ranked(garment_ids, limit, offset)
+                personalized = True
+            else:
+                built_at = None
+                garments = garment_repo.get_all_garments(limit, offset, sort='popular')
+                personalized = False
+            
+            garments_list = [garment.to_dict() for garment in garments]
+            
+            return jsonify({
+                'garments': garments_list,
+                'count': len(garments_list),
+                'limit': limit,
+                'offset': offset,
+                'personalized': personalized,
+                'builtAt': built_at.isoformat() if built_at else None
+            }), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get feed: {str(e)}'}), 500
+    
     @avatar_bp.route('/public', methods=['GET'])
+    @response_cache.cached(tags=('public_avatars',))
     def get_public_avatars():
         """
         Get public avatars
@@ -332,6 +418,8 @@ def init_avatar_routes(mysql):
         Query params:
         - limit: Number of avatars to return (default: 20, max: 100)
         - offset: Offset for pagination (default: 0)
+        - withTotal: true adds the number of public avatars as ``total``,
+          exact or estimated as ``totalExact`` says
         """
         try:
             limit = request.args.get('limit', 20, type=int)
@@ -346,12 +434,17 @@ def init_avatar_routes(mysql):
             
             avatars_list = [avatar.to_dict() for avatar in avatars]
             
-            return jsonify({
+            response = {
                 'avatars': avatars_list,
                 'count': len(avatars_list),
                 'limit': limit,
                 'offset': offset
-            }), 200
+            }
+            if wants_total() and totals is not None:
+                response['total'], response['totalExact'] = totals.public_avatars(
+                    len(avatars_list), limit, offset)
+            
+            return jsonify(response), 200
             
         except Exception as e:
             return jsonify({'error': f'Failed to get public avatars: {str(e)}'}), 500
@@ -364,6 +457,12 @@ def init_avatar_routes(mysql):
         Only returns avatar if it's public
         """
         try:
+            # Precomputed document, if fresh
+            if profile_documents is not None:
+                document = profile_documents.public_document(avatar_id)
+                if document is not None:
+                    return document, 200
+            
             avatar = avatar_repo.get_avatar_by_id(avatar_id)
             
             if not avatar:
@@ -375,13 +474,8 @@ def init_avatar_routes(mysql):
             # Get measurements if public
             measurements = measurements_repo.get_measurements_by_avatar_id(avatar.id)
             
-            avatar_response = avatar.to_dict()
-            
-            if measurements:
-                avatar_response['bodyMeasurements'] = measurements.to_dict()
-            
             return jsonify({
-                'avatar': avatar_response
+                'avatar': public_profile(avatar, measurements)
             }), 200
             
         except Exception as e:
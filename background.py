@@ -0,0 +1,122 @@
+"""
+Coalescing background work queue for derived data (rebuilds, flushes)
+
+Keys submitted while already pending are merged, so a burst of changes to
+the same entity costs one rebuild. The worker thread starts lazily in each
+process (it would not survive a prefork fork()) and runs its handler inside
+an application context, so repositories work as in a request.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingQueue:
+    """
+    Runs ``handler(keys)`` on a daemon thread for batches of pending keys.
+
+    ``delay`` holds each key back that many seconds after it was first
+    submitted, to merge bursts. Keys of a failing batch are retried after
+    ``retry_delay``, up to ``max_retries`` times.
+    """
+
+    def __init__(self, name, handler, app=None, batch_size=50, delay=0.0, retry_delay=1.0,
+                 max_retries=3):
+        self.name = name
+        self.handler = handler
+        self.app = app
+        self.batch_size = batch_size
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._attempts = {}
+        self._pending = OrderedDict()  # key -> monotonic time first submitted
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.processed = 0
+        self.failures = 0
+
+    def submit(self, key):
+        """Schedule ``key``; no-op if it is already pending"""
+        with self._cond:
+            if key not in self._pending:
+                self._pending[key] = time.monotonic()
+                self._cond.notify()
+        self._ensure_started()
+
+    def submit_many(self, keys):
+        now = time.monotonic()
+        with self._cond:
+            for key in keys:
+                self._pending.setdefault(key, now)
+            self._cond.notify()
+        self._ensure_started()
+
+    def stats(self):
+        with self._cond:
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                'depth': len(self._pending),
+                'oldest_seconds': round(time.monotonic() - oldest, 3) if oldest else 0.0,
+                'processed': self.processed,
+                'failures': self.failures
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    first_submitted = next(iter(self._pending.values()))
+                    wait = first_submitted + self.delay - time.monotonic()
+                    if wait <= 0:
+                        break
+                else:
+                    wait = None
+                self._cond.wait(wait)
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                key, _ = self._pending.popitem(last=False)
+                batch.append(key)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        self.handler(batch)
+                else:
+                    self.handler(batch)
+                self.processed += len(batch)
+                for key in batch:
+                    self._attempts.pop(key, None)
+            except Exception:
+                self.failures += 1
+                logger.exception('%s: batch of %d failed', self.name, len(batch))
+                retry = []
+                for key in batch:
+                    attempts = self._attempts.get(key, 0) + 1
+                    if attempts > self.max_retries:
+                        self._attempts.pop(key, None)
+                    else:
+                        self._attempts[key] = attempts
+                        retry.append(key)
+                time.sleep(self.retry_delay)
+                if retry:
+                    self.submit_many(retry)
@@ -0,0 +1,178 @@
+"""
+Batch route multiplexing several API calls into one HTTP round trip
+"""
+import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from werkzeug.test import EnvironBuilder
+
+batch_bp = Blueprint('batch', __name__, url_prefix='/api')
+
+# Headers of the batch request passed on to every sub-request (shared auth)
+SHARED_HEADERS = ('Authorization', 'Cookie', 'Accept-Language', 'User-Agent')
+SAFE_METHODS = ('GET', 'HEAD')
+# WSGI environ key marking a sub-request: a batch view reached through one
+# (whatever the path spelling) is rejected, so pool threads never wait on
+# the pool
+SUBREQUEST_KEY = 'app.batch_subrequest'
+
+
+def _dispatch(app, spec, base_url, environ_base, shared_headers):
+    """
+    Run one sub-request through the full WSGI stack, in-process; returns
+    its result and its Set-Cookie headers
+    """
+    headers = dict(shared_headers)
+    headers.update(spec.get('headers') or {})
+    builder = EnvironBuilder(
+        path=spec['path'],
+        base_url=base_url,
+        method=spec['method'],
+        headers=headers,
+        json=spec.get('body'),
+        environ_base=environ_base
+    )
+    try:
+        response = Response.from_app(app.wsgi_app, builder.get_environ())
+    finally:
+        builder.close()
+
+    if response.is_json:
+        body = response.get_json(silent=True)
+    else:
+        body = response.get_data(as_text=True)
+    result = {'id': spec.get('id'), 'status': response.status_code, 'body': body}
+    return result, response.headers.getlist('Set-Cookie')
+
+
+def _validate(spec):
+    if not isinstance(spec, dict):
+        return 'each request must be an object'
+    path = spec.get('path')
+    if not isinstance(path, str) or not path.startswith('/api/'):
+        return 'path must be an /api/ route'
+    # Compared as routed: percent-decoded, with dot segments and repeated
+    # slashes resolved
+    route = posixpath.normpath(unquote(path.split('?', 1)[0]))
+    if route.lstrip('/') == (batch_bp.url_prefix + '/batch').lstrip('/'):
+        return 'batch requests cannot be nested'
+    if spec.get('headers') is not None and not isinstance(spec['headers'], dict):
+        return 'headers must be an object'
+    return None
+
+
+def init_batch_routes(max_requests=20, max_workers=4):
+    """Initialize the batch route with its limits"""
+    executors = {}
+    executors_lock = threading.Lock()
+
+    def get_executor():
+        # One pool per process: threads do not survive a prefork fork
+        pid = os.getpid()
+        with executors_lock:
+            executor = executors.get(pid)
+            if executor is None:
+                executor = executors[pid] = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix='batch'
+                )
+            return executor
+
+    @batch_bp.route('/batch', methods=['POST'])
+    def batch():
+        """
+        Execute several API requests in one round trip
+
+        Body: {"requests": [{"id": "me", "method": "GET", "path": "/api/auth/me",
+               "body": {...}, "headers": {...}}, ...]}
+
+        Sub-requests run in-process with the Authorization header of the
+        batch request. Consecutive reads (GET/HEAD) run concurrently; any
+        other method runs alone, after everything before it and before
+        everything after it. Responses come back in request order. Cookies
+        set by a sub-request (e.g. the database sticky cookie) are set on
+        the batch response and sent with the sub-requests after it.
+        """
+        try:
+            if request.environ.get(SUBREQUEST_KEY):
+                return jsonify({'error': 'batch requests cannot be nested'}), 400
+
+            data = request.get_json(silent=True)
+            specs = data.get('requests') if isinstance(data, dict) else None
+
+            if not isinstance(specs, list) or not specs:
+                return jsonify({'error': 'requests must be a non-empty list'}), 400
+
+            if len(specs) > max_requests:
+                return jsonify({
+                    'error': f'At most {max_requests} requests per batch'
+                }), 400
+
+            app = current_app._get_current_object()
+            base_url = request.host_url
+            environ_base = {'REMOTE_ADDR': request.remote_addr, SUBREQUEST_KEY: True}
+            shared_headers = {name: request.headers[name] for name in SHARED_HEADERS
+                              if name in request.headers}
+
+            results = [None] * len(specs)
+            reads = []
+            set_cookies = []
+
+            def dispatch(spec, headers):
+                return _dispatch(app, spec, base_url, environ_base, headers)
+
+            def collect(index, dispatched):
+                results[index], cookies = dispatched
+                if cookies:
+                    set_cookies.extend(cookies)
+                    # Sent first, so they shadow the batch request's own
+                    pairs = [cookie.split(';', 1)[0] for cookie in cookies]
+                    if 'Cookie' in shared_headers:
+                        pairs.append(shared_headers['Cookie'])
+                    shared_headers['Cookie'] = '; '.join(pairs)
+
+            def flush_reads():
+                if not reads:
+                    return
+                # The first read runs on this thread while the pool runs the
+                # rest; reads of one group share the cookies set before it
+                headers = dict(shared_headers)
+                futures = [(index, get_executor().submit(dispatch, spec, headers))
+                           for index, spec in reads[1:]]
+                index, spec = reads[0]
+                collect(index, dispatch(spec, headers))
+                for index, future in futures:
+                    collect(index, future.result())
+                reads.clear()
+
+            for index, spec in enumerate(specs):
+                error = _validate(spec)
+                if error is not None:
+                    results[index] = {
+                        'id': spec.get('id') if isinstance(spec, dict) else None,
+                        'status': 400,
+                        'body': {'error': error}
+                    }
+                    continue
+                spec = dict(spec, method=str(spec.get('method', 'GET')).upper())
+                if spec['method'] in SAFE_METHODS:
+                    reads.append((index, spec))
+                    continue
+                # Writes are barriers: earlier reads finish first, later reads
+                # see the write
+                flush_reads()
+                collect(index, dispatch(spec, dict(shared_headers)))
+            flush_reads()
+
+            response = jsonify({'responses': results})
+            for cookie in set_cookies:
+                response.headers.add('Set-Cookie', cookie)
+            return response, 200
+
+        except Exception as e:
+            return jsonify({'error': f'Batch failed: {str(e)}'}), 500
+
+    return batch_bp
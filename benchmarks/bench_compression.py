@@ -0,0 +1,93 @@
+"""
+Bytes saved vs CPU cost of gzip/brotli on typical API payloads
+
+Payloads are built from the real models: a 100-item garment page with
+descriptions and a 40-item wardrobe as returned by get_avatar_garments.
+
+Usage: python benchmarks/bench_compression.py
+"""
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from garment_models import Garment  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BRANDS = ['Uniqlo', 'Zara', 'Nike', 'H&M', 'Adidas', 'Levi\'s', 'Mango', 'COS']
+CATEGORIES = ['tops', 'bottoms', 'outerwear', 'dresses', 'shoes']
+STYLES = ['casual', 'modern', 'classic', 'sporty']
+
+
+def garment_row(i):
+    created = datetime(2024, 1, 1) + timedelta(hours=i)
+    return {
+        'id': i,
+        'name': f'{STYLES[i % 4].title()} {CATEGORIES[i % 5][:-1].title()} #{i}',
+        'brand': BRANDS[i % len(BRANDS)],
+        'price': Decimal(f'{19 + i % 80}.99'),
+        'rating': Decimal(f'{3 + (i % 20) / 10:.2f}'),
+        'image_url': f'https://cdn.example.com/garments/{i}.jpg',
+        'description': 'Made from premium organic cotton with a relaxed fit, '
+                       f'reinforced seams and a soft brushed finish. Style {i}.',
+        'category': CATEGORIES[i % 5],
+        'style': STYLES[i % 4],
+        'available': 1,
+        'created_at': created,
+        'updated_at': created
+    }
+
+
+def payloads():
+    page = {
+        'garments': [Garment.from_dict(garment_row(i)).to_dict() for i in range(100)],
+        'count': 100, 'limit': 100, 'offset': 0
+    }
+    wardrobe = {'garments': [
+        dict(garment_row(i), avatar_id=7, garment_id=i) for i in range(40)
+    ]}
+    return {
+        'garment page (100)': json.dumps(page).encode(),
+        'wardrobe (40)': json.dumps(wardrobe, default=str).encode()
+    }
+
+
+def measure(fn, data, rounds=200):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        out = fn(data)
+    return out, (time.perf_counter() - started) / rounds
+
+
+def main():
+    codecs = [(f'gzip-{level}', lambda d, level=level: gzip.compress(d, level, mtime=0))
+              for level in (1, 5, 9)]
+    if brotli is not None:
+        codecs += [(f'br-{q}', lambda d, q=q: brotli.compress(d, quality=q))
+                   for q in (1, 4, 11)]
+    else:
+        print('brotli not installed; gzip only')
+
+    for name, data in payloads().items():
+        print(f'\n{name}: {len(data)} bytes uncompressed')
+        print(f'{"codec":<10} {"bytes":>8} {"saved":>7} {"us/resp":>9} {"MB/s":>8}')
+        for codec, fn in codecs:
+            rounds = 20 if codec == 'br-11' else 200
+            out, seconds = measure(fn, data, rounds)
+            saved = 1 - len(out) / len(data)
+            print(f'{codec:<10} {len(out):>8} {saved:>6.1%} {seconds * 1e6:>9.1f} '
+                  f'{len(data) / seconds / 1e6:>8.1f}')
+        print('cached hit: precompressed variant reused, 0 us compression per response')
+
+
+if __name__ == '__main__':
+    main()
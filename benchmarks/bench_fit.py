@@ -0,0 +1,108 @@
+"""
+Fit scoring of a 100k-garment category for one avatar
+
+Builds synthetic size charts (4 sizes per garment, random subsets of the
+dimensions), checks the vectorized scores against a plain-Python reference
+on a sample, then times FitEngine scoring and full ranking. Target: scoring
+100k garments under 50 ms.
+
+Usage: python benchmarks/bench_fit.py [garments]
+"""
+import math
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fit import DIMENSIONS, TOLERANCES, FitRanking, _Pack, body_profile  # noqa: E402
+
+# Typical adult range (cm/kg) per dimension, to draw size charts from
+RANGES = {'chest': (80, 120), 'waist': (60, 110), 'hips': (85, 125),
+          'shoulder_width': (38, 52), 'inseam': (70, 90), 'arm_length': (55, 68),
+          'neck_size': (34, 45), 'height': (150, 200), 'weight': (45, 110)}
+
+
+def size_charts(count, sizes=4, seed=7):
+    rng = random.Random(seed)
+    charts = []
+    for garment_id in range(1, count + 1):
+        dimensions = rng.sample(DIMENSIONS, rng.randint(2, 5))
+        low = np.full((len(DIMENSIONS), sizes), -np.inf, dtype=np.float32)
+        high = np.full((len(DIMENSIONS), sizes), np.inf, dtype=np.float32)
+        for dimension in dimensions:
+            index = DIMENSIONS.index(dimension)
+            start, end = RANGES[dimension]
+            step = (end - start) / (sizes + 1)
+            offset = rng.uniform(-step, step)
+            for size in range(sizes):
+                low[index, size] = start + offset + step * size
+                high[index, size] = start + offset + step * (size + 1.2)
+        charts.append((garment_id, tuple('XS S M L XL XXL'.split()[:sizes]), low, high))
+    return charts
+
+
+def reference_score(body, low, high):
+    """Plain-Python score of one garment (best size)"""
+    best = math.nan
+    for size in range(low.shape[1]):
+        distances = []
+        for index in range(len(DIMENSIONS)):
+            if math.isnan(body[index]) or (low[index, size] == -np.inf
+                                           and high[index, size] == np.inf):
+                continue
+            outside = max(low[index, size] - body[index], body[index] - high[index, size], 0)
+            distances.append((outside / TOLERANCES[index]) ** 2)
+        if distances:
+            score = math.exp(-0.5 * sum(distances) / len(distances))
+            best = score if math.isnan(best) else max(best, score)
+    return best
+
+
+def timeit(fn, rounds=30):
+    fn()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    charts = size_charts(count)
+    started = time.perf_counter()
+    pack = _Pack(charts)
+    print(f'{count} garments, {pack.low.shape[1]} sizes packed in '
+          f'{(time.perf_counter() - started) * 1e3:.0f} ms')
+
+    # Imperial avatar: converted to cm/kg by body_profile
+    avatar = SimpleNamespace(height=Decimal('68.90'), height_unit='in',
+                             weight=Decimal('150.00'), weight_unit='lbs')
+    measurements = SimpleNamespace(chest=38.5, waist=32, hips=39, shoulder_width=None,
+                                   inseam=31, arm_length=None, neck_size=15.5)
+    body = body_profile(avatar, measurements)
+
+    _, scores = pack.score(body)
+    for position in random.Random(1).sample(range(count), 200):
+        _, _, low, high = charts[position]
+        expected = reference_score(body, low, high)
+        actual = float(scores[position])
+        assert (math.isnan(expected) and math.isnan(actual)) or abs(expected - actual) < 1e-4, \
+            (position, expected, actual)
+
+    score = timeit(lambda: pack.score(body))
+    rank = timeit(lambda: FitRanking([(pack, *pack.score(body))]))
+    print(f'score {count} garments: {score * 1e3:6.1f} ms (target < 50 ms)')
+    print(f'score + rank:          {rank * 1e3:6.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Throughput of FastJSONProvider vs Flask's default provider on list payloads
+
+Checks that both produce identical bytes for each payload, then times a
+100-item garment page (to_dict output), a 100-row wardrobe join with raw
+Decimal/datetime values and 100 avatar profiles.
+
+Usage: python benchmarks/bench_json.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from avatar_models import Avatar  # noqa: E402
+from bench_compression import garment_row  # noqa: E402
+from garment_models import Garment  # noqa: E402
+from json_provider import FastJSONProvider, orjson  # noqa: E402
+
+
+def avatar_row(i):
+    created = datetime(2024, 3, 1) + timedelta(minutes=i)
+    return {
+        'id': i, 'user_id': i, 'full_name': f'Zoë Müller {i}', 'bio': 'Loves 👗 and 🧥',
+        'age': 20 + i % 40, 'height': Decimal('172.50'), 'height_unit': 'cm',
+        'weight': Decimal('64.20'), 'weight_unit': 'kg', 'avatar_type': 'generic',
+        'generic_avatar_style': 'modern', 'biometric_verified': 0,
+        'measurement_mode': 'manual', 'auto_estimated': 0, 'share_with_world': 1,
+        'create_assistant': 0, 'create_greeting_cards': 0, 'public_profile': 1,
+        'allow_connections': 1, 'selected_greeting_template': None,
+        'created_at': created, 'updated_at': created
+    }
+
+
+def payloads():
+    return {
+        'garment page (100, to_dict)': {
+            'garments': [Garment.from_dict(garment_row(i)).to_dict() for i in range(100)],
+            'count': 100, 'limit': 100, 'offset': 0
+        },
+        'wardrobe join (100, raw rows)': {
+            'garments': [dict(garment_row(i), avatar_id=7, garment_id=i) for i in range(100)]
+        },
+        'public avatars (100)': {
+            'avatars': [Avatar.from_dict(avatar_row(i)).to_dict() for i in range(100)],
+            'count': 100
+        }
+    }
+
+
+def timeit(fn, rounds=300):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds
+
+
+def main():
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    print(f"orjson {'available' if orjson else 'not installed (stdlib fallback)'}")
+
+    with app.app_context():
+        for name, payload in payloads().items():
+            expected = default.response(payload).get_data()
+            actual = fast.response(payload).get_data()
+            assert actual == expected, f'{name}: output differs from the default provider'
+
+            base = timeit(lambda: default.response(payload))
+            new = timeit(lambda: fast.response(payload))
+            print(f'{name:<30} {len(expected):>7} B  default {base * 1e6:8.1f} us  '
+                  f'fast {new * 1e6:8.1f} us  x{base / new:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Throughput of the prefork launcher: threads against processes
+
+Serves a CPU-bound WSGI app through PreforkServer and drives it from a pool
+of client processes using keep-alive connections. Each request builds a
+listing page the way the garment routes do (Garment.from_dict, to_dict and
+JSON encoding of 50 rows), pure-Python work that holds the GIL. For 1, 2,
+4 ... N it compares one worker with N threads against N single-threaded
+workers: threads share one GIL, so only processes should scale, and only
+with as many cores. Run it under taskset to compare core counts, e.g.
+``taskset -c 0-3 python benchmarks/bench_prefork.py`` for four.
+
+Usage: python benchmarks/bench_prefork.py [--max-workers N] [--seconds S]
+"""
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from decimal import Decimal  # noqa: E402
+
+from garment_models import Garment  # noqa: E402
+from prefork import PreforkServer  # noqa: E402
+
+ROWS = [{
+    'id': i, 'name': f'Garment {i}', 'brand': f'Brand {i % 40}',
+    'price': Decimal(f'{10 + i % 90}.99'), 'rating': Decimal('4.25'),
+    'image_url': f'https://img.example.com/{i}.jpg', 'description': 'Cotton, regular fit ' * 4,
+    'category': 'tops', 'style': 'casual', 'available': 1, 'wardrobe_count': i * 3,
+    'created_at': datetime.datetime(2024, 1, 1), 'updated_at': datetime.datetime(2024, 6, 1)
+} for i in range(50)]
+
+
+def cpu_app(environ, start_response):
+    """WSGI app doing a fixed amount of GIL-bound work per request"""
+    for _ in range(10):
+        garments = [Garment.from_dict(row).to_dict() for row in ROWS]
+        body = json.dumps({'garments': garments, 'count': len(garments)}).encode()
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _client(port, seconds, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.request('GET', '/')
+        conn.getresponse().read()
+        done += 1
+    results.put(done)
+
+
+def _wait_for(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server did not start')
+
+
+def run(workers, threads, clients, seconds):
+    port = _free_port()
+    server = PreforkServer('bench_prefork:cpu_app', host='127.0.0.1', port=port,
+                           workers=workers, threads=threads, graceful_timeout=5)
+    master = multiprocessing.Process(target=server.run)
+    master.start()
+    try:
+        _wait_for(port)
+        time.sleep(0.5)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_client, args=(port, seconds, results))
+                 for _ in range(clients)]
+        for proc in procs:
+            proc.start()
+        total = sum(results.get() for _ in procs)
+        for proc in procs:
+            proc.join()
+        return total / seconds
+    finally:
+        os.kill(master.pid, signal.SIGTERM)
+        master.join()
+
+
+def main():
+    # Cores this process may run on (taskset), not the machine's
+    cores = len(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--max-workers', type=int, default=cores)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    clients = max(4, args.max_workers * 2)
+    print(f"cores={cores} clients={clients} duration={args.seconds}s")
+    baseline = None
+    count = 1
+    while count <= args.max_workers:
+        threaded = run(1, count, clients, args.seconds)
+        forked = run(count, 1, clients, args.seconds)
+        baseline = baseline or threaded
+        print(f"n={count:<3} 1 worker x {count} threads {threaded:9.1f} req/s  "
+              f"x{threaded / baseline:.2f}   {count} workers x 1 thread {forked:9.1f} req/s  "
+              f"x{forked / baseline:.2f}")
+        count *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Typeahead lookups over a 100k-garment catalog
+
+Builds synthetic garment names (3-5 words from a fashion vocabulary, 400
+brands, 40 categories), checks the index's completions against a brute-force
+scan on a sample of prefixes, then times lookups by prefix length, an
+incremental update of 50 garments (checked against a rebuild) and the
+index's memory. Target: lookups
+well under 1 ms.
+
+Usage: python benchmarks/bench_suggest.py [garments]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from suggest import MAX_LIMIT, _Index, garment_weight, normalize  # noqa: E402
+
+ADJECTIVES = ('slim relaxed classic cropped oversized vintage linen cotton wool denim '
+              'leather striped floral pleated ribbed quilted padded tailored wide '
+              'stretch organic merino cashmere satin silk suede').split()
+ITEMS = ('jeans shirt tee blouse jacket coat blazer dress skirt shorts trousers '
+         'chinos sweater cardigan hoodie parka vest jumpsuit sneakers boots loafers '
+         'sandals scarf belt').split()
+COLOURS = 'black white navy beige olive grey red blue green pink ecru camel'.split()
+
+
+def catalog(count, seed=7):
+    rng = random.Random(seed)
+    brands = [f'{rng.choice(ADJECTIVES).title()} {rng.choice("&+ ")} Co {i}' for i in range(400)]
+    categories = [f'{item} {i}' for i, item in enumerate(ITEMS * 2)][:40]
+    garments = {}
+    for garment_id in range(1, count + 1):
+        words = rng.sample(ADJECTIVES, rng.randint(1, 3)) + [rng.choice(COLOURS), rng.choice(ITEMS)]
+        weight = garment_weight(round(rng.uniform(1, 5), 2), int(rng.paretovariate(1.2)) - 1)
+        garments[garment_id] = (' '.join(words).title(), rng.choice(brands),
+                                rng.choice(categories), weight)
+    return garments
+
+
+def brute_force(index, prefix, limit):
+    """Best terms with ``prefix`` at one of their first words, by a full scan"""
+    matches = []
+    for term, (weight, kind, text, garment_id, brand) in index.terms.items():
+        if any(key.startswith(prefix) for key in index._keys(text)):
+            matches.append((-weight, text, term, (kind, text, garment_id, brand)))
+    return [match[3] for match in sorted(matches)[:limit]]
+
+
+def timeit(fn, rounds=30):
+    fn()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    garments = catalog(count)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = _Index(24, 3, 256)
+    index.load(garments)
+    built = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{count} garments: {len(index.terms)} terms, {len(index.keys)} keys, '
+          f'{len(index.ranked)} ranked prefixes built in {built:.1f} s, '
+          f'{memory / 2 ** 20:.0f} MiB')
+
+    rng = random.Random(1)
+    samples = [normalize(entry[2]) for entry in rng.sample(list(index.terms.values()), 50)]
+    prefixes = {length: [sample[:length] for sample in samples] for length in (1, 2, 3, 5, 8)}
+    for group in prefixes.values():
+        for prefix in group[:3]:
+            assert index.suggest(prefix, 10) == brute_force(index, prefix, 10), prefix
+
+    for length, group in prefixes.items():
+        lookup = timeit(lambda: [index.suggest(prefix, MAX_LIMIT) for prefix in group])
+        print(f'prefix of {length} characters: {lookup / len(group) * 1e6:6.1f} us per lookup '
+              f'(target < 1000 us)')
+
+    changed = {garment_id: (f'Renamed Garment {garment_id}', *garments[garment_id][1:])
+               for garment_id in rng.sample(range(1, count + 1), 50)}
+    started = time.perf_counter()
+    updated = index.update(changed)
+    print(f'update of {len(changed)} garments: {(time.perf_counter() - started) * 1e3:.0f} ms')
+    assert updated.suggest('renamed garm', 1)[0][1].startswith('Renamed Garment')
+
+    # The spliced index ranks as a fresh build of the same garments
+    rebuilt = _Index(24, 3, 256)
+    rebuilt.load({**garments, **changed})
+    assert updated.keys == rebuilt.keys and updated.ranked == rebuilt.ranked
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+gzip/brotli response compression for /api/* with precompressed cache entries
+
+Responses are compressed in ``after_request`` when the client accepts it and
+the body is large enough to be worth the CPU. For views cached by
+``ResponseCache`` the compressed variant is produced once and stored on the
+cache entry, so repeated hits send precompressed bytes.
+
+Brotli is used when the optional ``brotli`` package is installed.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+from flask import request
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/css',
+                          'application/javascript')
+
+
+def parse_accept_encoding(header):
+    """Map of accepted encodings to their q-value (``identity`` excluded)"""
+    accepted = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class Compression:
+    """Flask extension negotiating and applying Content-Encoding"""
+
+    def __init__(self, app=None, response_cache=None):
+        self.enabled = True
+        self.min_size = 1024
+        self.gzip_level = 5
+        self.brotli_quality = 4
+        self.path_prefix = '/api/'
+        if app is not None:
+            self.init_app(app, response_cache)
+
+    def init_app(self, app, response_cache=None):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        # Mid levels: most of the size win for a fraction of max-level CPU
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 5)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+        app.extensions['compression'] = self
+        if not self.enabled:
+            return
+
+        app.after_request(self._after_request)
+        if response_cache is not None:
+            response_cache.compressor = self
+
+    @property
+    def encodings(self):
+        """Supported encodings in order of preference"""
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def negotiate(self):
+        """Best encoding accepted by the current request, or None"""
+        if not self.enabled or not request.path.startswith(self.path_prefix):
+            return None
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding'))
+        wildcard = accepted.get('*', 0)
+        best, best_q = None, 0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def is_compressible(self, response):
+        return (
+            response.status_code == 200
+            and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+        )
+
+    def apply(self, response, encoding, body=None):
+        """Set an already-compressed ``body`` (or compress it now) on ``response``"""
+        if body is None:
+            body = self.compress(response.get_data(), encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _after_request(self, response):
+        if not request.path.startswith(self.path_prefix) or not self.is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        return self.apply(response, encoding)
@@ -0,0 +1,615 @@
+"""
+Bounded MySQL connection pool used behind the repositories
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import current_app, g, has_app_context, has_request_context, request
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out before the timeout"""
+
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper reporting every statement to the query listeners.
+
+    Listeners are called as ``listener(statement, params, elapsed, rowcount,
+    connection)`` after each ``execute``/``executemany``.
+    """
+
+    def __init__(self, cursor, connection, listeners):
+        self._cursor = cursor
+        self._connection = connection
+        self._listeners = listeners
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _notify(self, statement, params, started):
+        elapsed = time.perf_counter() - started
+        rowcount = self._cursor.rowcount
+        for listener in self._listeners:
+            listener(statement, params, elapsed, rowcount, self._connection)
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            self._notify(query, args, started)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            self._notify(query, args, started)
+
+
+class PooledConnection:
+    """Thin wrapper around a MySQLdb connection that tracks pool metadata"""
+
+    # Seconds between reads of the server clock by ``current_timestamp``
+    clock_resync = 300
+
+    def __init__(self, raw, listeners=()):
+        self.raw = raw
+        self.listeners = listeners
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self._clock = None      # (server time, monotonic time it was read at)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        """Open a cursor, instrumented when query listeners are registered"""
+        cursor = self.raw.cursor(*args, **kwargs)
+        if self.listeners:
+            return InstrumentedCursor(cursor, self, self.listeners)
+        return cursor
+
+    def current_timestamp(self):
+        """
+        Now on the server clock, in the session time zone, at the (second)
+        precision of our TIMESTAMP columns. The server's time is read at
+        most every ``clock_resync`` seconds and advanced with the local
+        monotonic clock in between, so writes stamp rows without a round
+        trip of their own.
+        """
+        now = time.monotonic()
+        if self._clock is None or now - self._clock[1] > self.clock_resync:
+            cursor = self.cursor()
+            cursor.execute("SELECT CURRENT_TIMESTAMP(6) AS db_now")
+            self._clock = (cursor.fetchone()['db_now'], now)
+            cursor.close()
+        server_time, read_at = self._clock
+        return (server_time + timedelta(seconds=now - read_at)).replace(microsecond=0)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+
+    Keeps up to ``max_size`` connections open and allows ``max_overflow``
+    extra connections under bursts; overflow connections are closed when
+    returned. Idle connections are pinged before reuse once they have been
+    idle longer than ``validate_after`` seconds, and connections older than
+    ``recycle`` seconds are replaced. Connections are opened lazily so the
+    pool can be created before the server forks.
+    """
+
+    def __init__(self, connect_kwargs, min_size=1, max_size=4, max_overflow=0,
+                 timeout=10.0, recycle=3600, validate_after=30.0, listeners=None):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.connect_kwargs = dict(connect_kwargs)
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.validate_after = validate_after
+        self.listeners = listeners if listeners is not None else []
+
+        self._cond = threading.Condition(threading.Lock())
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._warmed = False
+        self._checkouts = 0
+        self._timeouts = 0
+        self._connects = 0
+        self._recycled = 0
+        self._invalidated = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def _check_pid(self):
+        # Connections inherited across fork() share sockets with the parent;
+        # drop them without closing so the parent's sessions stay intact.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _connect(self):
+        raw = MySQLdb.connect(**self.connect_kwargs)
+        with self._cond:
+            self._connects += 1
+        return PooledConnection(raw, self.listeners)
+
+    def _close(self, conn):
+        try:
+            conn.raw.close()
+        except Exception:
+            pass
+
+    def _warm_up(self):
+        """Open ``min_size`` connections the first time the pool is used"""
+        opened = []
+        try:
+            with self._cond:
+                missing = self.min_size - self._size
+                self._size += max(missing, 0)
+            for _ in range(max(missing, 0)):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= max(missing, 0) - len(opened)
+                self._idle.extend(opened)
+                self._cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """Check out a connection, waiting up to ``timeout`` seconds"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        deadline = started + timeout
+
+        with self._cond:
+            self._check_pid()
+            warm_up = not self._warmed
+            self._warmed = True
+        if warm_up:
+            self._warm_up()
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size + self.max_overflow:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f'Timed out after {timeout}s waiting for a database connection'
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            conn = self._prepare(conn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            if elapsed > self._checkout_time_max:
+                self._checkout_time_max = elapsed
+        return conn
+
+    def _prepare(self, conn):
+        """Return a usable connection, replacing stale or broken ones"""
+        if conn is None:
+            return self._connect()
+
+        now = time.monotonic()
+        if self.recycle and now - conn.created_at > self.recycle:
+            self._close(conn)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
+
+        if now - conn.last_used > self.validate_after:
+            try:
+                conn.raw.ping()
+            except Exception:
+                self._close(conn)
+                with self._cond:
+                    self._invalidated += 1
+                return self._connect()
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool"""
+        if not discard:
+            try:
+                # End the implicit transaction so the next borrower doesn't
+                # inherit a stale REPEATABLE READ snapshot or open locks.
+                conn.raw.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            if discard or self._size > self.max_size:
+                self._size -= 1
+                if discard:
+                    self._invalidated += 1
+                close = True
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                close = False
+            self._cond.notify()
+
+        if close:
+            self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._warmed = False
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of pool counters"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+                'checkouts': checkouts,
+                'timeouts': self._timeouts,
+                'connects': self._connects,
+                'recycled': self._recycled,
+                'invalidated': self._invalidated,
+                'checkout_ms_avg': round(
+                    self._checkout_time_total / checkouts * 1000, 3
+                ) if checkouts else 0.0,
+                'checkout_ms_max': round(self._checkout_time_max * 1000, 3)
+            }
+
+
+class _Scope:
+    """One level of a unit of work: the transaction itself or a savepoint"""
+    __slots__ = ('savepoint', 'callbacks', 'rollback_only')
+
+    def __init__(self, savepoint=None):
+        self.savepoint = savepoint
+        self.callbacks = []
+        self.rollback_only = False
+
+    def set_rollback_only(self):
+        """Roll this scope back on exit even if no exception is raised"""
+        self.rollback_only = True
+
+
+class PooledMySQL:
+    """
+    Flask extension exposing pooled connections to the repositories.
+
+    Drop-in replacement for ``flask_mysqldb.MySQL``: ``mysql.connection``
+    checks out one primary connection per application context and returns
+    it at teardown. Read-only repository methods use
+    ``mysql.read_connection`` instead, which is served by a replica when
+    ``MYSQL_REPLICA_HOSTS`` is configured. Once a context has touched the
+    primary, and for ``MYSQL_STICKY_SECONDS`` after a client's last write,
+    reads stay on the primary so clients always see their own writes.
+
+    A write pins the client's keys in this process and sets the
+    ``MYSQL_STICKY_COOKIE`` cookie to the end of the window, so its next
+    requests stay on the primary on any worker or instance. Clients that
+    drop cookies are only pinned on the worker that served the write.
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        self.replicas = None
+        self.query_listeners = []
+        self.stickiness = None
+        self.sticky_cookie = None
+        self._sticky_key_callback = self._default_sticky_key
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the pools from the application config"""
+        # Imported here to avoid a circular import (db_routing builds pools)
+        from db_routing import ReplicaSet, StickinessTracker, parse_replica_hosts
+
+        cursorclass = app.config.get('MYSQL_CURSORCLASS')
+        connect_kwargs = {
+            'host': app.config.get('MYSQL_HOST', 'localhost'),
+            'user': app.config.get('MYSQL_USER', 'root'),
+            'passwd': app.config.get('MYSQL_PASSWORD', ''),
+            'db': app.config.get('MYSQL_DB'),
+            'port': app.config.get('MYSQL_PORT', 3306),
+            'charset': app.config.get('MYSQL_CHARSET', 'utf8mb4'),
+            'connect_timeout': app.config.get('MYSQL_CONNECT_TIMEOUT', 10)
+        }
+        if cursorclass:
+            connect_kwargs['cursorclass'] = getattr(MySQLdb.cursors, cursorclass)
+
+        pool_kwargs = {
+            'min_size': app.config.get('MYSQL_POOL_MIN_SIZE', 1),
+            'max_size': app.config.get('MYSQL_POOL_MAX_SIZE', 4),
+            'max_overflow': app.config.get('MYSQL_POOL_MAX_OVERFLOW', 0),
+            'timeout': app.config.get('MYSQL_POOL_TIMEOUT', 10.0),
+            'recycle': app.config.get('MYSQL_POOL_RECYCLE', 3600),
+            'validate_after': app.config.get('MYSQL_POOL_VALIDATE_AFTER', 30.0),
+            'listeners': self.query_listeners
+        }
+        self.pool = ConnectionPool(connect_kwargs, **pool_kwargs)
+
+        replica_hosts = parse_replica_hosts(
+            app.config.get('MYSQL_REPLICA_HOSTS'),
+            default_port=connect_kwargs['port']
+        )
+        self.replicas = ReplicaSet.from_hosts(replica_hosts, connect_kwargs, **pool_kwargs)
+        self.replica_timeout = app.config.get('MYSQL_REPLICA_CHECKOUT_TIMEOUT', 1.0)
+        self.stickiness = StickinessTracker(
+            window=app.config.get('MYSQL_STICKY_SECONDS', 5.0)
+        )
+        self.sticky_cookie = app.config.get('MYSQL_STICKY_COOKIE', 'db_sticky_until')
+
+        app.extensions['mysql'] = self
+        app.after_request(self._set_sticky_cookie)
+        app.teardown_request(self._pin_writer)
+        app.teardown_appcontext(self.teardown)
+
+    def add_query_listener(self, listener):
+        """
+        Register a callable invoked after every statement on any pool, as
+        ``listener(statement, params, elapsed, rowcount, connection)``.
+        """
+        self.query_listeners.append(listener)
+
+    def pools(self):
+        """Primary pool followed by the replica pools"""
+        return [self.pool] + list(self.replicas.pools)
+
+    def sticky_key_loader(self, callback):
+        """
+        Register the function identifying a client for read-your-writes
+        stickiness. It is called inside a request and should return a
+        hashable key, a tuple of keys (a write pins them all, a read is
+        pinned if any is), or None for clients that cannot be identified.
+        """
+        self._sticky_key_callback = callback
+        return callback
+
+    @staticmethod
+    def _default_sticky_key():
+        # Without a loader the sticky cookie alone pins the client
+        return None
+
+    def _sticky_keys(self):
+        try:
+            keys = self._sticky_key_callback()
+        except Exception:
+            return ()
+        if keys is None:
+            return ()
+        return keys if isinstance(keys, tuple) else (keys,)
+
+    def _client_pinned(self):
+        """True if the client wrote within the stickiness window, here or elsewhere"""
+        if any(self.stickiness.is_pinned(key) for key in self._sticky_keys()):
+            return True
+        if not self.sticky_cookie or not has_request_context():
+            return False
+        try:
+            until = float(request.cookies.get(self.sticky_cookie, ''))
+        except ValueError:
+            return False
+        now = time.time()
+        # A client cannot stretch its pin beyond one window
+        return now < until <= now + self.stickiness.window
+
+    def reads_pinned_to_primary(self):
+        """True if reads in this context must see the client's own writes"""
+        if not has_app_context():
+            return False
+        if '_mysql_conn' in g:
+            return True
+        return bool(self.replicas) and self._client_pinned()
+
+    def _primary(self):
+        conn = g.get('_mysql_conn')
+        if conn is None:
+            conn = self.pool.acquire()
+            g._mysql_conn = conn
+        return conn
+
+    @property
+    def connection(self):
+        """Primary connection bound to the current application context"""
+        if not has_app_context():
+            return None
+        g._mysql_wrote = True
+        return self._primary()
+
+    @property
+    def read_connection(self):
+        """Connection for read-only queries (replica unless pinned to primary)"""
+        if not has_app_context():
+            return None
+        if not self.replicas or '_mysql_conn' in g:
+            return self._primary()
+
+        conn = g.get('_mysql_read_conn')
+        if conn is not None:
+            return conn
+
+        if self._client_pinned():
+            return self._primary()
+
+        pool, conn = self.replicas.acquire(self.replica_timeout)
+        if conn is None:
+            return self._primary()
+        g._mysql_read_conn = conn
+        g._mysql_read_pool = pool
+        return conn
+
+    # -- unit of work -------------------------------------------------------
+
+    def in_transaction(self):
+        """True while a ``transaction()`` scope is open in this context"""
+        return has_app_context() and bool(g.get('_mysql_tx'))
+
+    def commit(self):
+        """
+        Commit the primary connection, unless a unit of work is open: then
+        the outermost ``transaction()`` commits once at its boundary.
+        """
+        if not self.in_transaction():
+            self.connection.commit()
+
+    def rollback(self):
+        """Roll back the primary connection (left to the boundary inside a unit of work)"""
+        if not self.in_transaction():
+            self.connection.rollback()
+
+    def after_commit(self, callback, *args, **kwargs):
+        """
+        Run ``callback(*args, **kwargs)`` once the current writes are
+        committed: immediately outside a unit of work, otherwise after the
+        outermost commit. Callbacks of rolled back scopes are dropped.
+        """
+        if not self.in_transaction():
+            return callback(*args, **kwargs)
+        g._mysql_tx[-1].callbacks.append((callback, args, kwargs))
+        return None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work on the primary connection.
+
+        Repository writes inside the block join it instead of committing on
+        their own; the block commits once when it exits and rolls back if it
+        raises. Nested blocks use savepoints, so an inner failure only
+        undoes the inner block's writes.
+        """
+        conn = self.connection
+        stack = g.setdefault('_mysql_tx', [])
+        scope = _Scope(f'uow_{len(stack)}' if stack else None)
+        if scope.savepoint:
+            self._execute(conn, f'SAVEPOINT {scope.savepoint}')
+        stack.append(scope)
+        try:
+            yield scope
+        except BaseException:
+            stack.pop()
+            self._end_scope(conn, scope, commit=False)
+            raise
+        stack.pop()
+        self._end_scope(conn, scope, commit=not scope.rollback_only)
+
+    def transactional(self, view):
+        """
+        View decorator running the whole request as one unit of work.
+
+        Views report failures as error responses rather than exceptions, so
+        any response with a status of 400 or above is rolled back too.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with self.transaction() as scope:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code >= 400:
+                    scope.set_rollback_only()
+            return response
+        return wrapper
+
+    @staticmethod
+    def _execute(conn, statement):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    def _end_scope(self, conn, scope, commit):
+        if scope.savepoint:
+            if commit:
+                self._execute(conn, f'RELEASE SAVEPOINT {scope.savepoint}')
+                g._mysql_tx[-1].callbacks.extend(scope.callbacks)
+            else:
+                self._execute(conn, f'ROLLBACK TO SAVEPOINT {scope.savepoint}')
+            return
+        if not commit:
+            conn.rollback()
+            return
+        conn.commit()
+        for callback, args, kwargs in scope.callbacks:
+            callback(*args, **kwargs)
+
+    def _set_sticky_cookie(self, response):
+        window = self.stickiness.window
+        if g.get('_mysql_wrote') and self.replicas and self.sticky_cookie and window > 0:
+            response.set_cookie(
+                self.sticky_cookie, f'{time.time() + window:.3f}', max_age=math.ceil(window),
+                httponly=True, samesite='Lax', secure=request.is_secure
+            )
+        return response
+
+    def _pin_writer(self, exception):
+        # Runs while the request is still available to identify the client
+        if g.pop('_mysql_wrote', False) and self.replicas:
+            for key in self._sticky_keys():
+                self.stickiness.pin(key)
+
+    def teardown(self, exception):
+        """Return the context's connections to their pools"""
+        conn = g.pop('_mysql_conn', None)
+        if conn is not None:
+            self.pool.release(conn)
+
+        read_conn = g.pop('_mysql_read_conn', None)
+        read_pool = g.pop('_mysql_read_pool', None)
+        if read_conn is not None:
+            read_pool.release(read_conn)
@@ -0,0 +1,109 @@
+"""
+Read-replica routing helpers: replica selection and read-your-writes stickiness
+"""
+import itertools
+import threading
+import time
+
+from db_pool import ConnectionPool
+
+
+def parse_replica_hosts(value, default_port=3306):
+    """Parse ``"host1:3307,host2"`` into ``[('host1', 3307), ('host2', 3306)]``"""
+    replicas = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(':')
+        replicas.append((host, int(port) if port else default_port))
+    return replicas
+
+
+class StickinessTracker:
+    """
+    Remembers which clients wrote recently so their reads go to the primary.
+
+    Keys expire ``window`` seconds after the last write; the window only
+    needs to cover replication lag. State is process-local: other workers
+    and instances only see the pin through the cookie PooledMySQL sets on
+    the write's response.
+    """
+
+    def __init__(self, window=5.0, max_entries=100000):
+        self.window = window
+        self.max_entries = max_entries
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    def pin(self, key):
+        """Route ``key`` to the primary for the next ``window`` seconds"""
+        if key is None or self.window <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._pins) >= self.max_entries:
+                self._prune(now)
+            self._pins[key] = now + self.window
+
+    def is_pinned(self, key):
+        """True if ``key`` wrote within the stickiness window"""
+        if key is None:
+            return False
+        expires = self._pins.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            with self._lock:
+                if self._pins.get(key) == expires:
+                    del self._pins[key]
+            return False
+        return True
+
+    def _prune(self, now):
+        expired = [key for key, expires in self._pins.items() if expires < now]
+        for key in expired:
+            del self._pins[key]
+        if len(self._pins) >= self.max_entries:
+            self._pins.clear()
+
+    def __len__(self):
+        return len(self._pins)
+
+
+class ReplicaSet:
+    """Round-robin selection over a group of replica connection pools"""
+
+    def __init__(self, pools):
+        self.pools = list(pools)
+        self._cycle = itertools.cycle(range(len(self.pools))) if self.pools else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_hosts(cls, hosts, connect_kwargs, **pool_kwargs):
+        """Build one pool per ``(host, port)`` sharing the primary's credentials"""
+        pools = []
+        for host, port in hosts:
+            kwargs = dict(connect_kwargs, host=host, port=port)
+            pools.append(ConnectionPool(kwargs, **pool_kwargs))
+        return cls(pools)
+
+    def __bool__(self):
+        return bool(self.pools)
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection from the next healthy replica.
+
+        Returns ``(pool, connection)``, or ``(None, None)`` if every replica
+        failed so the caller can fall back to the primary.
+        """
+        for _ in range(len(self.pools)):
+            with self._lock:
+                pool = self.pools[next(self._cycle)]
+            try:
+                return pool, pool.acquire(timeout)
+            except Exception:
+                # Unreachable or saturated replica: try the next one
+                continue
+        return None, None
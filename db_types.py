@@ -0,0 +1,57 @@
+"""
+Helpers to build models from the values a write sent to MySQL
+
+Write paths return the object they wrote instead of selecting it back, so
+the values are first normalized to what the driver would return for the
+column (DECIMAL -> Decimal at the column scale, BOOLEAN -> 0/1) and the
+same normalized values are written. Timestamps come from the database
+clock, read in the writer's transaction, so they order with the ones MySQL
+fills in itself whatever the app hosts' clocks and time zones.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+# MySQL error code for a UNIQUE/PRIMARY KEY violation (ER_DUP_ENTRY)
+DUP_ENTRY = 1062
+
+
+# Select-list item reading the database clock along with a statement's rows
+DB_NOW = 'CURRENT_TIMESTAMP AS db_now'
+
+
+def current_timestamp(connection):
+    """
+    Now on the database clock, at the (second) precision of our TIMESTAMP
+    columns. The pooled connection keeps the server clock and only reads it
+    every few minutes, so this normally costs no round trip; statements that
+    already select a row add DB_NOW instead.
+    """
+    return connection.current_timestamp()
+
+
+def as_decimal(value, places=2):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def as_boolean(value):
+    if value is None:
+        return None
+    return int(bool(value))
+
+
+def as_stored(row, decimals=(), booleans=()):
+    """Copy of ``row`` with DECIMAL and BOOLEAN columns normalized"""
+    stored = dict(row)
+    for field in decimals:
+        if field in stored:
+            stored[field] = as_decimal(stored[field])
+    for field in booleans:
+        if field in stored:
+            stored[field] = as_boolean(stored[field])
+    return stored
+
+
+def is_duplicate_key(error):
+    """True if a driver IntegrityError was raised by a unique constraint"""
+    return bool(error.args) and error.args[0] == DUP_ENTRY
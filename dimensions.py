@@ -0,0 +1,211 @@
+"""
+Dictionary-encoded garment dimensions (brand, category, style)
+
+``garments`` stores ``brand_id``, ``category_id`` and ``style_id`` keys into
+the small ``brands``, ``categories`` and ``styles`` tables. Each process
+keeps a name <-> id dictionary of every table: filters translate names to
+ids before querying, and garment rows get their names back from memory, so
+the API keeps returning ``brand``, ``category`` and ``style`` strings.
+
+Names are only ever added, so a dictionary is loaded in full on first use
+and then grows: an id it has not seen (added by another process) reloads
+its table, and a name it does not know is looked up by a primary/unique key
+read. Names compare like the column collation (case-insensitively), so a
+new garment spelled "zara" joins the existing "Zara".
+
+``flask migrate-dimensions`` fills the tables and backfills the keys of
+garments written with the string columns (see the migration steps at the
+end of schema.sql).
+"""
+import threading
+
+import click
+
+# garments column -> dimension table
+DIMENSION_TABLES = {'brand': 'brands', 'category': 'categories', 'style': 'styles'}
+
+
+def _fold(name):
+    return name.strip().casefold()
+
+
+class Dimension:
+    """name <-> id dictionary of one dimension table"""
+
+    def __init__(self, column, table):
+        self.column = column
+        self.table = table
+        self._lock = threading.Lock()
+        self._names = None          # id -> name
+        self._ids = {}              # folded name -> id
+
+    def _load(self, cursor):
+        cursor.execute(f"SELECT id, name FROM {self.table}")
+        rows = cursor.fetchall()
+        names = {row['id']: row['name'] for row in rows}
+        ids = {_fold(name): dimension_id for dimension_id, name in names.items()}
+        with self._lock:
+            self._names, self._ids = names, ids
+
+    def _remember(self, dimension_id, name):
+        with self._lock:
+            self._names = {**(self._names or {}), dimension_id: name}
+            self._ids = {**self._ids, _fold(name): dimension_id}
+
+    def name(self, dimension_id, cursor):
+        """Name of ``dimension_id`` (None for None)"""
+        if dimension_id is None:
+            return None
+        names = self._names
+        if names is None or dimension_id not in names:
+            self._load(cursor)
+            names = self._names
+        return names.get(dimension_id)
+
+    def id(self, name, cursor):
+        """Id of ``name``, or None if no garment ever used it"""
+        if name is None:
+            return None
+        if self._names is None:
+            self._load(cursor)
+        dimension_id = self._ids.get(_fold(name))
+        if dimension_id is None:
+            cursor.execute(f"SELECT id, name FROM {self.table} WHERE name = %s", (name.strip(),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            dimension_id = row['id']
+            self._remember(dimension_id, row['name'])
+        return dimension_id
+
+    def ensure(self, name, cursor):
+        """
+        Id of ``name``, adding it in the writer's transaction (``cursor``)
+        if needed. Ids found or added here are only remembered once read
+        back committed, so a rollback cannot leave one in the dictionary.
+        """
+        return self.resolve(name, cursor)[0]
+
+    def resolve(self, name, cursor):
+        """``(id, stored spelling)`` of ``name``, adding it like ``ensure``"""
+        if name is None:
+            return None, None
+        dimension_id = self._ids.get(_fold(name))
+        if dimension_id is not None:
+            return dimension_id, self._names[dimension_id]
+        # Not remembered: the writer's connection also sees names added
+        # earlier in its own, still uncommitted, transaction
+        cursor.execute(f"SELECT id, name FROM {self.table} WHERE name = %s", (name.strip(),))
+        row = cursor.fetchone()
+        if row is not None:
+            return row['id'], row['name']
+        # The unique key resolves a concurrent insert of the same name; the
+        # no-op update hands back the existing id
+        cursor.execute(
+            f"INSERT INTO {self.table} (name) VALUES (%s) "
+            "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)",
+            (name.strip(),)
+        )
+        return cursor.lastrowid, name.strip()
+
+
+BRANDS = Dimension('brand', 'brands')
+CATEGORIES = Dimension('category', 'categories')
+STYLES = Dimension('style', 'styles')
+
+DIMENSIONS = (BRANDS, CATEGORIES, STYLES)
+DIMENSION_BY_COLUMN = {dimension.column: dimension for dimension in DIMENSIONS}
+
+
+def decode_garment(row, cursor):
+    """Replace a garment row's dimension keys with their names, in place"""
+    for dimension in DIMENSIONS:
+        key = f'{dimension.column}_id'
+        if key in row:
+            dimension_id = row.pop(key)
+            # Until migrate-dimensions backfilled the row, keep the string
+            # column it still has
+            if dimension_id is not None or dimension.column not in row:
+                row[dimension.column] = dimension.name(dimension_id, cursor)
+    return row
+
+
+def encode_garment(values, cursor, names=None):
+    """
+    Garment column values with dimension names replaced by their (ensured)
+    keys. The stored spelling of each name is put in ``names`` if given.
+    """
+    encoded = {}
+    for column, value in values.items():
+        if column in DIMENSION_TABLES:
+            dimension = DIMENSION_BY_COLUMN[column]
+            encoded[f'{column}_id'], stored = dimension.resolve(value, cursor)
+            if names is not None:
+                names[column] = stored
+        else:
+            encoded[column] = value
+    return encoded
+
+
+class GarmentDimensions:
+    """Flask extension registering the migration command of the dimension keys"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.chunk_size = 5000
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.chunk_size = app.config.get('DIMENSION_MIGRATION_CHUNK', 5000)
+        app.extensions['dimensions'] = self
+
+        @app.cli.command('migrate-dimensions')
+        def migrate_dimensions_command():
+            """Fill brands/categories/styles and backfill garments' dimension keys"""
+            click.echo(f'{self.migrate()} garments backfilled')
+
+    def migrate(self):
+        """
+        Backfill missing ``brand_id``/``category_id``/``style_id`` keys from
+        the string columns in id-range chunks; returns the rows updated.
+        Keys already set are kept, so it can be rerun after a partial run.
+        """
+        cursor = self.mysql.connection.cursor()
+        try:
+            for column, table in DIMENSION_TABLES.items():
+                cursor.execute(
+                    f"INSERT IGNORE INTO {table} (name) "
+                    f"SELECT DISTINCT {column} FROM garments WHERE {column} IS NOT NULL"
+                )
+            self.mysql.commit()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM garments")
+            max_id = cursor.fetchone()['max_id']
+
+            query = """
+                UPDATE garments g
+                LEFT JOIN brands b ON b.name = g.brand
+                LEFT JOIN categories c ON c.name = g.category
+                LEFT JOIN styles s ON s.name = g.style
+                SET g.brand_id = COALESCE(g.brand_id, b.id),
+                    g.category_id = COALESCE(g.category_id, c.id),
+                    g.style_id = COALESCE(g.style_id, s.id),
+                    g.updated_at = g.updated_at
+                WHERE g.id BETWEEN %s AND %s
+                    AND ((g.brand_id IS NULL AND b.id IS NOT NULL)
+                         OR (g.category_id IS NULL AND c.id IS NOT NULL)
+                         OR (g.style_id IS NULL AND s.id IS NOT NULL))
+            """
+            updated = 0
+            # Short chunked transactions: each locks only its id range
+            for low in range(1, max_id + 1, self.chunk_size):
+                cursor.execute(query, (low, low + self.chunk_size - 1))
+                updated += cursor.rowcount
+                self.mysql.commit()
+        except Exception:
+            self.mysql.rollback()
+            raise
+        finally:
+            cursor.close()
+        return updated
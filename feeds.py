@@ -0,0 +1,373 @@
+"""
+Precomputed personalized "for you" garment feeds
+
+``flask build-feeds`` (run from cron) scores the catalog for every active
+avatar whose inputs changed and stores its top ``FEED_SIZE`` garments in
+``avatar_feeds`` as packed arrays (uint32 ids and float16 scores, best
+first). GET /api/avatar/feed only reads that row and the page of garments.
+
+A garment's score for an avatar combines, with the weights below:
+- style: the garment's style is the avatar's ``generic_avatar_style``
+- affinity: share of the wardrobe in the garment's category, brand and style
+- fit: best size score from fit.py (neutral 0.5 without a size chart)
+- rating and popularity (``wardrobe_count``, log-scaled)
+Garments already in the wardrobe are left out.
+
+Avatars are scored in chunks of ``FEED_CHUNK`` as (avatars x catalog) NumPy
+arrays on a process pool. An avatar is active if its feed was requested or
+its profile updated within ``FEED_ACTIVE_DAYS``; its feed is rebuilt when the
+avatar, its measurements or its wardrobe changed since the build (the same
+version columns as profile_documents.py), or when the feed is older than
+``FEED_MAX_AGE`` seconds and the catalog changed since.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import click
+import numpy as np
+
+from avatar_models import MEASUREMENT_FIELDS, Avatar, BodyMeasurement
+from db_types import DB_NOW
+from dimensions import decode_garment
+from fit import body_profile, pack_all, read_size_charts
+
+logger = logging.getLogger(__name__)
+
+STYLES = ('classic', 'modern', 'casual', 'sporty')
+
+WEIGHT_STYLE = 0.25
+WEIGHT_AFFINITY = 0.30
+WEIGHT_FIT = 0.25
+WEIGHT_RATING = 0.15
+WEIGHT_POPULARITY = 0.05
+
+# Feeds are marked requested at most this often (a write on the read path)
+_REQUESTED_RESOLUTION = timedelta(days=1)
+
+
+def _codes(values):
+    """Integer codes of ``values`` (None included) and the number of codes"""
+    lookup = {}
+    codes = np.array([lookup.setdefault(value, len(lookup)) for value in values],
+                     dtype=np.int32)
+    return codes, max(len(lookup), 1)
+
+
+# -- scoring (runs in the pool's processes) --------------------------------
+
+_catalog = None
+
+
+def _init_worker(catalog):
+    global _catalog
+    _catalog = catalog
+
+
+def _score_chunk(chunk):
+    """Top garments of a chunk of avatars: [(avatar_id, ids bytes, scores bytes)]"""
+    catalog = _catalog
+    ids = catalog['ids']
+    size = min(catalog['feed_size'], len(ids))
+    if not size:
+        return [(avatar_id, b'', b'') for avatar_id, *_ in chunk]
+
+    count = len(chunk)
+    scores = np.broadcast_to(catalog['base'], (count, len(ids))).copy()
+
+    styles = np.array([style for _, style, _, _ in chunk], dtype=np.int32)
+    scores += WEIGHT_STYLE * (styles[:, None] == catalog['style'][None, :])
+
+    # Wardrobe affinity: per avatar, share of the wardrobe with the
+    # garment's category, brand and style
+    affinity = np.zeros_like(scores)
+    for attribute in ('category', 'brand', 'style'):
+        codes, code_count = catalog[attribute], catalog[f'{attribute}_count']
+        shares = np.zeros((count, code_count), dtype=np.float32)
+        for row, (_, _, _, owned) in enumerate(chunk):
+            if len(owned):
+                shares[row] = np.bincount(codes[owned], minlength=code_count) / len(owned)
+        affinity += shares[:, codes]
+    scores += (WEIGHT_AFFINITY / 3) * affinity
+
+    pack, positions = catalog['pack'], catalog['pack_positions']
+    mapped = positions >= 0
+    fit = np.full(len(ids), 0.5, dtype=np.float32)
+    for row, (_, _, body, owned) in enumerate(chunk):
+        fit.fill(0.5)
+        if len(pack):
+            _, garment_fit = pack.score(body)
+            fit[positions[mapped]] = np.nan_to_num(garment_fit[mapped], nan=0.5)
+        scores[row] += WEIGHT_FIT * fit
+        scores[row, owned] = -np.inf
+
+    top = np.argpartition(-scores, size - 1, axis=1)[:, :size]
+    results = []
+    for row, (avatar_id, _, _, owned) in enumerate(chunk):
+        best = top[row]
+        best = best[np.isfinite(scores[row, best])]
+        best = best[np.lexsort((ids[best], -scores[row, best]))]
+        results.append((
+            avatar_id,
+            ids[best].astype('<u4').tobytes(),
+            scores[row, best].astype('<f2').tobytes()
+        ))
+    return results
+
+
+# -- extension ---------------------------------------------------------------
+
+class PersonalizedFeeds:
+    """Flask extension serving stored feeds and registering the build job"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.feed_size = 200
+        self.chunk_size = 64
+        self.active_days = 30
+        self.max_age = 6 * 3600
+        self.workers = None
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.feed_size = app.config.get('FEED_SIZE', 200)
+        self.chunk_size = app.config.get('FEED_CHUNK', 64)
+        self.active_days = app.config.get('FEED_ACTIVE_DAYS', 30)
+        self.max_age = app.config.get('FEED_MAX_AGE', 6 * 3600)
+        self.workers = app.config.get('FEED_WORKERS') or os.cpu_count()
+        app.extensions['feeds'] = self
+
+        @app.cli.command('build-feeds')
+        @click.option('--workers', type=int, default=None, help='Scoring processes')
+        @click.option('--all', 'rebuild_all', is_flag=True,
+                      help='Rebuild every active feed, changed or not')
+        def build_feeds_command(workers, rebuild_all):
+            """Rebuild the personalized feeds of active avatars whose inputs changed"""
+            built = self.build(workers, rebuild_all)
+            click.echo(f'{built} feeds built')
+
+    # -- serving -------------------------------------------------------------
+
+    def stored_feed(self, user_id):
+        """
+        ``(avatar_id, garment ids best first or None, built_at)`` for the
+        user's avatar, or None if the user has no avatar
+        """
+        cursor = self.mysql.read_connection.cursor()
+        query = f"""
+            SELECT a.id AS avatar_id, f.garment_ids, f.built_at, f.requested_at, {DB_NOW}
+            FROM avatars a
+            LEFT JOIN avatar_feeds f ON f.avatar_id = a.id
+            WHERE a.user_id = %s
+        """
+        cursor.execute(query, (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            return None
+
+        now = row['db_now']
+        if row['requested_at'] is None or row['requested_at'] < now - _REQUESTED_RESOLUTION:
+            self._mark_requested(row['avatar_id'], now)
+        garment_ids = None
+        if row['garment_ids'] is not None:
+            garment_ids = np.frombuffer(row['garment_ids'], dtype='<u4')
+        return row['avatar_id'], garment_ids, row['built_at']
+
+    def _mark_requested(self, avatar_id, now):
+        """Keep the avatar active (or make it so, for its first feed)"""
+        cursor = self.mysql.connection.cursor()
+        query = """
+            INSERT INTO avatar_feeds (avatar_id, requested_at) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE requested_at = VALUES(requested_at)
+        """
+        cursor.execute(query, (avatar_id, now))
+        self.mysql.commit()
+        cursor.close()
+
+    # -- building ------------------------------------------------------------
+
+    def build(self, workers=None, rebuild_all=False):
+        """Rebuild the stale feeds of active avatars; returns how many were built"""
+        started = time.monotonic()
+        catalog, catalog_seq = self._read_catalog()
+        avatars = self._stale_avatars(catalog_seq, rebuild_all)
+        if not avatars:
+            return 0
+
+        jobs = []
+        for start in range(0, len(avatars), self.chunk_size):
+            chunk = avatars[start:start + self.chunk_size]
+            wardrobes = self._read_wardrobes([row['id'] for row in chunk])
+            jobs.append([
+                (row['id'],
+                 STYLES.index(row['generic_avatar_style'])
+                 if row['generic_avatar_style'] in STYLES else -1,
+                 self._body(row),
+                 self._owned(catalog['ids'], wardrobes.get(row['id'], ())))
+                for row in chunk
+            ])
+
+        versions = {row['id']: row for row in avatars}
+        workers = workers or self.workers
+        built = 0
+        if workers <= 1 or len(jobs) == 1:
+            _init_worker(catalog)
+            for results in map(_score_chunk, jobs):
+                built += self._store(results, versions, catalog_seq)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(catalog,)) as pool:
+                for results in pool.map(_score_chunk, jobs):
+                    built += self._store(results, versions, catalog_seq)
+
+        logger.info('feeds: built %d feeds over %d garments in %.1fs',
+                    built, len(catalog['ids']), time.monotonic() - started)
+        return built
+
+    def _read_catalog(self):
+        cursor = self.mysql.read_connection.cursor()
+        cursor.execute("SELECT value FROM change_sequences WHERE name = 'garments'")
+        sequence = cursor.fetchone()
+        cursor.execute("""
+            SELECT id, category_id, brand_id, style_id, rating, wardrobe_count
+            FROM garments
+            WHERE available = TRUE
+            ORDER BY id
+        """)
+        rows = [decode_garment(row, cursor) for row in cursor.fetchall()]
+        cursor.close()
+
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        rating = np.array([float(row['rating'] or 0) for row in rows], dtype=np.float32)
+        popularity = np.log1p(np.array([row['wardrobe_count'] or 0 for row in rows],
+                                       dtype=np.float32))
+        if len(rows) and popularity.max() > 0:
+            popularity /= popularity.max()
+
+        catalog = {
+            'ids': ids,
+            'feed_size': self.feed_size,
+            'base': WEIGHT_RATING * rating / 5 + WEIGHT_POPULARITY * popularity,
+        }
+        # Styles outside STYLES share the last code, which no avatar has
+        catalog['style'] = np.array([
+            STYLES.index(row['style']) if row['style'] in STYLES else len(STYLES)
+            for row in rows
+        ], dtype=np.int32)
+        catalog['style_count'] = len(STYLES) + 1
+        for attribute in ('category', 'brand'):
+            catalog[attribute], catalog[f'{attribute}_count'] = _codes(
+                row[attribute] for row in rows)
+
+        # Charts are read after the catalog: a garment added in between has
+        # a chart but no catalog position (-1) and is skipped
+        pack = pack_all(read_size_charts(self.mysql))
+        positions = np.searchsorted(ids, pack.garment_ids)
+        found = np.isin(pack.garment_ids, ids)
+        catalog['pack'] = pack
+        catalog['pack_positions'] = np.where(found, positions, -1)
+        return catalog, sequence['value'] if sequence else 0
+
+    def _stale_avatars(self, catalog_seq, rebuild_all):
+        measurement_columns = ', '.join(f'm.{field}' for field in MEASUREMENT_FIELDS)
+        query = f"""
+            SELECT a.id, a.generic_avatar_style, a.height, a.height_unit, a.weight,
+                   a.weight_unit, a.updated_at, {measurement_columns},
+                   a.version AS avatar_version, m.version AS measurements_version,
+                   COALESCE(w.version, 0) AS wardrobe_version
+            FROM avatars a
+            LEFT JOIN avatar_feeds f ON f.avatar_id = a.id
+            LEFT JOIN body_measurements m ON m.avatar_id = a.id
+            LEFT JOIN wardrobe_versions w ON w.avatar_id = a.id
+            WHERE (f.requested_at >= CURRENT_TIMESTAMP - INTERVAL %s DAY
+                   OR a.updated_at >= CURRENT_TIMESTAMP - INTERVAL %s DAY)
+        """
+        params = [self.active_days, self.active_days]
+        if not rebuild_all:
+            query += """
+                AND (
+                    f.built_at IS NULL
+                    OR NOT (
+                        f.avatar_version <=> a.version
+                        AND f.measurements_version <=> m.version
+                        AND f.wardrobe_version = COALESCE(w.version, 0)
+                    )
+                    OR (f.built_at < CURRENT_TIMESTAMP - INTERVAL %s SECOND
+                        AND f.catalog_seq < %s)
+                )
+            """
+            params += [self.max_age, catalog_seq]
+        cursor = self.mysql.read_connection.cursor()
+        cursor.execute(query + " ORDER BY a.id", tuple(params))
+        results = cursor.fetchall()
+        cursor.close()
+        return list(results)
+
+    def _read_wardrobes(self, avatar_ids):
+        cursor = self.mysql.read_connection.cursor()
+        query = (
+            "SELECT avatar_id, garment_id FROM avatar_garments "
+            f"WHERE avatar_id IN ({', '.join(['%s'] * len(avatar_ids))})"
+        )
+        cursor.execute(query, tuple(avatar_ids))
+        results = cursor.fetchall()
+        cursor.close()
+        wardrobes = {}
+        for row in results:
+            wardrobes.setdefault(row['avatar_id'], []).append(row['garment_id'])
+        return wardrobes
+
+    @staticmethod
+    def _body(row):
+        avatar = Avatar.from_dict(row)
+        measurements = None
+        if row['measurements_version'] is not None:
+            measurements = BodyMeasurement.from_dict(row)
+        return body_profile(avatar, measurements)
+
+    @staticmethod
+    def _owned(catalog_ids, garment_ids):
+        """Catalog positions of the wardrobe's garments that are in the catalog"""
+        garment_ids = np.array(sorted(garment_ids), dtype=np.int64)
+        if not len(garment_ids) or not len(catalog_ids):
+            return np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(catalog_ids, garment_ids)
+        positions = positions[positions < len(catalog_ids)]
+        return positions[np.isin(catalog_ids[positions], garment_ids)]
+
+    def _store(self, results, versions, catalog_seq):
+        values = []
+        for avatar_id, garment_ids, scores in results:
+            row = versions[avatar_id]
+            values.extend((avatar_id, garment_ids, scores, row['avatar_version'],
+                           row['measurements_version'], row['wardrobe_version'],
+                           catalog_seq))
+        query = f"""
+            INSERT INTO avatar_feeds (
+                avatar_id, garment_ids, scores, avatar_version,
+                measurements_version, wardrobe_version, catalog_seq, built_at
+            ) VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)'] * len(results))}
+            ON DUPLICATE KEY UPDATE
+                garment_ids = VALUES(garment_ids),
+                scores = VALUES(scores),
+                avatar_version = VALUES(avatar_version),
+                measurements_version = VALUES(measurements_version),
+                wardrobe_version = VALUES(wardrobe_version),
+                catalog_seq = VALUES(catalog_seq),
+                built_at = VALUES(built_at)
+        """
+        cursor = self.mysql.connection.cursor()
+        try:
+            cursor.execute(query, tuple(values))
+            self.mysql.commit()
+        except Exception:
+            self.mysql.rollback()
+            raise
+        finally:
+            cursor.close()
+        return len(results)
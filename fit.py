@@ -0,0 +1,321 @@
+"""
+Size/fit scoring of garments for an avatar
+
+Garments carry size charts (``garment_sizes``): per size, the body ranges
+it fits, in cm and kg. For each body dimension known on both sides, the
+distance outside the size's range is measured in that dimension's
+tolerance (a "one size off" step), and a size scores
+``exp(-0.5 * mean(distance ** 2))``: 1.0 when every range is met, falling
+off smoothly as it gets tighter or looser. A garment scores as its best
+size.
+
+The charts are packed per category into column-major NumPy arrays, loaded
+lazily in each process and refreshed from ``garment_changed``, so scoring a
+category is one vectorized pass per body dimension with no SQL.
+Measurements are taken in the avatar's ``height_unit`` and its weight in
+``weight_unit``; both are converted to cm/kg first.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+import signals
+from background import CoalescingQueue
+from dimensions import CATEGORIES
+from garment_models import SIZE_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+CM_PER_INCH = 2.54
+KG_PER_LB = 0.45359237
+
+DIMENSIONS = tuple(SIZE_DIMENSIONS)
+
+# Distance counted as one step off, per dimension (cm; kg for weight)
+TOLERANCES = np.array([
+    {'chest': 4.0, 'waist': 4.0, 'hips': 4.0, 'shoulder_width': 2.0, 'inseam': 3.0,
+     'arm_length': 3.0, 'neck_size': 1.5, 'height': 6.0, 'weight': 5.0}[dimension]
+    for dimension in DIMENSIONS
+], dtype=np.float32)
+
+# Number of set bits of every dimension mask
+_POPCOUNT = np.array([bin(mask).count('1') for mask in range(1 << len(DIMENSIONS))],
+                     dtype=np.float32)
+
+# Chart fields that change scores; other garment edits are ignored
+_CHART_FIELDS = {'sizes', 'category', 'available'}
+
+
+def to_metric(dimension, value, length_unit='cm', weight_unit='kg'):
+    """``value`` of a body dimension converted to cm (kg for weight)"""
+    if value is None:
+        return None
+    value = float(value)
+    if dimension == 'weight':
+        return value * KG_PER_LB if weight_unit == 'lbs' else value
+    return value * CM_PER_INCH if length_unit == 'in' else value
+
+
+def body_profile(avatar, measurements=None):
+    """Avatar body as a vector over DIMENSIONS in cm/kg (NaN when unknown)"""
+    values = {'height': avatar.height, 'weight': avatar.weight}
+    if measurements is not None:
+        for dimension in DIMENSIONS:
+            if hasattr(measurements, dimension):
+                values[dimension] = getattr(measurements, dimension)
+    return np.array([
+        np.nan if values.get(dimension) is None else to_metric(
+            dimension, values[dimension], avatar.height_unit, avatar.weight_unit)
+        for dimension in DIMENSIONS
+    ], dtype=np.float32)
+
+
+class _Pack:
+    """Size charts of the garments of one category, one column per size"""
+
+    def __init__(self, charts):
+        # charts: ((garment_id, labels, low, high), ...) sorted by garment id
+        self.garment_ids = np.array([chart[0] for chart in charts], dtype=np.int64)
+        counts = np.array([len(chart[1]) for chart in charts], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(charts) else counts
+        self.labels = [label for chart in charts for label in chart[1]]
+        # (dimensions, sizes): an unbounded side is -inf/+inf, so it never
+        # contributes a distance
+        low = np.concatenate([chart[2] for chart in charts], axis=1) if charts else \
+            np.empty((len(DIMENSIONS), 0), dtype=np.float32)
+        high = np.concatenate([chart[3] for chart in charts], axis=1) if charts else \
+            np.empty((len(DIMENSIONS), 0), dtype=np.float32)
+        bits = (~(np.isneginf(low) & np.isposinf(high))).astype(np.int64)
+        self.masks = (bits << np.arange(len(DIMENSIONS))[:, None]).sum(axis=0)
+        self.low = np.ascontiguousarray(low)
+        self.high = np.ascontiguousarray(high)
+        self.positions = {int(garment_id): i for i, garment_id in enumerate(self.garment_ids)}
+
+    def __len__(self):
+        return len(self.garment_ids)
+
+    def score_sizes(self, body):
+        """Fit score of every size (NaN where no dimension is comparable)"""
+        known = np.flatnonzero(~np.isnan(body))
+        sizes = self.low.shape[1]
+        total = np.zeros(sizes, dtype=np.float32)
+        step = np.empty(sizes, dtype=np.float32)
+        for dimension in known:
+            value = body[dimension]
+            np.subtract(self.low[dimension], value, out=step)
+            np.maximum(step, value - self.high[dimension], out=step)
+            np.maximum(step, 0, out=step)
+            step *= 1.0 / TOLERANCES[dimension]
+            step *= step
+            total += step
+        avatar_mask = int(sum(1 << int(dimension) for dimension in known))
+        compared = _POPCOUNT[self.masks & avatar_mask]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total /= compared
+        np.multiply(total, -0.5, out=total)
+        np.exp(total, out=total)
+        return total
+
+    def score(self, body):
+        """(size scores, best score per garment)"""
+        sizes = self.score_sizes(body)
+        if not len(self):
+            return sizes, sizes
+        return sizes, np.fmax.reduceat(sizes, self.starts)
+
+
+def _chart(rows):
+    """(labels, low, high) arrays of one garment's size rows"""
+    low = np.full((len(DIMENSIONS), len(rows)), -np.inf, dtype=np.float32)
+    high = np.full((len(DIMENSIONS), len(rows)), np.inf, dtype=np.float32)
+    for column, row in enumerate(rows):
+        for dimension_index, dimension in enumerate(DIMENSIONS):
+            if row[f'{dimension}_min'] is not None:
+                low[dimension_index, column] = row[f'{dimension}_min']
+            if row[f'{dimension}_max'] is not None:
+                high[dimension_index, column] = row[f'{dimension}_max']
+    return tuple(row['label'] for row in rows), low, high
+
+
+def read_size_charts(mysql, garment_ids=None):
+    """Charts of the available garments (or of ``garment_ids``): id -> (category, labels, low, high)"""
+    cursor = mysql.read_connection.cursor()
+    query = """
+        SELECT s.*, g.category_id
+        FROM garment_sizes s
+        JOIN garments g ON g.id = s.garment_id
+        WHERE g.available = TRUE
+    """
+    params = ()
+    if garment_ids is not None:
+        query += f" AND s.garment_id IN ({', '.join(['%s'] * len(garment_ids))})"
+        params = tuple(garment_ids)
+    cursor.execute(query + " ORDER BY s.garment_id, s.position", params)
+    results = cursor.fetchall()
+
+    rows_by_garment = defaultdict(list)
+    for row in results:
+        rows_by_garment[row['garment_id']].append(row)
+    charts = {
+        garment_id: (CATEGORIES.name(rows[0]['category_id'], cursor), *_chart(rows))
+        for garment_id, rows in rows_by_garment.items()
+    }
+    cursor.close()
+    return charts
+
+
+def pack_category(charts, category):
+    """_Pack of the charts of one category"""
+    return _Pack(tuple(
+        (garment_id, labels, low, high)
+        for garment_id, (chart_category, labels, low, high) in sorted(charts.items())
+        if chart_category == category
+    ))
+
+
+def pack_all(charts):
+    """_Pack of all the charts, categories mixed"""
+    return _Pack(tuple(
+        (garment_id, labels, low, high)
+        for garment_id, (_, labels, low, high) in sorted(charts.items())
+    ))
+
+
+class FitRanking:
+    """Garments ordered by fit for one body, best first"""
+
+    def __init__(self, results):
+        # results: ((pack, size scores, garment scores), ...)
+        self._results = results
+        if results:
+            ids = np.concatenate([pack.garment_ids for pack, _, _ in results])
+            scores = np.concatenate([scores for _, _, scores in results])
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            scores = np.empty(0, dtype=np.float32)
+        scored = ~np.isnan(scores)
+        ids, scores = ids[scored], scores[scored]
+        order = np.lexsort((ids, -scores))
+        self.garment_ids = ids[order]
+        self.scores = scores[order]
+
+    def __len__(self):
+        return len(self.garment_ids)
+
+    def above(self, min_score):
+        """Ranking cut to the garments scoring at least ``min_score``"""
+        count = int(np.count_nonzero(self.scores >= min_score))
+        ranking = FitRanking.__new__(FitRanking)
+        ranking._results = self._results
+        ranking.garment_ids = self.garment_ids[:count]
+        ranking.scores = self.scores[:count]
+        return ranking
+
+    def fit(self, garment_id):
+        """``{'score', 'size'}`` for a ranked garment (its best size), or None"""
+        for pack, sizes, scores in self._results:
+            position = pack.positions.get(garment_id)
+            if position is None:
+                continue
+            if np.isnan(scores[position]):
+                return None
+            start = pack.starts[position]
+            end = pack.starts[position + 1] if position + 1 < len(pack) else len(sizes)
+            best = start + int(np.nanargmax(sizes[start:end]))
+            return {'score': round(float(scores[position]), 4), 'size': pack.labels[best]}
+        return None
+
+
+class FitEngine:
+    """Flask extension scoring garment fit from in-memory size charts"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self._lock = threading.Lock()
+        self._charts = None      # garment id -> (category, labels, low, high)
+        self._packs = {}         # category -> _Pack
+        self._changed = set()
+        self._requested = False
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.queue = CoalescingQueue(
+            'fit-charts', self._process, app,
+            delay=app.config.get('FIT_REFRESH_DELAY', 0.5)
+        )
+        app.extensions['fit'] = self
+
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+
+    @property
+    def ready(self):
+        return self._charts is not None
+
+    def rank(self, body, category=None):
+        """FitRanking of the category (all categories if None), or None while loading"""
+        if self._charts is None:
+            if not self._requested:
+                self._requested = True
+                self.queue.submit('load')
+            return None
+        packs = self._packs
+        if category is not None:
+            selected = [packs[category]] if category in packs else []
+        else:
+            selected = list(packs.values())
+        return FitRanking([(pack, *pack.score(body)) for pack in selected])
+
+    def _on_garment_changed(self, sender, garment_id=None, action=None, fields=None, **kwargs):
+        if self._charts is None and not self._requested:
+            return
+        if action != 'update' or _CHART_FIELDS & set(fields or ()):
+            with self._lock:
+                self._changed.add(garment_id)
+            self.queue.submit('refresh')
+
+    def _process(self, keys):
+        if self._charts is None:
+            try:
+                self._load()
+            except Exception:
+                self._requested = False  # let the next request try again
+                raise
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if changed:
+            self._refresh(changed)
+
+    def _load(self):
+        charts = read_size_charts(self.mysql)
+        categories = {chart[0] for chart in charts.values()}
+        self._packs = {category: pack_category(charts, category) for category in categories}
+        self._charts = charts
+        logger.info('fit: loaded size charts of %d garments in %d categories',
+                    len(charts), len(categories))
+
+    def _refresh(self, garment_ids):
+        fresh = read_size_charts(self.mysql, sorted(garment_ids))
+        charts = dict(self._charts)
+        categories = set()
+        for garment_id in garment_ids:
+            previous = charts.pop(garment_id, None)
+            if previous is not None:
+                categories.add(previous[0])
+            if garment_id in fresh:
+                charts[garment_id] = fresh[garment_id]
+                categories.add(fresh[garment_id][0])
+
+        packs = dict(self._packs)
+        for category in categories:
+            pack = pack_category(charts, category)
+            if len(pack):
+                packs[category] = pack
+            else:
+                packs.pop(category, None)
+        self._charts = charts
+        self._packs = packs
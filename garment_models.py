@@ -2,6 +2,46 @@
 Garment models for managing garment items in the system
 """
 from datetime import datetime
+from db_types import DB_NOW, as_decimal, as_stored, current_timestamp
+from dimensions import BRANDS, CATEGORIES, DIMENSIONS, decode_garment, encode_garment
+from signals import garment_changed
+from singleflight import coalesced
+
+GARMENT_DECIMAL_FIELDS = ('price', 'rating')
+GARMENT_BOOLEAN_FIELDS = ('available',)
+
+# Stored columns the price statistics count a garment by. Writes that change
+# them pass the row's values before and after as ``prices`` with
+# garment_changed (see price_stats.py).
+PRICED_COLUMNS = ('price', 'brand_id', 'category_id', 'style_id', 'available')
+_PRICED_FIELDS = {'price', 'brand', 'category', 'style', 'available'}
+
+# Body dimensions a size chart can constrain (column prefix -> API name).
+# Lengths are stored in cm, weight in kg.
+SIZE_DIMENSIONS = {
+    'chest': 'chest',
+    'waist': 'waist',
+    'hips': 'hips',
+    'shoulder_width': 'shoulderWidth',
+    'inseam': 'inseam',
+    'arm_length': 'armLength',
+    'neck_size': 'neckSize',
+    'height': 'height',
+    'weight': 'weight',
+}
+
+# Text search over name, brand and description (brand through its dimension)
+_SEARCH_MATCH = (
+    "name LIKE %s OR brand_id IN (SELECT id FROM brands WHERE name LIKE %s) "
+    "OR description LIKE %s"
+)
+
+# ORDER BY clauses for the ``sort`` option of the catalog listings
+GARMENT_SORTS = {
+    'newest': 'created_at DESC',
+    'rating': 'rating DESC',
+    'popular': 'wardrobe_count DESC, rating DESC',
+}
 
 
 class Garment:
@@ -9,7 +49,7 @@ class Garment:
     
     def __init__(self, id=None, name=None, brand=None, price=None, rating=None,
                  image_url=None, description=None, category=None, style=None,
-                 available=True, created_at=None, updated_at=None):
+                 available=True, wardrobe_count=0, created_at=None, updated_at=None):
         self.id = id
         self.name = name
         self.brand = brand
@@ -20,6 +60,7 @@ class Garment:
         self.category = category
         self.style = style
         self.available = available
+        self.wardrobe_count = wardrobe_count
         self.created_at = created_at
         self.updated_at = updated_at
     
@@ -36,6 +77,7 @@ class Garment:
             'category': self.category,
             'style': self.style,
             'available': self.available,
+            'wardrobeCount': self.wardrobe_count,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'updatedAt': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -54,81 +96,226 @@ class Garment:
             category=data.get('category'),
             style=data.get('style'),
             available=data.get('available', True),
+            wardrobe_count=data.get('wardrobe_count', 0),
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at')
         )
 
 
+class GarmentSize:
+    """One size of a garment's size chart: body ranges it fits, in cm/kg"""
+    
+    def __init__(self, garment_id=None, label=None, position=0, ranges=None):
+        self.garment_id = garment_id
+        self.label = label
+        self.position = position
+        # dimension -> (min, max); either bound may be None
+        self.ranges = ranges or {}
+    
+    def to_dict(self):
+        """Convert size object to dictionary"""
+        size = {'label': self.label}
+        for dimension, name in SIZE_DIMENSIONS.items():
+            if dimension in self.ranges:
+                size[name] = [float(bound) if bound is not None else None
+                              for bound in self.ranges[dimension]]
+        return size
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Create GarmentSize object from a garment_sizes row"""
+        ranges = {}
+        for dimension in SIZE_DIMENSIONS:
+            low, high = data.get(f'{dimension}_min'), data.get(f'{dimension}_max')
+            if low is not None or high is not None:
+                ranges[dimension] = (low, high)
+        return cls(
+            garment_id=data.get('garment_id'),
+            label=data.get('label'),
+            position=data.get('position', 0),
+            ranges=ranges
+        )
+
+
 class GarmentRepository:
     """Database operations for Garment model"""
     
-    def __init__(self, mysql):
+    def __init__(self, mysql, singleflight=None):
         self.mysql = mysql
+        # Coalesces identical concurrent catalog reads (see singleflight.py)
+        self.singleflight = singleflight
     
     def create_garment(self, garment_data):
         """Create a new garment"""
         try:
             cursor = self.mysql.connection.cursor()
             
-            query = """
-                INSERT INTO garments (
-                    name, brand, price, rating, image_url, description,
-                    category, style, available
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
+            now = current_timestamp(self.mysql.connection)
             
-            cursor.execute(query, (
-                garment_data.get('name'),
-                garment_data.get('brand'),
-                garment_data.get('price'),
-                garment_data.get('rating', 0),
-                garment_data.get('image_url'),
-                garment_data.get('description'),
-                garment_data.get('category'),
-                garment_data.get('style'),
-                garment_data.get('available', True)
-            ))
-            
-            self.mysql.connection.commit()
+            row = as_stored({
+                'name': garment_data.get('name'),
+                'brand': garment_data.get('brand'),
+                'price': garment_data.get('price'),
+                'rating': garment_data.get('rating', 0),
+                'image_url': garment_data.get('image_url'),
+                'description': garment_data.get('description'),
+                'category': garment_data.get('category'),
+                'style': garment_data.get('style'),
+                'available': garment_data.get('available', True),
+                'created_at': now,
+                'updated_at': now
+            }, GARMENT_DECIMAL_FIELDS, GARMENT_BOOLEAN_FIELDS)
+            # Brand, category and style are stored as dimension keys; the
+            # result shows the names as stored (their existing spelling)
+            names = {}
+            stored = encode_garment(row, cursor, names)
+            query = (
+                f"INSERT INTO garments ({', '.join(stored)}) "
+                f"VALUES ({', '.join(['%s'] * len(stored))})"
+            )
+            cursor.execute(query, tuple(stored.values()))
             garment_id = cursor.lastrowid
+            if garment_data.get('sizes'):
+                self._write_sizes(cursor, garment_id, garment_data['sizes'])
+            self._record_change(cursor, garment_id, 'create')
+            
+            self.mysql.commit()
             cursor.close()
             
-            return self.get_garment_by_id(garment_id)
+            self.mysql.after_commit(
+                garment_changed.send, self, garment_id=garment_id, action='create',
+                fields=set(garment_data),
+                prices=(None, {column: stored.get(column) for column in PRICED_COLUMNS})
+            )
+            return Garment.from_dict(dict(row, **names, id=garment_id))
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
+    @staticmethod
+    def _record_change(cursor, garment_id, action):
+        """
+        Append to the garment change log in the writer's transaction.
+
+        The sequence row stays locked until commit, so concurrent writers
+        commit in sequence order and a reader never sees seq N+1 before N.
+        """
+        cursor.execute("""
+            INSERT INTO change_sequences (name, value) VALUES ('garments', LAST_INSERT_ID(1))
+            ON DUPLICATE KEY UPDATE value = LAST_INSERT_ID(value + 1)
+        """)
+        cursor.execute(
+            "INSERT INTO garment_changes (seq, garment_id, action) VALUES (LAST_INSERT_ID(), %s, %s)",
+            (garment_id, action)
+        )
+    
+    @staticmethod
+    def _write_sizes(cursor, garment_id, sizes):
+        """
+        Replace the garment's size chart. ``sizes`` is a list of
+        ``{'label': str, 'ranges': {dimension: (min, max)}}`` in cm/kg.
+        """
+        cursor.execute("DELETE FROM garment_sizes WHERE garment_id = %s", (garment_id,))
+        if not sizes:
+            return
+        columns = [f'{dimension}_{bound}' for dimension in SIZE_DIMENSIONS
+                   for bound in ('min', 'max')]
+        values = []
+        for position, size in enumerate(sizes):
+            ranges = size.get('ranges', {})
+            values.extend((garment_id, position, size['label']))
+            for dimension in SIZE_DIMENSIONS:
+                low, high = ranges.get(dimension, (None, None))
+                values.extend((as_decimal(low), as_decimal(high)))
+        row = f"({', '.join(['%s'] * (3 + len(columns)))})"
+        query = (
+            f"INSERT INTO garment_sizes (garment_id, position, label, {', '.join(columns)}) "
+            f"VALUES {', '.join([row] * len(sizes))}"
+        )
+        cursor.execute(query, tuple(values))
+    
+    @staticmethod
+    def _garments(cursor, rows):
+        """Garment objects of rows read with ``cursor``, dimension keys decoded"""
+        return [Garment.from_dict(decode_garment(row, cursor)) for row in rows]
+    
+    def get_changes_since(self, since=0, limit=500):
+        """
+        Current state of the garments changed after change sequence ``since``.
+        
+        Each garment appears once, at its latest change. Returns
+        ``(garments, deleted_ids, next_since, has_more)``: available garments
+        to upsert, ids of unavailable (soft deleted) or missing garments, and
+        the token to pass as ``since`` next time.
+        """
+        cursor = self.mysql.read_connection.cursor()
+        query = """
+            SELECT c.seq AS change_seq, c.garment_id AS change_garment_id, g.*
+            FROM (
+                SELECT garment_id, MAX(seq) AS seq
+                FROM garment_changes
+                WHERE seq > %s
+                GROUP BY garment_id
+                ORDER BY seq
+                LIMIT %s
+            ) c
+            LEFT JOIN garments g ON g.id = c.garment_id
+            ORDER BY c.seq
+        """
+        cursor.execute(query, (since, limit + 1))
+        results = cursor.fetchall()
+        
+        has_more = len(results) > limit
+        results = results[:limit]
+        garments = []
+        deleted_ids = []
+        for row in results:
+            if row.get('id') is not None and row.get('available'):
+                garments.append(Garment.from_dict(decode_garment(row, cursor)))
+            else:
+                deleted_ids.append(row['change_garment_id'])
+        cursor.close()
+        next_since = results[-1]['change_seq'] if results else since
+        return garments, deleted_ids, next_since, has_more
+    
     def get_garment_by_id(self, garment_id):
         """Get garment by ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM garments WHERE id = %s"
         cursor.execute(query, (garment_id,))
         result = cursor.fetchone()
+        garment = Garment.from_dict(decode_garment(result, cursor)) if result else None
         cursor.close()
         
-        if result:
-            return Garment.from_dict(result)
-        return None
+        return garment
     
-    def get_all_garments(self, limit=50, offset=0, filters=None):
-        """Get all garments with optional filters"""
-        cursor = self.mysql.connection.cursor()
+    def get_garment_sizes(self, garment_id):
+        """Size chart of a garment, smallest size first"""
+        cursor = self.mysql.read_connection.cursor()
+        query = "SELECT * FROM garment_sizes WHERE garment_id = %s ORDER BY position"
+        cursor.execute(query, (garment_id,))
+        results = cursor.fetchall()
+        cursor.close()
         
-        query = "SELECT * FROM garments WHERE available = TRUE"
+        return [GarmentSize.from_dict(row) for row in results]
+    
+    @staticmethod
+    def _filter_clause(filters, cursor):
+        """WHERE clause and parameters of the catalog listing filters"""
+        query = "available = TRUE"
         params = []
         
         if filters:
-            if filters.get('brand'):
-                query += " AND brand = %s"
-                params.append(filters['brand'])
-            
-            if filters.get('category'):
-                query += " AND category = %s"
-                params.append(filters['category'])
-            
-            if filters.get('style'):
-                query += " AND style = %s"
-                params.append(filters['style'])
+            for dimension in DIMENSIONS:
+                name = filters.get(dimension.column)
+                if name:
+                    dimension_id = dimension.id(name, cursor)
+                    if dimension_id is None:
+                        # No garment ever had that name
+                        query += " AND FALSE"
+                    else:
+                        query += f" AND {dimension.column}_id = %s"
+                        params.append(dimension_id)
             
             if filters.get('min_price'):
                 query += " AND price >= %s"
@@ -139,21 +326,86 @@ class GarmentRepository:
                 params.append(filters['max_price'])
             
             if filters.get('search'):
-                query += " AND (name LIKE %s OR brand LIKE %s OR description LIKE %s)"
+                query += f" AND ({_SEARCH_MATCH})"
                 search_term = f"%{filters['search']}%"
                 params.extend([search_term, search_term, search_term])
+            
+            if filters.get('min_wardrobe_count'):
+                query += " AND wardrobe_count >= %s"
+                params.append(filters['min_wardrobe_count'])
+        
+        return query, params
+    
+    @coalesced
+    def get_all_garments(self, limit=50, offset=0, filters=None, sort='newest'):
+        """Get all garments with optional filters, ordered by ``sort`` (see GARMENT_SORTS)"""
+        cursor = self.mysql.read_connection.cursor()
         
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
+        where, params = self._filter_clause(filters, cursor)
+        query = f"SELECT * FROM garments WHERE {where} ORDER BY {GARMENT_SORTS[sort]} LIMIT %s OFFSET %s"
         params.extend([limit, offset])
         
         cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
+        garments = self._garments(cursor, cursor.fetchall())
+        cursor.close()
+        
+        return garments
+    
+    def count_garments(self, filters=None, limit=None):
+        """
+        Number of available garments passing ``filters``, counting at most
+        ``limit`` of them (None counts all)
+        """
+        cursor = self.mysql.read_connection.cursor()
+        
+        where, params = self._filter_clause(filters, cursor)
+        if limit is None:
+            query = f"SELECT COUNT(*) AS total FROM garments WHERE {where}"
+        else:
+            query = f"SELECT COUNT(*) AS total FROM (SELECT 1 FROM garments WHERE {where} LIMIT %s) t"
+            params.append(limit)
+        
+        cursor.execute(query, tuple(params))
+        result = cursor.fetchone()
         cursor.close()
         
-        return [Garment.from_dict(row) for row in results]
+        return result['total']
+    
+    def get_garments_ranked(self, ranked_ids, limit=50, offset=0, filters=None):
+        """
+        Page of the garments in ``ranked_ids`` (best first) that pass
+        ``filters``, in ranking order. The ranking is read in growing
+        chunks until the page is full.
+        """
+        cursor = self.mysql.read_connection.cursor()
+        
+        where, params = self._filter_clause(filters, cursor)
+        wanted = offset + limit
+        matched = []
+        position = 0
+        chunk = max(wanted * 2, 200)
+        while len(matched) < wanted and position < len(ranked_ids):
+            ids = [int(garment_id) for garment_id in ranked_ids[position:position + chunk]]
+            position += len(ids)
+            query = (
+                f"SELECT * FROM garments WHERE {where} "
+                f"AND id IN ({', '.join(['%s'] * len(ids))})"
+            )
+            cursor.execute(query, tuple(params) + tuple(ids))
+            rows = {row['id']: row for row in cursor.fetchall()}
+            matched.extend(rows[garment_id] for garment_id in ids if garment_id in rows)
+            chunk = min(chunk * 4, 10000)
+        garments = self._garments(cursor, matched[offset:wanted])
+        cursor.close()
+        
+        return garments
     
     def update_garment(self, garment_id, garment_data):
-        """Update garment"""
+        """
+        Update garment. The row is locked and read before the write, so the
+        result is built from it and the written values without reading it
+        back.
+        """
         allowed_fields = ['name', 'brand', 'price', 'rating', 'image_url',
                          'description', 'category', 'style', 'available']
         
@@ -165,92 +417,160 @@ class GarmentRepository:
                 update_fields.append(f"{field} = %s")
                 values.append(value)
         
-        if not update_fields:
+        sizes = garment_data.get('sizes')
+        if not update_fields and sizes is None:
             return None
         
-        values.append(garment_id)
-        query = f"UPDATE garments SET {', '.join(update_fields)} WHERE id = %s"
+        written = as_stored(
+            dict(zip((f.split(' ')[0] for f in update_fields), values)),
+            GARMENT_DECIMAL_FIELDS, GARMENT_BOOLEAN_FIELDS
+        )
         
         try:
             cursor = self.mysql.connection.cursor()
-            cursor.execute(query, tuple(values))
-            self.mysql.connection.commit()
+            # rowcount cannot tell a missing garment from a no-op update; the
+            # lock also keeps the row read until commit
+            cursor.execute(
+                f"SELECT *, {DB_NOW} FROM garments WHERE id = %s FOR UPDATE",
+                (garment_id,)
+            )
+            before = cursor.fetchone()
+            if before is None:
+                self.mysql.rollback()
+                cursor.close()
+                return None
+            now = before.pop('db_now')
+            # Brand, category and style are stored as dimension keys
+            names = {}
+            stored = encode_garment(written, cursor, names)
+            assignments = [f"{column} = %s" for column in stored] + ['updated_at = %s']
+            query = f"UPDATE garments SET {', '.join(assignments)} WHERE id = %s"
+            cursor.execute(query, tuple(stored.values()) + (now, garment_id))
+            updated = cursor.rowcount
+            if sizes is not None:
+                self._write_sizes(cursor, garment_id, sizes)
+            if updated or sizes is not None:
+                self._record_change(cursor, garment_id, 'update')
+            self.mysql.commit()
+            after = dict(before, **stored)
+            current = decode_garment(dict(before), cursor)
+            current.update(written, **names)
+            if updated:
+                current['updated_at'] = now
+            garment = Garment.from_dict(current)
             cursor.close()
             
-            return self.get_garment_by_id(garment_id)
+            fields = {f.split(' ')[0] for f in update_fields}
+            if sizes is not None:
+                fields.add('sizes')
+            prices = None
+            if _PRICED_FIELDS & set(written):
+                prices = tuple({column: row[column] for column in PRICED_COLUMNS}
+                               for row in (before, after))
+            self.mysql.after_commit(
+                garment_changed.send, self, garment_id=garment_id, action='update',
+                fields=fields, prices=prices
+            )
+            return garment
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def delete_garment(self, garment_id):
         """Soft delete garment (mark as unavailable)"""
         try:
             cursor = self.mysql.connection.cursor()
+            cursor.execute(
+                f"SELECT {', '.join(PRICED_COLUMNS)} FROM garments WHERE id = %s FOR UPDATE",
+                (garment_id,)
+            )
+            before = cursor.fetchone()
             query = "UPDATE garments SET available = FALSE WHERE id = %s"
             cursor.execute(query, (garment_id,))
-            self.mysql.connection.commit()
+            if cursor.rowcount:
+                self._record_change(cursor, garment_id, 'delete')
+            self.mysql.commit()
             cursor.close()
+            
+            prices = (before, dict(before, available=False)) if before is not None else None
+            self.mysql.after_commit(
+                garment_changed.send, self, garment_id=garment_id, action='delete',
+                fields={'available'}, prices=prices
+            )
             return True
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def search_garments(self, search_query, limit=20):
         """Search garments by name, brand, or description"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         
-        query = """
+        query = f"""
             SELECT * FROM garments 
             WHERE available = TRUE 
-            AND (name LIKE %s OR brand LIKE %s OR description LIKE %s)
+            AND ({_SEARCH_MATCH})
             ORDER BY rating DESC
             LIMIT %s
         """
         
         search_term = f"%{search_query}%"
         cursor.execute(query, (search_term, search_term, search_term, limit))
-        results = cursor.fetchall()
+        garments = self._garments(cursor, cursor.fetchall())
         cursor.close()
         
-        return [Garment.from_dict(row) for row in results]
+        return garments
     
-    def get_garments_by_brand(self, brand, limit=20):
+    @coalesced
+    def get_garments_by_brand(self, brand, limit=20, sort='rating'):
         """Get garments by brand"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         
-        query = """
+        brand_id = BRANDS.id(brand, cursor)
+        if brand_id is None:
+            cursor.close()
+            return []
+        
+        query = f"""
             SELECT * FROM garments 
-            WHERE available = TRUE AND brand = %s
-            ORDER BY rating DESC
+            WHERE available = TRUE AND brand_id = %s
+            ORDER BY {GARMENT_SORTS[sort]}
             LIMIT %s
         """
         
-        cursor.execute(query, (brand, limit))
-        results = cursor.fetchall()
+        cursor.execute(query, (brand_id, limit))
+        garments = self._garments(cursor, cursor.fetchall())
         cursor.close()
         
-        return [Garment.from_dict(row) for row in results]
+        return garments
     
-    def get_garments_by_category(self, category, limit=20):
+    @coalesced
+    def get_garments_by_category(self, category, limit=20, sort='rating'):
         """Get garments by category"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         
-        query = """
+        category_id = CATEGORIES.id(category, cursor)
+        if category_id is None:
+            cursor.close()
+            return []
+        
+        query = f"""
             SELECT * FROM garments 
-            WHERE available = TRUE AND category = %s
-            ORDER BY rating DESC
+            WHERE available = TRUE AND category_id = %s
+            ORDER BY {GARMENT_SORTS[sort]}
             LIMIT %s
         """
         
-        cursor.execute(query, (category, limit))
-        results = cursor.fetchall()
+        cursor.execute(query, (category_id, limit))
+        garments = self._garments(cursor, cursor.fetchall())
         cursor.close()
         
-        return [Garment.from_dict(row) for row in results]
+        return garments
     
+    @coalesced
     def get_top_rated_garments(self, limit=10):
         """Get top rated garments"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         
         query = """
             SELECT * FROM garments 
@@ -260,7 +580,7 @@ class GarmentRepository:
         """
         
         cursor.execute(query, (limit,))
-        results = cursor.fetchall()
+        garments = self._garments(cursor, cursor.fetchall())
         cursor.close()
         
-        return [Garment.from_dict(row) for row in results]
\ No newline at end of file
+        return garments
\ No newline at end of file
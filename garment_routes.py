@@ -2,17 +2,137 @@
 Garment routes for shopping and browsing garments
 """
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from garment_models import GarmentRepository
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
+from avatar_models import AvatarRepository, BodyMeasurementRepository
+from fit import body_profile, to_metric
+from garment_models import GARMENT_SORTS, SIZE_DIMENSIONS, GarmentRepository
+from price_stats import RELATIVE_ACCURACY as PRICE_RELATIVE_ACCURACY
+from suggest import MAX_LIMIT as MAX_SUGGESTIONS
+from totals import wants_total
 
 garment_bp = Blueprint('garment', __name__, url_prefix='/api/garments')
 
-def init_garment_routes(mysql):
-    """Initialize garment routes with database connection"""
-    garment_repo = GarmentRepository(mysql)
+# Breakdowns of GET /api/garments/stats (dimension -> response key)
+PRICE_STAT_DIMENSIONS = {'category': 'categories', 'brand': 'brands', 'style': 'styles'}
+
+# Listing sorts: the SQL orders plus 'fit' (ranked for the caller's avatar)
+LISTING_SORTS = (*GARMENT_SORTS, 'fit')
+
+
+def _uncached_listing():
+    """
+    Listings bypassing the response cache: fit-ranked ones depend on the
+    caller, and popular ones (sort=popular, minWardrobeCount) on wardrobe
+    counters, which popularity.py updates without invalidating the cache
+    """
+    return (request.args.get('sort') in ('fit', 'popular')
+            or 'minFit' in request.args or 'minWardrobeCount' in request.args)
+
+
+def _listing_sort(default):
+    """``(sort, min_fit)`` of a listing request; ValueError if invalid"""
+    min_fit = request.args.get('minFit', type=float)
+    if 'minFit' in request.args and min_fit is None:
+        raise ValueError('minFit must be a number between 0 and 1')
+    sort = request.args.get('sort', 'fit' if min_fit is not None else default)
+    if sort not in LISTING_SORTS:
+        raise ValueError(f'sort must be one of {", ".join(LISTING_SORTS)}')
+    if min_fit is not None and sort != 'fit':
+        raise ValueError('minFit requires sort=fit')
+    return sort, min_fit
+
+
+def _parse_sizes(data):
+    """
+    Size chart of a create/update body, converted to cm/kg, or None if absent
+
+    ``sizes`` is a list of ``{"label": "M", "chest": [min, max], ...}``
+    (either bound may be null), with lengths in ``sizeUnit`` (cm/in) and
+    weight in ``weightUnit`` (kg/lbs).
+    """
+    if 'sizes' not in data:
+        return None
+    sizes = data['sizes'] or []
+    length_unit = data.get('sizeUnit', 'cm')
+    weight_unit = data.get('weightUnit', 'kg')
+    if length_unit not in ('cm', 'in') or weight_unit not in ('kg', 'lbs'):
+        raise ValueError('sizeUnit must be cm or in, weightUnit kg or lbs')
+    if not isinstance(sizes, list) or len(sizes) > 30:
+        raise ValueError('sizes must be a list of at most 30 sizes')
+    
+    parsed = []
+    for size in sizes:
+        label = size.get('label') if isinstance(size, dict) else None
+        if not isinstance(label, str) or not 0 < len(label) <= 20:
+            raise ValueError('each size needs a label of at most 20 characters')
+        ranges = {}
+        for dimension, name in SIZE_DIMENSIONS.items():
+            if size.get(name) is None:
+                continue
+            bounds = size[name]
+            if (not isinstance(bounds, list) or len(bounds) != 2
+                    or not all(b is None or isinstance(b, (int, float)) for b in bounds)):
+                raise ValueError(f'{name} of size {label} must be [min, max]')
+            low, high = (to_metric(dimension, b, length_unit, weight_unit) for b in bounds)
+            if low is not None and high is not None and low > high:
+                raise ValueError(f'{name} of size {label}: min is above max')
+            ranges[dimension] = (low, high)
+        parsed.append({'label': label, 'ranges': ranges})
+    return parsed
+
+
+def init_garment_routes(mysql, response_cache, singleflight=None, similar_garments=None,
+                        fit_engine=None, totals=None, suggestions=None, price_stats=None):
+    """Initialize garment routes with database connection and response cache"""
+    garment_repo = GarmentRepository(mysql, singleflight)
+    avatar_repo = AvatarRepository(mysql)
+    measurements_repo = BodyMeasurementRepository(mysql)
+    cached = response_cache.cached(tags=('garments',))
+    cached_listing = response_cache.cached(tags=('garments',), unless=_uncached_listing)
+    
+    def fit_page(limit, offset, filters, min_fit, category=None):
+        """
+        Page of garments ranked by fit for the caller's avatar, as
+        ``(garment dicts, None)`` or ``(None, error response)``
+        """
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+        if identity is None:
+            return None, (jsonify({'error': 'sort=fit requires authentication'}), 401)
+        if fit_engine is None:
+            return None, (jsonify({'error': 'Fit ranking is not enabled'}), 400)
+        
+        avatar = avatar_repo.get_avatar_by_user_id(int(identity))
+        if not avatar:
+            return None, (jsonify({'error': 'Avatar not found'}), 404)
+        measurements = measurements_repo.get_measurements_by_avatar_id(avatar.id)
+        
+        ranking = fit_engine.rank(body_profile(avatar, measurements), category)
+        if ranking is None:
+            response = jsonify({'error': 'Fit data is loading'})
+            response.headers['Retry-After'] = '5'
+            return None, (response, 503)
+        if min_fit is not None:
+            ranking = ranking.above(min_fit)
+        
+        garments = garment_repo.get_garments_ranked(ranking.garment_ids, limit, offset, filters)
+        return [dict(g.to_dict(), fit=ranking.fit(g.id)) for g in garments], None
     
     @garment_bp.route('/', methods=['GET'])
+    @cached_listing
     def get_garments():
+        """
+        List available garments
+        
+        Query params: brand, category, style, minPrice, maxPrice, search,
+        minWardrobeCount, limit, offset, and sort (newest, rating, popular,
+        or fit). sort=fit (authenticated) ranks garments with a size chart
+        by how well they fit the caller's avatar; minFit (0-1) keeps only
+        those scoring at least that and implies sort=fit. withTotal=true
+        adds the number of matching garments as ``total``, exact or
+        estimated as ``totalExact`` says (not with sort=fit); with search,
+        price or minWardrobeCount filters a large total is null instead.
+        """
         try:
             limit = request.args.get('limit', 50, type=int)
             offset = request.args.get('offset', 0, type=int)
@@ -40,19 +160,41 @@ def init_garment_routes(mysql):
             if request.args.get('search'):
                 filters['search'] = request.args.get('search')
             
-            garments = garment_repo.get_all_garments(limit, offset, filters)
-            
-            return jsonify({
-                'garments': [g.to_dict() for g in garments],
+            if request.args.get('minWardrobeCount'):
+                filters['min_wardrobe_count'] = request.args.get('minWardrobeCount', type=int)
+            
+            try:
+                sort, min_fit = _listing_sort('newest')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if sort == 'fit':
+                garments, error = fit_page(limit, offset, filters, min_fit,
+                                           filters.get('category'))
+                if error:
+                    return error
+            else:
+                garments = [g.to_dict() for g in
+                            garment_repo.get_all_garments(limit, offset, filters, sort)]
+            
+            response = {
+                'garments': garments,
                 'count': len(garments),
                 'limit': limit,
-                'offset': offset
-            }), 200
+                'offset': offset,
+                'sort': sort
+            }
+            if wants_total() and totals is not None and sort != 'fit':
+                response['total'], response['totalExact'] = totals.garments(
+                    filters, len(garments), limit, offset)
+            
+            return jsonify(response), 200
             
         except Exception as e:
             return jsonify({'error': f'Failed to get garments: {str(e)}'}), 500
     
     @garment_bp.route('/<int:garment_id>', methods=['GET'])
+    @cached
     def get_garment(garment_id):
         """Get garment by ID"""
         try:
@@ -72,6 +214,7 @@ def init_garment_routes(mysql):
             return jsonify({'error': f'Failed to get garment: {str(e)}'}), 500
     
     @garment_bp.route('/search', methods=['GET'])
+    @cached
     def search_garments():
         try:
             search_query = request.args.get('q')
@@ -93,38 +236,65 @@ def init_garment_routes(mysql):
             return jsonify({'error': f'Search failed: {str(e)}'}), 500
     
     @garment_bp.route('/brands/<brand>', methods=['GET'])
+    @cached_listing
     def get_garments_by_brand(brand):
         try:
             limit = request.args.get('limit', 20, type=int)
             
-            garments = garment_repo.get_garments_by_brand(brand, limit)
+            try:
+                sort, min_fit = _listing_sort('rating')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if sort == 'fit':
+                garments, error = fit_page(limit, 0, {'brand': brand}, min_fit)
+                if error:
+                    return error
+            else:
+                garments = [g.to_dict() for g in
+                            garment_repo.get_garments_by_brand(brand, limit, sort)]
             
             return jsonify({
-                'garments': [g.to_dict() for g in garments],
+                'garments': garments,
                 'count': len(garments),
-                'brand': brand
+                'brand': brand,
+                'sort': sort
             }), 200
             
         except Exception as e:
             return jsonify({'error': f'Failed to get garments: {str(e)}'}), 500
     
     @garment_bp.route('/categories/<category>', methods=['GET'])
+    @cached_listing
     def get_garments_by_category(category):
         try:
             limit = request.args.get('limit', 20, type=int)
             
-            garments = garment_repo.get_garments_by_category(category, limit)
+            try:
+                sort, min_fit = _listing_sort('rating')
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if sort == 'fit':
+                garments, error = fit_page(limit, 0, {'category': category}, min_fit, category)
+                if error:
+                    return error
+            else:
+                garments = [g.to_dict() for g in
+                            garment_repo.get_garments_by_category(category, limit, sort)]
             
             return jsonify({
-                'garments': [g.to_dict() for g in garments],
+                'garments': garments,
                 'count': len(garments),
-                'category': category
+                'category': category,
+                'sort': sort
             }), 200
             
         except Exception as e:
             return jsonify({'error': f'Failed to get garments: {str(e)}'}), 500
     
     @garment_bp.route('/top-rated', methods=['GET'])
+    @cached
     def get_top_rated():
         try:
             limit = request.args.get('limit', 10, type=int)
@@ -139,6 +309,175 @@ def init_garment_routes(mysql):
         except Exception as e:
             return jsonify({'error': f'Failed to get top rated garments: {str(e)}'}), 500
     
+    @garment_bp.route('/<int:garment_id>/sizes', methods=['GET'])
+    @cached
+    def get_garment_sizes(garment_id):
+        """Size chart of a garment (lengths in cm, weight in kg)"""
+        try:
+            sizes = garment_repo.get_garment_sizes(garment_id)
+            
+            return jsonify({
+                'garmentId': garment_id,
+                'sizes': [size.to_dict() for size in sizes],
+                'count': len(sizes)
+            }), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get garment sizes: {str(e)}'}), 500
+    
+    @garment_bp.route('/<int:garment_id>/similar', methods=['GET'])
+    def get_similar_garments(garment_id):
+        """
+        Garments frequently saved together with this one, best first
+        
+        Served from the in-memory co-occurrence index (no SQL). Query params:
+        - limit: Number of garments to return (default: 10, max: 50)
+        """
+        try:
+            if similar_garments is None:
+                return jsonify({'error': 'Recommendations are not enabled'}), 404
+            
+            limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+            
+            if not similar_garments.is_available(garment_id):
+                return jsonify({'error': 'Garment not found'}), 404
+            
+            neighbours = similar_garments.similar(garment_id, limit)
+            
+            if neighbours is None:
+                response = jsonify({'error': 'Recommendations are loading'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            
+            return jsonify({
+                'garmentId': garment_id,
+                'similar': [
+                    {'garmentId': other_id, 'score': score, 'savedTogether': saved_together}
+                    for other_id, score, saved_together in neighbours
+                ],
+                'count': len(neighbours)
+            }), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get similar garments: {str(e)}'}), 500
+    
+    @garment_bp.route('/suggest', methods=['GET'])
+    def suggest_garments():
+        """
+        Completions of a partly typed garment name, brand or category
+        
+        Served from the in-memory typeahead index (no SQL), best first.
+        Query params:
+        - prefix: Text typed so far
+        - limit: Number of suggestions to return (default: 8, max: 20)
+        """
+        try:
+            if suggestions is None:
+                return jsonify({'error': 'Suggestions are not enabled'}), 404
+            
+            prefix = request.args.get('prefix', '')
+            limit = min(max(request.args.get('limit', 8, type=int), 1), MAX_SUGGESTIONS)
+            
+            matches = suggestions.suggest(prefix, limit)
+            
+            if matches is None:
+                response = jsonify({'error': 'Suggestions are loading'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            
+            results = []
+            for kind, text, garment_id, brand in matches:
+                result = {'type': kind, 'text': text}
+                if kind == 'garment':
+                    result.update(garmentId=garment_id, brand=brand)
+                results.append(result)
+            
+            return jsonify({
+                'prefix': prefix,
+                'suggestions': results,
+                'count': len(results)
+            }), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get suggestions: {str(e)}'}), 500
+    
+    @garment_bp.route('/stats', methods=['GET'])
+    def get_price_stats():
+        """
+        Price count, mean and percentiles (p10/p50/p90) of the available
+        catalog, per category, brand and style
+        
+        Served from in-memory summaries of the price sketches (no SQL);
+        percentiles are within 1% of an actual price. Query params:
+        - by: Only this breakdown (category, brand or style)
+        """
+        try:
+            if price_stats is None:
+                return jsonify({'error': 'Price statistics are not enabled'}), 404
+            
+            by = request.args.get('by')
+            if by is not None and by not in PRICE_STAT_DIMENSIONS:
+                return jsonify({
+                    'error': f'by must be one of {", ".join(PRICE_STAT_DIMENSIONS)}'
+                }), 400
+            
+            summaries = price_stats.summaries()
+            
+            if summaries is None:
+                response = jsonify({'error': 'Price statistics are loading'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            
+            stats = {'overall': summaries['all'], 'relativeError': PRICE_RELATIVE_ACCURACY}
+            for dimension, key in PRICE_STAT_DIMENSIONS.items():
+                if by is None or by == dimension:
+                    stats[key] = summaries[dimension]
+            
+            return jsonify(stats), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get price statistics: {str(e)}'}), 500
+    
+    @garment_bp.route('/changes', methods=['GET'])
+    @cached
+    def get_garment_changes():
+        """
+        Garments changed since a sync token
+        
+        Query params:
+        - since: token returned by the previous call (default: 0, full sync)
+        - limit: Maximum garments per page (default: 500, max: 1000)
+        
+        Apply ``upserts`` and drop ``deleted`` ids locally, then call again
+        with ``next`` (immediately while ``hasMore`` is true).
+        """
+        try:
+            since = request.args.get('since', 0, type=int)
+            limit = request.args.get('limit', 500, type=int)
+            
+            if since < 0:
+                return jsonify({'error': 'since must be a sync token returned by this endpoint'}), 400
+            
+            if limit > 1000:
+                limit = 1000
+            elif limit < 1:
+                limit = 1
+            
+            garments, deleted_ids, next_since, has_more = garment_repo.get_changes_since(
+                since, limit
+            )
+            
+            return jsonify({
+                'upserts': [g.to_dict() for g in garments],
+                'deleted': deleted_ids,
+                'since': since,
+                'next': next_since,
+                'hasMore': has_more
+            }), 200
+            
+        except Exception as e:
+            return jsonify({'error': f'Failed to get garment changes: {str(e)}'}), 500
+    
     @garment_bp.route('/', methods=['POST'])
     @jwt_required()
     def create_garment():
@@ -165,6 +504,11 @@ def init_garment_routes(mysql):
                 'available': data.get('available', True)
             }
             
+            try:
+                garment_data['sizes'] = _parse_sizes(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
             garment = garment_repo.create_garment(garment_data)
             
             return jsonify({
@@ -202,6 +546,13 @@ def init_garment_routes(mysql):
                 if frontend_field in data:
                     garment_data[backend_field] = data[frontend_field]
             
+            try:
+                sizes = _parse_sizes(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if sizes is not None:
+                garment_data['sizes'] = sizes
+            
             garment = garment_repo.update_garment(garment_id, garment_data)
             
             if not garment:
@@ -0,0 +1,154 @@
+"""
+Background database health probe backing the readiness endpoints
+
+Probes run on a daemon thread every ``HEALTH_PROBE_INTERVAL`` seconds and
+the result is cached, so /readyz and /health never touch MySQL on the
+request path. The thread starts lazily in each process (it would not
+survive a prefork fork()).
+"""
+import os
+import threading
+import time
+
+
+class HealthMonitor:
+    """Periodically probes the primary and replicas and caches the result"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.interval = 5.0
+        self.stale_after = 15.0
+        self.probe_timeout = 2.0
+        self.max_replica_lag = 30.0
+        self._result = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.interval = app.config.get('HEALTH_PROBE_INTERVAL', 5.0)
+        self.stale_after = app.config.get('HEALTH_STALE_AFTER', self.interval * 3)
+        self.probe_timeout = app.config.get('HEALTH_PROBE_TIMEOUT', 2.0)
+        self.max_replica_lag = app.config.get('HEALTH_MAX_REPLICA_LAG', 30.0)
+        app.extensions['health'] = self
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._result = None
+            self._thread = threading.Thread(target=self._run, name='health-probe', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                result = self.probe()
+            except Exception as e:
+                result = {'checked_at': time.time(), 'database': 'unknown',
+                          'error': str(e), 'replicas': []}
+            with self._lock:
+                self._result = result
+            time.sleep(self.interval)
+
+    def _probe_pool(self, pool, query):
+        started = time.perf_counter()
+        conn = pool.acquire(timeout=self.probe_timeout)
+        discard = False
+        try:
+            cursor = conn.raw.cursor()
+            cursor.execute(query)
+            row = cursor.fetchone()
+            cursor.close()
+            return row, (time.perf_counter() - started) * 1000
+        except Exception:
+            discard = True
+            raise
+        finally:
+            pool.release(conn, discard=discard)
+
+    @staticmethod
+    def _saturation(stats):
+        capacity = stats['max_size'] + stats['max_overflow']
+        return round(stats['in_use'] / capacity, 3) if capacity else 0.0
+
+    def _replica_lag(self, pool):
+        for query in ('SHOW REPLICA STATUS', 'SHOW SLAVE STATUS'):
+            try:
+                row, _ = self._probe_pool(pool, query)
+            except Exception:
+                continue
+            if not row or not isinstance(row, dict):
+                return None
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return float(lag) if lag is not None else None
+        raise RuntimeError('replication status unavailable')
+
+    def probe(self):
+        """Run one probe of every pool (called from the background thread)"""
+        result = {
+            'checked_at': time.time(),
+            'database': 'connected',
+            'replicas': []
+        }
+        try:
+            _, latency = self._probe_pool(self.mysql.pool, 'SELECT 1')
+            result['latency_ms'] = round(latency, 2)
+        except Exception as e:
+            result['database'] = 'disconnected'
+            result['error'] = str(e)
+
+        for index, pool in enumerate(self.mysql.replicas.pools, start=1):
+            host = pool.connect_kwargs.get('host')
+            stats = pool.stats()
+            replica = {
+                'name': f'replica{index}',
+                'host': host,
+                'saturation': self._saturation(stats)
+            }
+            try:
+                lag = self._replica_lag(pool)
+                replica['lag_seconds'] = lag
+                replica['healthy'] = lag is not None and lag <= self.max_replica_lag
+            except Exception as e:
+                replica['healthy'] = False
+                replica['error'] = str(e)
+            result['replicas'].append(replica)
+
+        return result
+
+    def readiness(self):
+        """Cached readiness as ``(payload, ready)``; never blocks on MySQL"""
+        self._ensure_started()
+        with self._lock:
+            result = self._result
+
+        if result is None:
+            return {'status': 'starting', 'message': 'First database probe pending'}, False
+
+        age = time.time() - result['checked_at']
+        stats = self.mysql.pool.stats()
+        payload = dict(result, age_seconds=round(age, 3), pool={
+            'in_use': stats['in_use'],
+            'waiting': stats['waiting'],
+            'saturation': self._saturation(stats)
+        })
+        if age > self.stale_after:
+            payload['status'] = 'unready'
+            payload['message'] = 'Database probe result is stale'
+            return payload, False
+        if result['database'] != 'connected':
+            payload['status'] = 'unready'
+            payload['message'] = 'Database connection failed'
+            return payload, False
+
+        payload['status'] = 'ready'
+        if any(not replica['healthy'] for replica in result['replicas']):
+            payload['status'] = 'degraded'
+        return payload, True
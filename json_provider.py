@@ -0,0 +1,179 @@
+"""
+Fast JSON provider producing the same bytes as Flask's default provider
+
+Flask's ``DefaultJSONProvider`` serializes with ``sort_keys=True`` and
+``ensure_ascii=True``, turns ``Decimal`` into a string and ``datetime``/
+``date`` into an HTTP date. This provider keeps that contract but encodes
+with orjson when it is installed (falling back to the stdlib encoder) and
+resolves the encoder for non-native types once per type instead of walking
+an isinstance chain for every value. ``bytes`` are also supported (UTF-8
+text, or base64 when not valid UTF-8).
+
+Only whitespace may differ from the default provider, with two exceptions
+when orjson is installed: floats that need exponent notation (``1e16`` vs
+``1e+16``, which parse identically), and non-finite floats, which orjson
+encodes as ``null`` where the stdlib writes ``NaN``/``Infinity`` (not valid
+JSON, and rejected by most clients). Views should not put NaN or infinities
+in responses; finding them would mean scanning every payload.
+"""
+import base64
+import codecs
+import dataclasses
+import decimal
+import json
+import re
+import uuid
+from datetime import date, datetime, timezone
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+from flask.json.provider import DefaultJSONProvider
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _json_escape_errors(error):
+    """Codec error handler emitting JSON ``\\uXXXX`` escapes (surrogate pairs above the BMP)"""
+    escaped = []
+    for char in error.object[error.start:error.end]:
+        code = ord(char)
+        if code < 0x10000:
+            escaped.append('\\u%04x' % code)
+        else:
+            code -= 0x10000
+            escaped.append('\\u%04x\\u%04x' % (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff)))
+    return ''.join(escaped), error.end
+
+
+codecs.register_error('json_escape', _json_escape_errors)
+
+
+_ASTRAL_ESCAPE = re.compile(rb'\\U[0-9a-f]{8}')
+
+
+def _surrogate_pair(match):
+    code = int(match[2:], 16) - 0x10000
+    return b'\\u%04x\\u%04x' % (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+
+
+def _ensure_ascii(data):
+    """Escape what ``ensure_ascii`` escapes but orjson leaves raw"""
+    if not data.isascii():
+        if b'\\' in data:
+            # An escaped backslash followed by "x"/"U" would be ambiguous below
+            data = data.decode('utf-8').encode('ascii', 'json_escape')
+        else:
+            # backslashreplace runs in C; rewrite its \xNN and \UNNNNNNNN
+            # forms into JSON escapes (\uNNNN is already identical)
+            data = data.decode('utf-8').encode('ascii', 'backslashreplace')
+            if b'\\x' in data:
+                data = data.replace(b'\\x', b'\\u00')
+            if b'\\U' in data:
+                for seq in set(_ASTRAL_ESCAPE.findall(data)):
+                    data = data.replace(seq, _surrogate_pair(seq))
+    if b'\x7f' in data:
+        data = data.replace(b'\x7f', b'\\u007f')
+    return data
+
+
+def _http_date(value):
+    """Same output as ``werkzeug.http.http_date`` for date/datetime, faster"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        _DAYS[value.weekday()], value.day, _MONTHS[value.month - 1], value.year,
+        hour, minute, second
+    )
+
+
+def _encode_bytes(value):
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return base64.b64encode(value).decode('ascii')
+
+
+def _encode_html(value):
+    return str(value.__html__())
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Drop-in ``app.json`` provider backed by orjson when available"""
+
+    # Same conversions as flask.json.provider._default, plus bytes
+    _base_encoders = (
+        (date, _http_date),
+        (decimal.Decimal, str),
+        (uuid.UUID, str),
+        (bytes, _encode_bytes),
+        (bytearray, lambda value: _encode_bytes(bytes(value))),
+        (memoryview, lambda value: _encode_bytes(value.tobytes()))
+    )
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._encoders = {}
+
+    def _encoder_for(self, cls):
+        encoder = self._encoders.get(cls)
+        if encoder is not None:
+            return encoder
+        for base, candidate in self._base_encoders:
+            if issubclass(cls, base):
+                encoder = candidate
+                break
+        else:
+            if dataclasses.is_dataclass(cls):
+                encoder = dataclasses.asdict
+            elif hasattr(cls, '__html__'):
+                encoder = _encode_html
+            else:
+                return None
+        self._encoders[cls] = encoder
+        return encoder
+
+    def _default(self, value):
+        encoder = self._encoder_for(type(value))
+        if encoder is None:
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+        return encoder(value)
+
+    def dumps_bytes(self, obj, pretty=False):
+        """Serialize ``obj`` to ASCII JSON bytes with sorted keys"""
+        if orjson is not None:
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if pretty:
+                option |= orjson.OPT_INDENT_2
+            try:
+                return _ensure_ascii(orjson.dumps(obj, default=self._default, option=option))
+            except (orjson.JSONEncodeError, TypeError):
+                # Integers beyond 64 bits, non-str keys etc. (NaN and
+                # infinities do not raise: they become null)
+                pass
+        return json.dumps(
+            obj, default=self._default, ensure_ascii=True, sort_keys=True,
+            indent=2 if pretty else None,
+            separators=None if pretty else (',', ':')
+        ).encode('ascii')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', self._default)
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('ascii')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(
+            self.dumps_bytes(obj, pretty=pretty) + b'\n', mimetype=self.mimetype
+        )
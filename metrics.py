@@ -0,0 +1,242 @@
+"""
+Request and database metrics exposed in Prometheus text format at /metrics
+
+Instrumentation is a handful of dict lookups and a bisect per request so it
+can stay enabled in production. Metrics are process-local; in prefork mode
+each worker reports its own series (scrape them per worker or sum them).
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_app_context, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROW_COUNT_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def dec(self, label_values=(), amount=1):
+        self.inc(label_values, -amount)
+
+    def set(self, label_values=(), value=0):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_values=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # bucket counts (+Inf last), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items()]
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                yield self.name + '_bucket' + _format_labels(self.labels, label_values, le), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, label_values), total
+            yield self.name + '_count' + _format_labels(self.labels, label_values), count
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback):
+        """Register a callback refreshing gauges right before each scrape"""
+        self.collectors.append(callback)
+
+    def render(self):
+        for callback in self.collectors:
+            callback()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample, value in metric.collect():
+                lines.append(f'{sample} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """
+    Flask extension recording per-endpoint latency, status codes, in-flight
+    requests and per-request database usage.
+    """
+
+    def __init__(self, app=None, mysql=None):
+        self.registry = Registry()
+        r = self.registry
+        self.request_latency = r.register(Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint',
+            ('endpoint', 'method')))
+        self.requests_total = r.register(Counter(
+            'http_requests_total', 'Requests by endpoint and status',
+            ('endpoint', 'method', 'status')))
+        self.in_flight = r.register(Gauge(
+            'http_requests_in_flight', 'Requests currently being served'))
+        self.request_queries = r.register(Histogram(
+            'db_queries_per_request', 'SQL statements issued per request',
+            ('endpoint',), QUERY_COUNT_BUCKETS))
+        self.request_rows = r.register(Histogram(
+            'db_rows_per_request', 'Rows returned or affected per request',
+            ('endpoint',), ROW_COUNT_BUCKETS))
+        self.request_db_time = r.register(Histogram(
+            'db_time_per_request_seconds', 'Time spent in SQL per request',
+            ('endpoint',)))
+        self.query_latency = r.register(Histogram(
+            'db_query_duration_seconds', 'Latency of individual SQL statements'))
+        self.pool_gauge = r.register(Gauge(
+            'db_pool_connections', 'Connection pool state', ('pool', 'state')))
+        self.pool_checkouts = r.register(Gauge(
+            'db_pool_checkouts', 'Connections checked out since start', ('pool',)))
+        self.pool_checkout_ms = r.register(Gauge(
+            'db_pool_checkout_ms', 'Checkout latency (avg and max)', ('pool', 'stat')))
+        self.mysql = None
+
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql=None):
+        """Install request hooks, the query listener and the /metrics route"""
+        app.extensions['metrics'] = self
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view, methods=['GET'])
+
+        if mysql is not None:
+            self.mysql = mysql
+            mysql.add_query_listener(self._on_query)
+            self.registry.add_collector(self._collect_pool_stats)
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._metrics_db = [0, 0, 0.0]  # queries, rows, seconds
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exception):
+        started = g.pop('_metrics_start', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.in_flight.dec()
+
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('_metrics_status', 500)
+        self.request_latency.observe(elapsed, (endpoint, request.method))
+        self.requests_total.inc((endpoint, request.method, str(status)))
+
+        queries, rows, db_time = g.pop('_metrics_db')
+        label = (endpoint,)
+        self.request_queries.observe(queries, label)
+        self.request_rows.observe(rows, label)
+        self.request_db_time.observe(db_time, label)
+
+    def _on_query(self, statement, params, elapsed, rowcount, connection):
+        self.query_latency.observe(elapsed)
+        if has_app_context():
+            counters = g.get('_metrics_db')
+            if counters is not None:
+                counters[0] += 1
+                counters[1] += max(rowcount or 0, 0)
+                counters[2] += elapsed
+
+    def _collect_pool_stats(self):
+        for index, pool in enumerate(self.mysql.pools()):
+            name = 'primary' if index == 0 else f'replica{index}'
+            stats = pool.stats()
+            for state in ('size', 'idle', 'in_use', 'waiting'):
+                self.pool_gauge.set((name, state), stats[state])
+            self.pool_checkouts.set((name,), stats['checkouts'])
+            self.pool_checkout_ms.set((name, 'avg'), stats['checkout_ms_avg'])
+            self.pool_checkout_ms.set((name, 'max'), stats['checkout_ms_max'])
+
+    def metrics_view(self):
+        """Prometheus scrape endpoint"""
+        return Response(self.registry.render(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
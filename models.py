@@ -3,10 +3,16 @@ User model for database operations
 """
 from flask_bcrypt import Bcrypt
 from datetime import datetime
+from MySQLdb import IntegrityError
+from db_types import current_timestamp, is_duplicate_key
 
 bcrypt = Bcrypt()
 
 
+class EmailAlreadyRegistered(Exception):
+    """Raised when creating a user whose email is already taken"""
+
+
 class User:
     """User model class"""
     
@@ -59,29 +65,36 @@ class UserRepository:
         self.mysql = mysql
     
     def create_user(self, email, full_name, password):
-        """Create a new user"""
+        """Create a new user (the unique email index rejects duplicates)"""
         try:
             password_hash = User.hash_password(password)
             cursor = self.mysql.connection.cursor()
+            now = current_timestamp(self.mysql.connection)
             
             query = """
-                INSERT INTO users (email, full_name, password_hash)
-                VALUES (%s, %s, %s)
+                INSERT INTO users (email, full_name, password_hash, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s)
             """
-            cursor.execute(query, (email, full_name, password_hash))
-            self.mysql.connection.commit()
+            cursor.execute(query, (email, full_name, password_hash, now, now))
+            self.mysql.commit()
             
             user_id = cursor.lastrowid
             cursor.close()
             
-            return self.get_user_by_id(user_id)
+            return User(id=user_id, email=email, full_name=full_name,
+                        password_hash=password_hash, created_at=now, updated_at=now)
+        except IntegrityError as e:
+            self.mysql.rollback()
+            if is_duplicate_key(e):
+                raise EmailAlreadyRegistered(email) from e
+            raise e
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
     
     def get_user_by_email(self, email):
         """Get user by email"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM users WHERE email = %s"
         cursor.execute(query, (email,))
         result = cursor.fetchone()
@@ -93,7 +106,7 @@ class UserRepository:
     
     def get_user_by_id(self, user_id):
         """Get user by ID"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT * FROM users WHERE id = %s"
         cursor.execute(query, (user_id,))
         result = cursor.fetchone()
@@ -105,7 +118,7 @@ class UserRepository:
     
     def email_exists(self, email):
         """Check if email already exists"""
-        cursor = self.mysql.connection.cursor()
+        cursor = self.mysql.read_connection.cursor()
         query = "SELECT COUNT(*) as count FROM users WHERE email = %s"
         cursor.execute(query, (email,))
         result = cursor.fetchone()
@@ -133,10 +146,10 @@ class UserRepository:
         try:
             cursor = self.mysql.connection.cursor()
             cursor.execute(query, tuple(values))
-            self.mysql.connection.commit()
+            self.mysql.commit()
             cursor.close()
             
             return self.get_user_by_id(user_id)
         except Exception as e:
-            self.mysql.connection.rollback()
+            self.mysql.rollback()
             raise e
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Wardrobe popularity counters (``garments.wardrobe_count``)
+
+Adding a garment to a wardrobe or removing it only bumps an in-memory
+delta once the write has committed (via ``wardrobe_changed``); a background
+flusher applies the accumulated deltas every ``POPULARITY_FLUSH_INTERVAL``
+seconds with one UPDATE per distinct delta value. A hot garment saved a
+thousand times in an interval costs one row update instead of a thousand.
+
+Deltas of a process that dies before flushing are lost, so a reconciliation
+pass recomputes the counts from ``avatar_garments`` in id-range chunks and
+corrects the rows that drifted. It runs every
+``POPULARITY_RECONCILE_INTERVAL`` seconds from the flusher, in one process
+at a time (a MySQL named lock), and on demand with ``flask
+reconcile-popularity``. Deltas still pending elsewhere while it runs are
+applied on top of the recomputed counts; the next pass corrects them.
+
+Counter updates send no ``garment_changed``: they are not edits, and
+invalidating the catalog's response cache every flush would empty it under
+steady saves. Listings ordered or filtered by the count bypass that cache
+instead; elsewhere ``wardrobeCount`` may lag by ``RESPONSE_CACHE_TTL``.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import click
+
+import signals
+from background import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+_FLUSH = 'flush'
+# Named lock (GET_LOCK) held by the process running the periodic reconcile
+_RECONCILE_LOCK = 'popularity-reconcile'
+
+
+class PopularityCounters:
+    """Flask extension maintaining ``garments.wardrobe_count`` incrementally"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self.reconcile_interval = 3600
+        self.reconcile_chunk = 5000
+        self._deltas = defaultdict(int)
+        self._lock = threading.Lock()
+        self._last_reconcile = time.monotonic()
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.reconcile_interval = app.config.get('POPULARITY_RECONCILE_INTERVAL', 3600)
+        self.reconcile_chunk = app.config.get('POPULARITY_RECONCILE_CHUNK', 5000)
+        self.queue = CoalescingQueue(
+            'popularity', self._process, app,
+            delay=app.config.get('POPULARITY_FLUSH_INTERVAL', 2.0)
+        )
+        app.extensions['popularity'] = self
+
+        signals.wardrobe_changed.connect(self._on_wardrobe_changed, weak=False)
+
+        @app.cli.command('reconcile-popularity')
+        def reconcile_popularity_command():
+            """Recompute garments.wardrobe_count from avatar_garments"""
+            click.echo(f'{self.reconcile()} garment counters corrected')
+
+    def _on_wardrobe_changed(self, sender, action=None, garment_id=None, garment_ids=(),
+                             **kwargs):
+        if action == 'add':
+            self.bump(garment_id, 1)
+        elif action == 'remove':
+            self.bump(garment_id, -1)
+        elif action == 'clear':
+            for cleared_id in garment_ids:
+                self.bump(cleared_id, -1)
+
+    def bump(self, garment_id, delta):
+        """Add ``delta`` to the garment's count at the next flush"""
+        with self._lock:
+            self._deltas[garment_id] += delta
+        self.queue.submit(_FLUSH)
+
+    def pending(self):
+        """Number of garments with unflushed deltas"""
+        with self._lock:
+            return len(self._deltas)
+
+    def _process(self, keys):
+        self.flush()
+        if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            self._last_reconcile = time.monotonic()
+            self._reconcile_once()
+
+    def _reconcile_once(self):
+        """``reconcile()`` unless another process is running it; returns whether it ran"""
+        cursor = self.mysql.connection.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (_RECONCILE_LOCK,))
+        if not cursor.fetchone()['acquired']:
+            cursor.close()
+            return False
+        try:
+            self.reconcile()
+        finally:
+            # Named locks outlive transactions: release before the
+            # connection goes back to the pool
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_RECONCILE_LOCK,))
+            cursor.close()
+        return True
+
+    def flush(self):
+        """Apply the pending deltas, one UPDATE per distinct delta value"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+
+        by_delta = defaultdict(list)
+        for garment_id, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(garment_id)
+        if not by_delta:
+            return 0
+
+        try:
+            cursor = self.mysql.connection.cursor()
+            for delta, garment_ids in by_delta.items():
+                # updated_at is kept: a counter is not an edit of the garment
+                query = (
+                    "UPDATE garments SET wardrobe_count = GREATEST(wardrobe_count + %s, 0), "
+                    "updated_at = updated_at "
+                    f"WHERE id IN ({', '.join(['%s'] * len(garment_ids))})"
+                )
+                cursor.execute(query, (delta, *garment_ids))
+            self.mysql.commit()
+            cursor.close()
+        except Exception:
+            self.mysql.rollback()
+            # Not applied: keep them for the retry
+            with self._lock:
+                for garment_id, delta in deltas.items():
+                    self._deltas[garment_id] += delta
+            raise
+        return len(deltas)
+
+    def reconcile(self):
+        """Correct counts that drifted from ``avatar_garments``; returns rows fixed"""
+        self._last_reconcile = time.monotonic()
+        cursor = self.mysql.connection.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM garments")
+        max_id = cursor.fetchone()['max_id']
+
+        corrected = 0
+        query = """
+            UPDATE garments g
+            LEFT JOIN (
+                SELECT garment_id, COUNT(*) AS saves
+                FROM avatar_garments
+                WHERE garment_id BETWEEN %s AND %s
+                GROUP BY garment_id
+            ) s ON s.garment_id = g.id
+            SET g.wardrobe_count = COALESCE(s.saves, 0), g.updated_at = g.updated_at
+            WHERE g.id BETWEEN %s AND %s
+                AND g.wardrobe_count <> COALESCE(s.saves, 0)
+        """
+        # Short chunked transactions: each locks only its id range
+        for low in range(1, max_id + 1, self.reconcile_chunk):
+            high = low + self.reconcile_chunk - 1
+            try:
+                cursor.execute(query, (low, high, low, high))
+                corrected += cursor.rowcount
+                self.mysql.commit()
+            except Exception:
+                self.mysql.rollback()
+                cursor.close()
+                raise
+        cursor.close()
+
+        if corrected:
+            logger.warning('popularity: corrected %d drifted wardrobe counters', corrected)
+        return corrected
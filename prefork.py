@@ -0,0 +1,228 @@
+"""
+Prefork launcher running several waitress worker processes on one port
+
+The master process never imports the application: every worker imports it
+after fork(), so each one builds its own database pools and a rolling
+restart (SIGHUP) picks up new code without dropping the listening socket.
+
+Signals handled by the master:
+- SIGHUP: replace workers one at a time (rolling restart)
+- SIGTERM / SIGINT: stop all workers gracefully and exit
+- SIGTTIN / SIGTTOU: add / remove one worker
+"""
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+
+
+class PreforkServer:
+    """Master process supervising forked waitress workers"""
+
+    def __init__(self, app_path, host='0.0.0.0', port=5000, workers=2,
+                 threads=4, connection_limit=100, reuse_port=False,
+                 graceful_timeout=30, restart_delay=1.0, backlog=1024):
+        self.app_path = app_path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.connection_limit = connection_limit
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.graceful_timeout = graceful_timeout
+        self.restart_delay = restart_delay
+        self.backlog = backlog
+
+        self.sock = None
+        self.children = {}
+        self._stopping = False
+        self._restart_requested = False
+
+    # -- sockets -----------------------------------------------------------
+
+    def _bind_socket(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        return sock
+
+    # -- master ------------------------------------------------------------
+
+    def run(self):
+        """Start the workers and supervise them until asked to stop"""
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('Prefork mode requires os.fork (not available on this platform)')
+
+        if not self.reuse_port:
+            # Workers inherit this socket; the kernel hands each accepted
+            # connection to whichever worker accepts first.
+            self.sock = self._bind_socket()
+
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGTTIN, self._on_ttin)
+        signal.signal(signal.SIGTTOU, self._on_ttou)
+
+        print(f"Prefork master {os.getpid()}: {self.workers} workers x {self.threads} threads "
+              f"on {self.host}:{self.port} ({'SO_REUSEPORT' if self.reuse_port else 'shared socket'})")
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        try:
+            while not self._stopping:
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self._rolling_restart()
+                self._reap()
+                self._scale()
+                time.sleep(0.5)
+        finally:
+            self._stop_all()
+            if self.sock is not None:
+                self.sock.close()
+
+    def _on_hup(self, signum, frame):
+        self._restart_requested = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_ttin(self, signum, frame):
+        self.workers += 1
+
+    def _on_ttou(self, signum, frame):
+        self.workers = max(1, self.workers - 1)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _reap(self):
+        """Collect exited workers; replace the ones that died unexpectedly"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if self.children.pop(pid, None) is not None and not self._stopping:
+                print(f"Worker {pid} exited with status {status}; respawning")
+                self._spawn()
+
+    def _scale(self):
+        while len(self.children) < self.workers and not self._stopping:
+            self._spawn()
+        while len(self.children) > self.workers:
+            oldest = min(self.children, key=self.children.get)
+            self._stop_worker(oldest)
+
+    def _stop_worker(self, pid):
+        """Ask one worker to finish in-flight requests, then wait for it"""
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.children.pop(pid, None)
+            return
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                break
+            time.sleep(0.1)
+        else:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.pop(pid, None)
+
+    def _rolling_restart(self):
+        """Start a replacement before stopping each old worker"""
+        print(f"Rolling restart of {len(self.children)} workers")
+        for pid in list(self.children):
+            if self._stopping:
+                return
+            self._spawn()
+            time.sleep(self.restart_delay)
+            self._stop_worker(pid)
+
+    def _stop_all(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+        for pid in list(self.children):
+            self._stop_worker(pid)
+
+    # -- worker ------------------------------------------------------------
+
+    def _load_app(self):
+        module_name, _, attr = self.app_path.partition(':')
+        module = importlib.import_module(module_name)
+        return getattr(module, attr or 'app')
+
+    def _run_worker(self):
+        from waitress import wasyncore
+        from waitress.server import create_server
+
+        stopping = []
+        for signum in (signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, signal.SIG_IGN)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+        sock = self.sock if self.sock is not None else self._bind_socket()
+        app = self._load_app()
+        server = create_server(
+            app,
+            sockets=[sock],
+            threads=self.threads,
+            connection_limit=self.connection_limit,
+            ident='waitress'
+        )
+
+        while not stopping:
+            wasyncore.loop(timeout=1.0, map=server._map, use_poll=True, count=1)
+
+        # Graceful shutdown: stop accepting, let in-flight requests finish
+        # and flush their responses, close idle keep-alive connections.
+        wasyncore.dispatcher.close(server)
+        deadline = time.monotonic() + self.graceful_timeout
+        while server.active_channels and time.monotonic() < deadline:
+            cutoff = time.time() - 0.5
+            for channel in list(server.active_channels.values()):
+                if not channel.requests and channel.last_activity < cutoff:
+                    channel.will_close = True
+            wasyncore.loop(timeout=0.2, map=server._map, use_poll=True, count=1)
+        server.task_dispatcher.shutdown(
+            cancel_pending=True, timeout=max(deadline - time.monotonic(), 0)
+        )
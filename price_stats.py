@@ -0,0 +1,358 @@
+"""
+Price statistics per category, brand and style (GET /api/garments/stats)
+
+Every slice of the available catalog (all of it, and each brand, category
+and style) has a quantile sketch of its prices: counts per logarithmic
+bucket, each ``RELATIVE_ACCURACY`` wide (DDSketch), so a reported percentile
+is within 1% of a price at that rank. Sketches merge by adding counts, and
+unlike t-digest or KLL a count can be decremented, so a repriced or removed
+garment is taken out exactly. A sketch holds at most about 800 buckets from
+a cent to a million, whatever the catalog size.
+
+Writes pass a garment's priced columns before and after (``prices`` on
+``garment_changed``); each process accumulates the differences as delta
+sketches and merges them into the ``price_sketches`` rows every
+``STATS_FLUSH_INTERVAL`` seconds, like the popularity counters. Summaries
+(count, mean, p10/p50/p90) are computed when the rows are reloaded, at most
+every ``STATS_REFRESH_INTERVAL`` seconds, so a request only reads memory.
+
+Deltas of a process that dies before flushing are lost, and writes outside
+the repository (``flask migrate-dimensions``) send none, so the sketches are
+rebuilt from ``garments`` every ``STATS_REBUILD_INTERVAL`` seconds and by
+``flask rebuild-price-stats``; the latter is also needed after changing
+``RELATIVE_ACCURACY``. A rebuild locks the sketch rows before reading
+``garments`` on the primary, so flushes wait for it rather than being
+overwritten; only one process runs the periodic rebuild (a MySQL named
+lock). Deltas still unflushed when it reads are counted twice until the
+next rebuild.
+"""
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+import click
+import numpy as np
+
+import signals
+from background import CoalescingQueue
+from db_types import as_decimal
+from dimensions import DIMENSION_BY_COLUMN
+from garment_models import PRICED_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Relative error of the reported percentiles (bucket width)
+RELATIVE_ACCURACY = 0.01
+# Reported percentiles
+QUANTILES = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+
+_FLUSH = 'flush'
+_LOAD = 'load'
+_ALL = ('all', 0)
+# Sketched dimensions of a garment, besides the whole catalog
+_DIMENSIONS = ('category', 'brand', 'style')
+# Bucket of zero prices, below every logarithmic bucket
+_ZERO = -2 ** 15
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Rows per INSERT when a rebuild writes the sketches
+_WRITE_CHUNK = 500
+# Named lock (GET_LOCK) held by the process running the periodic rebuild
+_REBUILD_LOCK = 'price-stats-rebuild'
+
+
+def sketch_keys(row):
+    """``(dimension, value id)`` sketches a garment's priced columns count in"""
+    if row is None or row.get('price') is None or not row.get('available'):
+        return []
+    keys = [_ALL]
+    for dimension in _DIMENSIONS:
+        if row.get(f'{dimension}_id') is not None:
+            keys.append((dimension, row[f'{dimension}_id']))
+    return keys
+
+
+class PriceSketch:
+    """Mergeable quantile sketch of prices: counts per logarithmic bucket"""
+
+    def __init__(self, counts=None, total=Decimal(0)):
+        self.counts = counts if counts is not None else {}  # bucket -> count
+        self.total = total                                  # sum of the prices
+
+    @staticmethod
+    def bucket(price):
+        price = float(price)
+        if price <= 0:
+            return _ZERO
+        return math.ceil(math.log(price) / _LOG_GAMMA)
+
+    @staticmethod
+    def value(bucket):
+        """Price representing a bucket, within RELATIVE_ACCURACY of all its prices"""
+        if bucket == _ZERO:
+            return 0.0
+        return 2 * _GAMMA ** bucket / (_GAMMA + 1)
+
+    def add(self, price, count=1):
+        """Count ``price`` ``count`` times (negative to take it out)"""
+        bucket = self.bucket(price)
+        total = self.counts.get(bucket, 0) + count
+        if total:
+            self.counts[bucket] = total
+        else:
+            self.counts.pop(bucket, None)
+        self.total += as_decimal(price) * count
+        return self
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            count += self.counts.get(bucket, 0)
+            if count:
+                self.counts[bucket] = count
+            else:
+                self.counts.pop(bucket, None)
+        self.total += other.total
+        return self
+
+    @property
+    def count(self):
+        # Lost deltas can leave a bucket negative until the next rebuild
+        return sum(count for count in self.counts.values() if count > 0)
+
+    def quantile(self, q):
+        """Price at quantile ``q`` (0-1), or None if the sketch is empty"""
+        buckets = sorted(bucket for bucket, count in self.counts.items() if count > 0)
+        rank = q * (sum(self.counts[bucket] for bucket in buckets) - 1)
+        seen = 0
+        for bucket in buckets:
+            seen += self.counts[bucket]
+            if seen > rank:
+                return self.value(bucket)
+        return None
+
+    def summary(self):
+        count = self.count
+        if not count:
+            return {'count': 0, 'mean': None, **{name: None for name in QUANTILES}}
+        return {
+            'count': count,
+            'mean': round(float(self.total) / count, 2),
+            **{name: round(self.quantile(q), 2) for name, q in QUANTILES.items()}
+        }
+
+    def to_bytes(self):
+        buckets = sorted(self.counts)
+        return (np.array(buckets, dtype='<i2').tobytes()
+                + np.array([self.counts[bucket] for bucket in buckets], dtype='<i8').tobytes())
+
+    @classmethod
+    def from_row(cls, row):
+        """Sketch of a ``price_sketches`` row"""
+        data = row['buckets']
+        size = len(data) // 10
+        buckets = np.frombuffer(data, dtype='<i2', count=size)
+        counts = np.frombuffer(data, dtype='<i8', count=size, offset=2 * size)
+        return cls(dict(zip(buckets.tolist(), counts.tolist())), Decimal(row['price_sum']))
+
+
+class PriceStatistics:
+    """Flask extension maintaining and serving the price sketches"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self.refresh_interval = 60
+        self.rebuild_interval = 24 * 3600
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(PriceSketch)
+        self._summaries = None
+        self._loaded_at = None
+        self._requested = False
+        self._last_rebuild = time.monotonic()
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.refresh_interval = app.config.get('STATS_REFRESH_INTERVAL', 60)
+        self.rebuild_interval = app.config.get('STATS_REBUILD_INTERVAL', 24 * 3600)
+        self.queue = CoalescingQueue(
+            'price-stats', self._process, app,
+            delay=app.config.get('STATS_FLUSH_INTERVAL', 5.0)
+        )
+        app.extensions['price_stats'] = self
+
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+
+        @app.cli.command('rebuild-price-stats')
+        def rebuild_price_stats_command():
+            """Recompute the price sketches from garments"""
+            click.echo(f'{self.rebuild()} price sketches rebuilt')
+
+    # -- serving -----------------------------------------------------------
+
+    def summaries(self):
+        """
+        ``{'all': summary, 'category': {name: summary}, 'brand': ...,
+        'style': ...}`` as of the last load, or None while loading. A
+        summary has count, mean and the QUANTILES prices.
+        """
+        summaries = self._summaries
+        if summaries is None:
+            if not self._requested:
+                self._requested = True
+                self.queue.submit(_LOAD)
+            return None
+        if time.monotonic() - self._loaded_at > self.refresh_interval:
+            self._loaded_at = time.monotonic()  # submit once; the load resets it
+            self.queue.submit(_LOAD)
+        return summaries
+
+    # -- change tracking ---------------------------------------------------
+
+    def _on_garment_changed(self, sender, prices=None, **kwargs):
+        if prices is None:
+            return
+        before, after = prices
+        with self._lock:
+            for key in sketch_keys(before):
+                self._deltas[key].add(before['price'], -1)
+            for key in sketch_keys(after):
+                self._deltas[key].add(after['price'])
+        self.queue.submit(_FLUSH)
+
+    def _process(self, keys):
+        try:
+            self.flush()
+            if time.monotonic() - self._last_rebuild >= self.rebuild_interval:
+                self._last_rebuild = time.monotonic()
+                self._rebuild_once()
+            if _LOAD in keys and not self.load():
+                # No sketches yet (new database): build them, unless another
+                # process is (the next refresh loads its result)
+                if self._rebuild_once():
+                    self.load()
+        finally:
+            if self._summaries is None:
+                # The first load failed: let the next request try again
+                self._requested = False
+
+    def _rebuild_once(self):
+        """``rebuild()`` unless another process is running it; returns whether it ran"""
+        cursor = self.mysql.connection.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (_REBUILD_LOCK,))
+        if not cursor.fetchone()['acquired']:
+            cursor.close()
+            return False
+        try:
+            self.rebuild()
+        finally:
+            # Named locks outlive transactions: release before the
+            # connection goes back to the pool
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_REBUILD_LOCK,))
+            cursor.close()
+        return True
+
+    def flush(self):
+        """Merge the pending deltas into ``price_sketches``; returns sketches written"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(PriceSketch)
+        # Sorted, so concurrent flushers lock rows in the same order
+        keys = sorted(key for key, delta in deltas.items() if delta.counts or delta.total)
+        if not keys:
+            return 0
+
+        try:
+            cursor = self.mysql.connection.cursor()
+            cursor.execute(
+                "SELECT dimension, value_id, price_sum, buckets FROM price_sketches "
+                f"WHERE (dimension, value_id) IN ({', '.join(['(%s, %s)'] * len(keys))}) "
+                "FOR UPDATE",
+                tuple(value for key in keys for value in key)
+            )
+            stored = {(row['dimension'], row['value_id']): PriceSketch.from_row(row)
+                      for row in cursor.fetchall()}
+            values = []
+            for key in keys:
+                sketch = stored.get(key, PriceSketch()).merge(deltas[key])
+                values.extend((*key, sketch.total, sketch.to_bytes()))
+            cursor.execute(
+                "INSERT INTO price_sketches (dimension, value_id, price_sum, buckets, updated_at) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, CURRENT_TIMESTAMP)'] * len(keys))} "
+                "ON DUPLICATE KEY UPDATE price_sum = VALUES(price_sum), "
+                "buckets = VALUES(buckets), updated_at = VALUES(updated_at)",
+                tuple(values)
+            )
+            self.mysql.commit()
+            cursor.close()
+        except Exception:
+            self.mysql.rollback()
+            # Not applied: keep them for the retry
+            with self._lock:
+                for key, delta in deltas.items():
+                    self._deltas[key].merge(delta)
+            raise
+        return len(keys)
+
+    def rebuild(self):
+        """Replace every sketch by one computed from ``garments``; returns how many"""
+        self._last_rebuild = time.monotonic()
+        started = time.monotonic()
+        cursor = self.mysql.connection.cursor()
+        try:
+            # Lock the sketches first: a flush merging into them waits for
+            # the rewrite instead of being lost in it
+            cursor.execute("SELECT dimension, value_id FROM price_sketches FOR UPDATE")
+            cursor.execute(
+                f"SELECT {', '.join(PRICED_COLUMNS)} FROM garments "
+                "WHERE available = TRUE AND price IS NOT NULL"
+            )
+            sketches = defaultdict(PriceSketch)
+            for row in cursor.fetchall():
+                for key in sketch_keys(row):
+                    sketches[key].add(row['price'])
+
+            rows = [(*key, sketch.total, sketch.to_bytes())
+                    for key, sketch in sorted(sketches.items())]
+            cursor.execute("DELETE FROM price_sketches")
+            for start in range(0, len(rows), _WRITE_CHUNK):
+                chunk = rows[start:start + _WRITE_CHUNK]
+                cursor.execute(
+                    "INSERT INTO price_sketches "
+                    "(dimension, value_id, price_sum, buckets, updated_at) "
+                    f"VALUES {', '.join(['(%s, %s, %s, %s, CURRENT_TIMESTAMP)'] * len(chunk))}",
+                    tuple(value for row in chunk for value in row)
+                )
+            self.mysql.commit()
+        except Exception:
+            self.mysql.rollback()
+            raise
+        finally:
+            cursor.close()
+        logger.info('price-stats: rebuilt %d sketches in %.2fs',
+                    len(rows), time.monotonic() - started)
+        return len(rows)
+
+    def load(self):
+        """Summarize the stored sketches for serving; returns how many were read"""
+        cursor = self.mysql.read_connection.cursor()
+        cursor.execute("SELECT dimension, value_id, price_sum, buckets FROM price_sketches")
+        rows = cursor.fetchall()
+        summaries = {'all': PriceSketch().summary(),
+                     **{dimension: {} for dimension in _DIMENSIONS}}
+        for row in rows:
+            summary = PriceSketch.from_row(row).summary()
+            if row['dimension'] == 'all':
+                summaries['all'] = summary
+            elif summary['count']:
+                dimension = DIMENSION_BY_COLUMN[row['dimension']]
+                name = dimension.name(row['value_id'], cursor)
+                if name is not None:
+                    summaries[row['dimension']][name] = summary
+        cursor.close()
+        self._summaries = summaries
+        self._loaded_at = time.monotonic()
+        return len(rows)
@@ -0,0 +1,247 @@
+"""
+Materialized avatar profile documents
+
+The owner view (GET /api/avatar/profile) and the public view
+(GET /api/avatar/<id>) are stored per avatar in ``profile_documents`` as
+ready-to-send JSON bytes, and rebuilt on a background queue whenever the
+avatar, its measurements, its wardrobe or a garment in its wardrobe changes.
+
+A stored document is served only while it is fresh: the avatar, measurements
+and wardrobe versions it was built from still match (checked by the same
+query that fetches it), and it is younger than ``PROFILE_DOC_MAX_AGE``
+seconds, which bounds staleness after garment edits. Otherwise the view is built live and a rebuild is queued.
+"""
+from datetime import timedelta
+
+from flask import Response, current_app
+
+import signals
+from avatar_models import AvatarGarmentRepository, AvatarRepository, BodyMeasurementRepository
+from background import CoalescingQueue
+from db_types import DB_NOW
+from metrics import Gauge
+
+# Source versions the document was built from still match the live rows.
+# Versions, not updated_at: two writes within the same second would leave
+# the same timestamp.
+_FRESH = """
+    d.avatar_version = a.version
+    AND d.measurements_version <=> m.version
+    AND d.wardrobe_version = COALESCE(w.version, 0)
+"""
+_VERSIONS = """
+    SELECT a.version AS avatar_version, m.version AS measurements_version,
+           COALESCE(w.version, 0) AS wardrobe_version
+    FROM avatars a
+    LEFT JOIN body_measurements m ON m.avatar_id = a.id
+    LEFT JOIN wardrobe_versions w ON w.avatar_id = a.id
+    WHERE a.id = %s
+"""
+
+
+def owner_profile(avatar, measurements, garments):
+    """Avatar as shown to its owner: profile, measurements and wardrobe"""
+    avatar_response = avatar.to_dict()
+    if measurements:
+        avatar_response['bodyMeasurements'] = measurements.to_dict()
+    avatar_response['garments'] = garments
+    return avatar_response
+
+
+def public_profile(avatar, measurements):
+    """Avatar as shown publicly: profile and measurements"""
+    avatar_response = avatar.to_dict()
+    if measurements:
+        avatar_response['bodyMeasurements'] = measurements.to_dict()
+    return avatar_response
+
+
+class ProfileDocuments:
+    """Flask extension storing and serving precomputed profile responses"""
+
+    def __init__(self, app=None, mysql=None, metrics=None):
+        self.enabled = True
+        self.max_age = 300
+        self.mysql = None
+        self.queue = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app, mysql, metrics)
+
+    def init_app(self, app, mysql, metrics=None):
+        self.enabled = app.config.get('PROFILE_DOCS_ENABLED', True)
+        self.max_age = app.config.get('PROFILE_DOC_MAX_AGE', 300)
+        self.mysql = mysql
+        self.avatar_repo = AvatarRepository(mysql)
+        self.measurements_repo = BodyMeasurementRepository(mysql)
+        self.garments_repo = AvatarGarmentRepository(mysql)
+        self.queue = CoalescingQueue(
+            'profile-docs', self._process, app,
+            delay=app.config.get('PROFILE_DOC_REBUILD_DELAY', 0.05)
+        )
+        app.extensions['profile_documents'] = self
+        if not self.enabled:
+            return
+
+        signals.avatar_changed.connect(self._on_avatar_changed, weak=False)
+        signals.measurements_changed.connect(self._on_avatar_changed, weak=False)
+        signals.wardrobe_changed.connect(self._on_avatar_changed, weak=False)
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+
+        if metrics is not None:
+            self._queue_gauge = metrics.registry.register(Gauge(
+                'profile_doc_rebuild_queue', 'Profile document rebuild queue', ('stat',)))
+            self._reads_gauge = metrics.registry.register(Gauge(
+                'profile_doc_reads', 'Profile reads served from documents or live', ('result',)))
+            metrics.registry.add_collector(self._collect_stats)
+
+    # -- invalidation ------------------------------------------------------
+
+    def _on_avatar_changed(self, sender, avatar_id=None, **kwargs):
+        if avatar_id is not None:
+            self.queue.submit(('avatar', avatar_id))
+
+    def _on_garment_changed(self, sender, garment_id=None, **kwargs):
+        # Resolved to the wardrobes holding it on the worker, not the request
+        self.queue.submit(('garment', garment_id))
+
+    def _process(self, keys):
+        garment_ids = [key[1] for key in keys if key[0] == 'garment']
+        if garment_ids:
+            self.queue.submit_many(('avatar', avatar_id)
+                                   for avatar_id in self._avatars_holding(garment_ids))
+        for kind, avatar_id in keys:
+            if kind == 'avatar':
+                self.rebuild(avatar_id)
+
+    def _avatars_holding(self, garment_ids):
+        cursor = self.mysql.connection.cursor()
+        query = (
+            "SELECT DISTINCT avatar_id FROM avatar_garments "
+            f"WHERE garment_id IN ({', '.join(['%s'] * len(garment_ids))})"
+        )
+        cursor.execute(query, tuple(garment_ids))
+        results = cursor.fetchall()
+        cursor.close()
+        return [row['avatar_id'] for row in results]
+
+    # -- build -------------------------------------------------------------
+
+    @staticmethod
+    def _serialize(payload):
+        return current_app.json.response(payload).get_data()
+
+    def rebuild(self, avatar_id):
+        """Rebuild the avatar's document from the primary (drop it if the avatar is gone)"""
+        # Reads below follow the primary connection once it is checked out
+        cursor = self.mysql.connection.cursor()
+        # Versions first: a change racing with the build leaves the document
+        # looking stale rather than looking fresh
+        cursor.execute(_VERSIONS, (avatar_id,))
+        versions = cursor.fetchone()
+        avatar = self.avatar_repo.get_avatar_by_id(avatar_id) if versions else None
+        if avatar is None:
+            cursor.execute("DELETE FROM profile_documents WHERE avatar_id = %s", (avatar_id,))
+            self.mysql.commit()
+            cursor.close()
+            return
+
+        measurements = self.measurements_repo.get_measurements_by_avatar_id(avatar_id)
+        garments = self.garments_repo.get_avatar_garments(avatar_id)
+
+        owner_body = self._serialize({'avatar': owner_profile(avatar, measurements, garments)})
+        public_body = None
+        if avatar.public_profile:
+            public_body = self._serialize({'avatar': public_profile(avatar, measurements)})
+
+        query = """
+            INSERT INTO profile_documents (
+                avatar_id, user_id, owner_body, public_body, avatar_version,
+                measurements_version, wardrobe_version, built_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON DUPLICATE KEY UPDATE
+                user_id = VALUES(user_id),
+                owner_body = VALUES(owner_body),
+                public_body = VALUES(public_body),
+                avatar_version = VALUES(avatar_version),
+                measurements_version = VALUES(measurements_version),
+                wardrobe_version = VALUES(wardrobe_version),
+                built_at = VALUES(built_at)
+        """
+        cursor.execute(query, (
+            avatar_id, avatar.user_id, owner_body, public_body, versions['avatar_version'],
+            versions['measurements_version'], versions['wardrobe_version']
+        ))
+        self.mysql.commit()
+        cursor.close()
+
+    # -- serve -------------------------------------------------------------
+
+    def owner_document(self, user_id):
+        """Stored owner profile response for ``user_id``, or None to build it live"""
+        if not self.enabled:
+            return None
+        cursor = self.mysql.read_connection.cursor()
+        query = f"""
+            SELECT a.id AS avatar_id, d.owner_body AS body, d.built_at, ({_FRESH}) AS fresh,
+                   {DB_NOW}
+            FROM avatars a
+            LEFT JOIN profile_documents d ON d.avatar_id = a.id
+            LEFT JOIN body_measurements m ON m.avatar_id = a.id
+            LEFT JOIN wardrobe_versions w ON w.avatar_id = a.id
+            WHERE a.user_id = %s
+        """
+        cursor.execute(query, (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return self._serve(row)
+
+    def public_document(self, avatar_id):
+        """Stored public profile response for ``avatar_id``, or None to build it live"""
+        if not self.enabled:
+            return None
+        cursor = self.mysql.read_connection.cursor()
+        query = f"""
+            SELECT a.id AS avatar_id, a.public_profile, d.public_body AS body, d.built_at,
+                   ({_FRESH}) AS fresh, {DB_NOW}
+            FROM avatars a
+            LEFT JOIN profile_documents d ON d.avatar_id = a.id
+            LEFT JOIN body_measurements m ON m.avatar_id = a.id
+            LEFT JOIN wardrobe_versions w ON w.avatar_id = a.id
+            WHERE a.id = %s
+        """
+        cursor.execute(query, (avatar_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is not None and not row['public_profile']:
+            # Not public: the live path answers 403, nothing to rebuild
+            return None
+        return self._serve(row)
+
+    def _serve(self, row):
+        if row is None:
+            return None
+        fresh = (
+            row['body'] is not None and row['fresh']
+            and row['built_at'] >= row['db_now'] - timedelta(seconds=self.max_age)
+        )
+        if not fresh:
+            self.misses += 1
+            self.queue.submit(('avatar', row['avatar_id']))
+            return None
+        self.hits += 1
+        response = Response(row['body'], mimetype='application/json')
+        response.headers['X-Profile-Document'] = 'HIT'
+        return response
+
+    def stats(self):
+        return dict(self.queue.stats(), hits=self.hits, misses=self.misses)
+
+    def _collect_stats(self):
+        stats = self.queue.stats()
+        self._queue_gauge.set(('depth',), stats['depth'])
+        self._queue_gauge.set(('oldest_seconds',), stats['oldest_seconds'])
+        self._queue_gauge.set(('failures',), stats['failures'])
+        self._reads_gauge.set(('document',), self.hits)
+        self._reads_gauge.set(('live',), self.misses)
@@ -0,0 +1,173 @@
+"""
+Development/staging SQL inspector: N+1 detection, slow-query EXPLAIN logging
+and query budgets
+
+Every statement executed during a request is fingerprinted (literals and
+placeholders replaced by ``?``). At the end of the request, same-shape
+statements repeated ``QUERY_INSPECTOR_N_PLUS_ONE`` times or more are
+reported as a likely N+1, and statements slower than
+``QUERY_INSPECTOR_SLOW_MS`` are logged with their EXPLAIN plan.
+
+Tests can assert query budgets (with ``QUERY_INSPECTOR_ENABLED`` set)::
+
+    with inspector.budget(1):
+        client.get('/api/avatar/profile', headers=auth)
+
+    with inspector.capture() as queries:
+        client.get('/api/garments/top-rated')
+    assert len(queries) == 1
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+
+logger = logging.getLogger(__name__)
+
+_COMMENTS = re.compile(r'/\*.*?\*/|--[^\n]*', re.S)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'%s|%\(\w+\)s')
+_IN_LISTS = re.compile(r'\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.I)
+_VALUES_LISTS = re.compile(r'\bvalues\s*(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*', re.I)
+_WHITESPACE = re.compile(r'\s+')
+
+_EXPLAINABLE = ('select', 'update', 'delete', 'insert', 'replace')
+
+
+def fingerprint(statement):
+    """Normalize a statement so executions with different values compare equal"""
+    sql = _COMMENTS.sub(' ', statement)
+    sql = _STRINGS.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _IN_LISTS.sub('IN (...)', sql)
+    sql = _VALUES_LISTS.sub(r'VALUES \1', sql)
+    return _WHITESPACE.sub(' ', sql).strip().lower()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by ``QueryInspector.budget`` when too many statements ran"""
+
+
+class QueryInspector:
+    """Flask extension fingerprinting and analysing SQL issued per request"""
+
+    def __init__(self, app=None, mysql=None):
+        self.enabled = False
+        self.slow_ms = 100.0
+        self.n_plus_one = 3
+        self.budgets = {}
+        self._captures = threading.local()
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        """Hook into the request cycle when ``QUERY_INSPECTOR_ENABLED`` is set"""
+        app.extensions['query_inspector'] = self
+        self.enabled = app.config.get('QUERY_INSPECTOR_ENABLED', False)
+        if not self.enabled:
+            return
+
+        self.slow_ms = app.config.get('QUERY_INSPECTOR_SLOW_MS', 100.0)
+        self.n_plus_one = app.config.get('QUERY_INSPECTOR_N_PLUS_ONE', 3)
+        # Maximum statements per endpoint, e.g. {'avatar.get_avatar_profile': 3}
+        self.budgets = dict(app.config.get('QUERY_BUDGETS', {}))
+
+        mysql.add_query_listener(self._on_query)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _active_captures(self):
+        captures = getattr(self._captures, 'stack', None)
+        if captures is None:
+            captures = self._captures.stack = []
+        return captures
+
+    def _on_query(self, statement, params, elapsed, rowcount, connection):
+        entry = {
+            'fingerprint': fingerprint(statement),
+            'statement': statement,
+            'params': params,
+            'elapsed_ms': elapsed * 1000,
+            'rowcount': rowcount
+        }
+        for capture in self._active_captures():
+            capture.append(entry)
+
+        if not has_app_context():
+            return
+        log = g.get('_query_log')
+        if log is None:
+            log = g._query_log = []
+        log.append(entry)
+
+        if entry['elapsed_ms'] >= self.slow_ms:
+            entry['plan'] = self._explain(connection, statement, params)
+
+    def _explain(self, connection, statement, params):
+        if not statement.lstrip().lower().startswith(_EXPLAINABLE):
+            return None
+        try:
+            # Use the raw connection so EXPLAIN isn't reported to listeners
+            cursor = connection.raw.cursor()
+            cursor.execute('EXPLAIN ' + statement, params)
+            plan = cursor.fetchall()
+            cursor.close()
+            return plan
+        except Exception as e:
+            return f'EXPLAIN failed: {e}'
+
+    def _after_request(self, response):
+        log = g.get('_query_log') or []
+        response.headers['X-Query-Count'] = str(len(log))
+        response.headers['X-Query-Time-Ms'] = f"{sum(q['elapsed_ms'] for q in log):.2f}"
+        return response
+
+    def _teardown_request(self, exception):
+        log = g.pop('_query_log', None)
+        if not log:
+            return
+        endpoint = request.endpoint or 'unmatched'
+
+        for shape, count in Counter(q['fingerprint'] for q in log).items():
+            if count >= self.n_plus_one:
+                logger.warning('Possible N+1 in %s: %d executions of "%s"',
+                               endpoint, count, shape)
+
+        for query in log:
+            if query['elapsed_ms'] >= self.slow_ms:
+                logger.warning('Slow query in %s (%.1f ms): %s\nplan: %s',
+                               endpoint, query['elapsed_ms'],
+                               _WHITESPACE.sub(' ', query['statement']).strip(),
+                               query.get('plan'))
+
+        budget = self.budgets.get(endpoint)
+        if budget is not None and len(log) > budget:
+            logger.warning('Query budget exceeded in %s: %d statements (budget %d)',
+                           endpoint, len(log), budget)
+
+    @contextmanager
+    def capture(self):
+        """Collect every statement executed on this thread inside the block"""
+        queries = []
+        captures = self._active_captures()
+        captures.append(queries)
+        try:
+            yield queries
+        finally:
+            del captures[next(i for i, c in enumerate(captures) if c is queries)]
+
+    @contextmanager
+    def budget(self, max_queries):
+        """Fail if the block executes more than ``max_queries`` statements"""
+        with self.capture() as queries:
+            yield queries
+        if len(queries) > max_queries:
+            shapes = '\n'.join(f"  {q['fingerprint']}" for q in queries)
+            raise QueryBudgetExceeded(
+                f'{len(queries)} queries executed, budget was {max_queries}:\n{shapes}'
+            )
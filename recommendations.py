@@ -0,0 +1,282 @@
+"""
+Item-to-item "frequently saved together" recommendations
+
+The wardrobes in ``avatar_garments`` form a sparse avatar x garment matrix
+X; its co-occurrence matrix C = X'X (CSR) counts, for every pair of
+garments, the avatars holding both, with each garment's popularity on the
+diagonal. Pairs are scored by cosine similarity, C[i, j] / sqrt(C[i, i] *
+C[j, j]), so that garments everyone saves do not top every list.
+
+The top-k neighbours of every garment are precomputed and served from
+memory: GET /api/garments/<id>/similar runs no SQL. The index is loaded
+lazily in each process and kept current from ``wardrobe_changed``: the
+changes are applied to C as a sparse delta on a background queue and only
+the rows whose scores moved are re-ranked. A full rebuild every
+``SIMILAR_REBUILD_INTERVAL`` seconds corrects anything missed.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import signals
+from background import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+_REBUILD = ('rebuild',)
+_APPLY = ('apply',)
+
+
+class GarmentSimilarity:
+    """Flask extension holding the in-memory co-occurrence index"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self.top_k = 50
+        self.min_support = 2
+        self.rebuild_interval = 3600
+        self._lock = threading.Lock()
+        self._events = []
+        self._availability = set()
+        self._index = None
+        self._built_at = None
+        self._requested = False
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.top_k = app.config.get('SIMILAR_TOP_K', 50)
+        self.min_support = app.config.get('SIMILAR_MIN_SUPPORT', 2)
+        self.rebuild_interval = app.config.get('SIMILAR_REBUILD_INTERVAL', 3600)
+        self.queue = CoalescingQueue(
+            'similar-garments', self._process, app,
+            delay=app.config.get('SIMILAR_UPDATE_DELAY', 1.0)
+        )
+        app.extensions['similar_garments'] = self
+
+        signals.wardrobe_changed.connect(self._on_wardrobe_changed, weak=False)
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+
+    # -- serving -----------------------------------------------------------
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    def similar(self, garment_id, limit=10):
+        """
+        Up to ``limit`` ``(garment_id, score, saved_together)`` neighbours of
+        ``garment_id``, best first, or None while the index is loading.
+        """
+        index = self._index
+        if index is None:
+            self._request_build()
+            return None
+        if time.monotonic() - self._built_at > self.rebuild_interval:
+            self._built_at = time.monotonic()  # submit once; the rebuild resets it
+            self.queue.submit(_REBUILD)
+        available = index.available
+        neighbours = []
+        for neighbour in index.top.get(garment_id, ()):
+            if neighbour[0] in available:
+                neighbours.append(neighbour)
+                if len(neighbours) == limit:
+                    break
+        return neighbours
+
+    def is_available(self, garment_id):
+        """False for unknown, deleted and archived garments once the index is loaded"""
+        index = self._index
+        return index is None or garment_id in index.available
+
+    def _request_build(self):
+        if not self._requested:
+            self._requested = True
+            self.queue.submit(_REBUILD)
+
+    # -- change tracking ---------------------------------------------------
+
+    def _on_wardrobe_changed(self, sender, avatar_id=None, garment_id=None, action=None,
+                             garment_ids=(), **kwargs):
+        if self._index is None and not self._requested:
+            # Not loaded in this process: the build will read the change
+            return
+        with self._lock:
+            if action == 'add':
+                self._events.append((avatar_id, garment_id, True))
+            elif action == 'remove':
+                self._events.append((avatar_id, garment_id, False))
+            elif action == 'clear':
+                self._events.extend((avatar_id, cleared_id, False) for cleared_id in garment_ids)
+        self.queue.submit(_APPLY)
+
+    def _on_garment_changed(self, sender, garment_id=None, action=None, fields=None, **kwargs):
+        if self._index is None and not self._requested:
+            return
+        if action in ('create', 'delete') or 'available' in (fields or ()):
+            with self._lock:
+                self._availability.add(garment_id)
+            self.queue.submit(_APPLY)
+
+    def _process(self, keys):
+        if _REBUILD in keys or self._index is None:
+            try:
+                self.rebuild()
+            except Exception:
+                if self._index is None:
+                    self._requested = False  # let the next request try again
+                raise
+        self._apply_pending()
+
+    # -- building ----------------------------------------------------------
+
+    def rebuild(self):
+        """Load the wardrobes and rank every garment from scratch"""
+        started = time.monotonic()
+        cursor = self.mysql.read_connection.cursor()
+        cursor.execute("SELECT avatar_id, garment_id FROM avatar_garments")
+        pairs = cursor.fetchall()
+        cursor.execute("SELECT id FROM garments WHERE available = TRUE")
+        available = {row['id'] for row in cursor.fetchall()}
+        cursor.close()
+
+        index = _Index(self.top_k, self.min_support)
+        index.load(((row['avatar_id'], row['garment_id']) for row in pairs), available)
+
+        # Changes that arrived during the load are replayed on top of it; the
+        # wardrobe sets make replays of already-loaded ones no-ops
+        self._index = index
+        self._built_at = time.monotonic()
+        logger.info('similar-garments: indexed %d garments from %d wardrobe entries in %.2fs',
+                    len(index.garment_ids), len(pairs), time.monotonic() - started)
+
+    def _apply_pending(self):
+        index = self._index
+        with self._lock:
+            events, self._events = self._events, []
+            availability, self._availability = self._availability, set()
+        if events:
+            index.apply(events)
+        if availability:
+            self._refresh_availability(index, availability)
+
+    def _refresh_availability(self, index, garment_ids):
+        cursor = self.mysql.read_connection.cursor()
+        query = (
+            "SELECT id FROM garments WHERE available = TRUE "
+            f"AND id IN ({', '.join(['%s'] * len(garment_ids))})"
+        )
+        cursor.execute(query, tuple(garment_ids))
+        available = {row['id'] for row in cursor.fetchall()}
+        cursor.close()
+        index.available = (index.available - set(garment_ids)) | available
+
+
+class _Index:
+    """Co-occurrence matrix, wardrobes and ranked neighbour lists"""
+
+    def __init__(self, top_k, min_support):
+        self.top_k = top_k
+        self.min_support = min_support
+        self.garment_ids = []          # column -> garment id
+        self.columns = {}              # garment id -> column
+        self.wardrobes = {}            # avatar id -> set of columns
+        self.cooccurrence = sparse.csr_matrix((0, 0), dtype=np.int32)
+        self.top = {}                  # garment id -> ((garment id, score, count), ...)
+        self.available = set()
+
+    def _column(self, garment_id):
+        column = self.columns.get(garment_id)
+        if column is None:
+            column = self.columns[garment_id] = len(self.garment_ids)
+            self.garment_ids.append(garment_id)
+        return column
+
+    def load(self, pairs, available):
+        rows = []
+        columns = []
+        avatar_rows = {}
+        for avatar_id, garment_id in pairs:
+            column = self._column(garment_id)
+            self.wardrobes.setdefault(avatar_id, set()).add(column)
+            rows.append(avatar_rows.setdefault(avatar_id, len(avatar_rows)))
+            columns.append(column)
+
+        size = len(self.garment_ids)
+        wardrobes = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(avatar_rows), size)
+        )
+        self.cooccurrence = (wardrobes.T @ wardrobes).tocsr()
+        self.available = set(available)
+        self._rank(range(size))
+
+    def apply(self, events):
+        """Apply ``(avatar_id, garment_id, added)`` events as one sparse delta"""
+        delta = {}
+        touched = set()
+        for avatar_id, garment_id, added in events:
+            column = self._column(garment_id)
+            wardrobe = self.wardrobes.setdefault(avatar_id, set())
+            if (column in wardrobe) == added:
+                continue  # already reflected (replayed, or loaded by a rebuild)
+            step = 1 if added else -1
+            if added:
+                wardrobe.add(column)
+            else:
+                wardrobe.discard(column)
+            for other in wardrobe:
+                delta[(column, other)] = delta.get((column, other), 0) + step
+                if other != column:
+                    delta[(other, column)] = delta.get((other, column), 0) + step
+            if not added:
+                delta[(column, column)] = delta.get((column, column), 0) + step
+            touched.add(column)
+        if not touched:
+            return
+
+        size = len(self.garment_ids)
+        if self.cooccurrence.shape[0] < size:
+            self.cooccurrence.resize((size, size))
+        (rows, columns), values = zip(*delta.keys()), list(delta.values())
+        change = sparse.csr_matrix((values, (rows, columns)), shape=(size, size), dtype=np.int32)
+        self.cooccurrence = (self.cooccurrence + change).tocsr()
+        self.cooccurrence.eliminate_zeros()
+
+        # Re-rank every row with a changed pair and, since a garment's
+        # popularity is in every score of its neighbours' rows, the neighbours
+        dirty = set(rows)
+        matrix = self.cooccurrence
+        for column in touched:
+            dirty.update(matrix.indices[matrix.indptr[column]:matrix.indptr[column + 1]].tolist())
+        self._rank(dirty)
+
+    def _rank(self, columns):
+        matrix = self.cooccurrence
+        popularity = matrix.diagonal().astype(np.float64)
+        garment_ids = np.array(self.garment_ids)
+        top = dict(self.top)
+        for column in columns:
+            start, end = matrix.indptr[column], matrix.indptr[column + 1]
+            neighbours = matrix.indices[start:end]
+            counts = matrix.data[start:end]
+            keep = (neighbours != column) & (counts >= self.min_support)
+            if not keep.any():
+                top.pop(int(garment_ids[column]), None)
+                continue
+            neighbours = neighbours[keep]
+            counts = counts[keep]
+            scores = counts / np.sqrt(popularity[column] * popularity[neighbours])
+            neighbour_ids = garment_ids[neighbours]
+            # Best score first, ties by garment id
+            best = np.lexsort((neighbour_ids, -scores))[:self.top_k]
+            top[int(garment_ids[column])] = tuple(
+                (int(neighbour_ids[i]), round(float(scores[i]), 4), int(counts[i]))
+                for i in best
+            )
+        self.top = top
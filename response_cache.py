@@ -0,0 +1,225 @@
+"""
+Process-local cache of serialized responses for anonymous catalog GETs
+
+Entries are keyed by path plus normalized query string, hold the final
+response bytes, expire after a TTL and are evicted least-recently-used once
+the memory budget is exceeded. Each entry carries tags; write paths
+invalidate tags through the domain signals in ``signals.py``.
+
+Responses computed while an invalidation raced with them are not stored,
+and for ``RESPONSE_CACHE_SETTLE_SECONDS`` after an invalidation (the
+replica lag bound) freshly computed responses are served but not cached,
+so a lagging replica cannot repopulate the cache with pre-write data.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request
+
+import signals
+
+
+class _Entry:
+    __slots__ = ('body', 'status', 'headers', 'expires', 'size', 'tags', 'variants')
+
+    def __init__(self, body, status, headers, expires, tags):
+        self.body = body
+        self.variants = {}  # Content-Encoding -> precompressed body
+        self.status = status
+        self.headers = headers
+        self.expires = expires
+        self.tags = tags
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + 200
+
+
+class ResponseCache:
+    """Flask extension caching whole responses with tag-based invalidation"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.default_ttl = 60
+        self.max_bytes = 64 * 1024 * 1024
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generations = {}
+        self._settle_until = {}
+        self.settle_seconds = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Set by the Compression extension to store precompressed variants
+        self.compressor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        self.default_ttl = app.config.get('RESPONSE_CACHE_TTL', 60)
+        self.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        self.settle_seconds = app.config.get('RESPONSE_CACHE_SETTLE_SECONDS', 0)
+        app.extensions['response_cache'] = self
+
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+        signals.avatar_changed.connect(self._on_avatar_changed, weak=False)
+
+    # -- invalidation ------------------------------------------------------
+
+    def _on_garment_changed(self, sender, **kwargs):
+        self.invalidate('garments')
+
+    def _on_avatar_changed(self, sender, action=None, fields=None, public=None, **kwargs):
+        if action == 'delete' or public or (fields and 'public_profile' in fields):
+            self.invalidate('public_avatars')
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of ``tags``"""
+        settle_until = time.monotonic() + self.settle_seconds
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                if self.settle_seconds:
+                    self._settle_until[tag] = settle_until
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    # -- storage -----------------------------------------------------------
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generations(self, tags):
+        """Invalidation counters for ``tags``, to detect races with ``set``"""
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def set(self, key, body, status, headers, tags, ttl=None, generations=None):
+        """
+        Store a response. Skipped when ``generations`` (taken before the
+        response was computed) shows the tags were invalidated meanwhile.
+        """
+        now = time.monotonic()
+        entry = _Entry(body, status, headers, now + (ttl or self.default_ttl), tuple(tags))
+        if entry.size > self.max_bytes:
+            return None
+        with self._lock:
+            if generations is not None and generations != tuple(
+                    self._generations.get(tag, 0) for tag in entry.tags):
+                return None
+            if any(self._settle_until.get(tag, 0) > now for tag in entry.tags):
+                return None
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def _add_variant(self, key, entry, encoding, body):
+        with self._lock:
+            if self._entries.get(key) is entry and encoding not in entry.variants:
+                entry.variants[encoding] = body
+                entry.size += len(body)
+                self._bytes += len(body)
+
+    def _encode(self, response, key, entry):
+        """Serve the negotiated precompressed variant, compressing it once"""
+        compressor = self.compressor
+        if compressor is None:
+            return response
+        encoding = compressor.negotiate()
+        if encoding is None or len(entry.body) < compressor.min_size:
+            return response
+        body = entry.variants.get(encoding)
+        if body is None:
+            body = compressor.compress(entry.body, encoding)
+            self._add_variant(key, entry, encoding, body)
+        return compressor.apply(response, encoding, body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    # -- decorator ---------------------------------------------------------
+
+    @staticmethod
+    def make_key():
+        """Route plus query parameters sorted by name (order-insensitive)"""
+        args = sorted((k, v) for k, v in request.args.items(multi=True) if v != '')
+        return f'{request.path}?{urlencode(args)}' if args else request.path
+
+    def cached(self, tags, ttl=None, unless=None):
+        """
+        Cache successful GET responses of the decorated view under ``tags``.
+        Requests for which ``unless()`` is true (personalized) bypass it.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET' or (unless is not None and unless()):
+                    return view(*args, **kwargs)
+
+                key = self.make_key()
+                entry = self.get(key)
+                if entry is not None:
+                    response = Response(entry.body, status=entry.status, headers=entry.headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return self._encode(response, key, entry)
+
+                generations = self.generations(tags)
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    headers = [(k, v) for k, v in response.headers.items()
+                               if k in ('Content-Type',)]
+                    entry = self.set(key, response.get_data(), response.status_code,
+                                     headers, tags, ttl, generations)
+                    if entry is not None:
+                        response = self._encode(response, key, entry)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
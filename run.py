@@ -1,9 +1,11 @@
 """
 Production-ready server using Waitress (Windows compatible)
 Run this instead of app.py for better Windows support
+
+Set WAITRESS_WORKERS > 1 to run in prefork mode (Linux/macOS only): N worker
+processes share the listening socket, each with WAITRESS_THREADS threads
+and its own database pool.
 """
-from waitress import serve
-from app import app
 import os
 from dotenv import load_dotenv
 
@@ -12,10 +14,34 @@ load_dotenv()
 if __name__ == '__main__':
     host = os.getenv('FLASK_HOST', '0.0.0.0')
     port = int(os.getenv('FLASK_PORT', 5000))
-    
+    threads = int(os.getenv('WAITRESS_THREADS', 4))
+    workers = int(os.getenv('WAITRESS_WORKERS', 1))
+    connection_limit = int(os.getenv('WAITRESS_CONNECTION_LIMIT', 100))
+
     print(f"Starting Flask server with Waitress...")
     print(f"Server running on http://{host}:{port}")
     print(f"Health check: http://{host}:{port}/health")
     print("Press CTRL+C to quit")
-    
-    serve(app, host=host, port=port)
\ No newline at end of file
+
+    if workers > 1 and hasattr(os, 'fork'):
+        from prefork import PreforkServer
+
+        # The master never imports the app; each worker loads it after
+        # fork() so database pools are never shared between processes.
+        PreforkServer(
+            'app:app',
+            host=host,
+            port=port,
+            workers=workers,
+            threads=threads,
+            connection_limit=connection_limit,
+            reuse_port=os.getenv('WAITRESS_REUSE_PORT', 'False') == 'True',
+            graceful_timeout=int(os.getenv('WAITRESS_GRACEFUL_TIMEOUT', 30))
+        ).run()
+    else:
+        from waitress import serve
+        from app import app
+
+        print(f"Worker threads: {threads} (DB pool max size: {app.config['MYSQL_POOL_MAX_SIZE']})")
+        serve(app, host=host, port=port, threads=threads,
+              connection_limit=connection_limit)
@@ -33,6 +33,9 @@ CREATE TABLE IF NOT EXISTS avatars (
     selected_greeting_template VARCHAR(50) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- Bumped by every update; documents and feeds record the version they
+    -- were built from
+    version BIGINT NOT NULL DEFAULT 0,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id),
     INDEX idx_public_profile (public_profile),
@@ -52,33 +55,81 @@ CREATE TABLE IF NOT EXISTS body_measurements (
     neck_size DECIMAL(6,2) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- Bumped by every update, like avatars.version
+    version BIGINT NOT NULL DEFAULT 0,
     FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE,
     INDEX idx_avatar_id (avatar_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Garment dimensions: names stored once, referenced from garments by key
+-- (see dimensions.py)
+CREATE TABLE IF NOT EXISTS brands (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS categories (
+    id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS styles (
+    id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Garments table
 CREATE TABLE IF NOT EXISTS garments (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
-    brand VARCHAR(255) NOT NULL,
+    brand_id INT NOT NULL,
     price DECIMAL(10,2) NOT NULL,
     rating DECIMAL(3,2) DEFAULT 0.0,
     image_url TEXT,
     description TEXT,
-    category VARCHAR(100),
-    style VARCHAR(100),
+    category_id SMALLINT UNSIGNED NULL,
+    style_id SMALLINT UNSIGNED NULL,
     available BOOLEAN DEFAULT TRUE,
+    -- Avatars holding it in their wardrobe, maintained by popularity.py
+    wardrobe_count INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    INDEX idx_brand (brand),
-    INDEX idx_category (category),
-    INDEX idx_style (style),
+    FOREIGN KEY (brand_id) REFERENCES brands(id),
+    FOREIGN KEY (category_id) REFERENCES categories(id),
+    FOREIGN KEY (style_id) REFERENCES styles(id),
+    -- Listings filter on a dimension and available, ordered by rating
+    INDEX idx_brand_listing (brand_id, available, rating),
+    INDEX idx_category_listing (category_id, available, rating),
+    INDEX idx_style_listing (style_id, available, rating),
     INDEX idx_available (available),
     INDEX idx_rating (rating),
-    FULLTEXT idx_search (name, brand, description)
+    INDEX idx_popular (available, wardrobe_count),
+    FULLTEXT idx_search (name, description)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Garments moved out of the hot table by `flask archive-garments` (long
+-- unavailable); same columns as garments
+CREATE TABLE IF NOT EXISTS garments_archive (
+    id INT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    brand_id INT NOT NULL,
+    price DECIMAL(10,2) NOT NULL,
+    rating DECIMAL(3,2) DEFAULT 0.0,
+    image_url TEXT,
+    description TEXT,
+    category_id SMALLINT UNSIGNED NULL,
+    style_id SMALLINT UNSIGNED NULL,
+    available BOOLEAN DEFAULT FALSE,
+    wardrobe_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NULL,
+    updated_at TIMESTAMP NULL,
+    archived_at TIMESTAMP NOT NULL,
+    INDEX idx_archived_at (archived_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- Avatar garments junction table (wardrobe)
+-- Avatar garments junction table (wardrobe). garment_id has no foreign key:
+-- it may point to garments_archive; add_garment only accepts garments of
+-- the hot table
 CREATE TABLE IF NOT EXISTS avatar_garments (
     id INT AUTO_INCREMENT PRIMARY KEY,
     avatar_id INT NOT NULL,
@@ -86,16 +137,187 @@ CREATE TABLE IF NOT EXISTS avatar_garments (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE KEY unique_avatar_garment (avatar_id, garment_id),
     FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE,
-    FOREIGN KEY (garment_id) REFERENCES garments(id) ON DELETE CASCADE,
     INDEX idx_avatar_id (avatar_id),
     INDEX idx_garment_id (garment_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Wardrobe version per avatar, bumped under the row lock on every change
+CREATE TABLE IF NOT EXISTS wardrobe_versions (
+    avatar_id INT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Wardrobe change log backing GET /api/avatar/garments?since_version=
+CREATE TABLE IF NOT EXISTS wardrobe_changes (
+    avatar_id INT NOT NULL,
+    version BIGINT NOT NULL,
+    garment_id INT NULL,
+    action ENUM('add', 'remove', 'clear') NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (avatar_id, version),
+    FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Named counters handed out under a row lock, so that sequence order is
+-- commit order (AUTO_INCREMENT values are allocated before commit and can
+-- become visible out of order)
+CREATE TABLE IF NOT EXISTS change_sequences (
+    name VARCHAR(64) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Garment change log backing GET /api/garments/changes
+CREATE TABLE IF NOT EXISTS garment_changes (
+    seq BIGINT PRIMARY KEY,
+    garment_id INT NOT NULL,
+    action ENUM('create', 'update', 'delete') NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_garment_id (garment_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Garment size charts: per size, the body ranges it fits (lengths in cm,
+-- weight in kg; NULL bounds are open)
+CREATE TABLE IF NOT EXISTS garment_sizes (
+    garment_id INT NOT NULL,
+    position TINYINT UNSIGNED NOT NULL,
+    label VARCHAR(20) NOT NULL,
+    chest_min DECIMAL(6,2) NULL,
+    chest_max DECIMAL(6,2) NULL,
+    waist_min DECIMAL(6,2) NULL,
+    waist_max DECIMAL(6,2) NULL,
+    hips_min DECIMAL(6,2) NULL,
+    hips_max DECIMAL(6,2) NULL,
+    shoulder_width_min DECIMAL(6,2) NULL,
+    shoulder_width_max DECIMAL(6,2) NULL,
+    inseam_min DECIMAL(6,2) NULL,
+    inseam_max DECIMAL(6,2) NULL,
+    arm_length_min DECIMAL(6,2) NULL,
+    arm_length_max DECIMAL(6,2) NULL,
+    neck_size_min DECIMAL(6,2) NULL,
+    neck_size_max DECIMAL(6,2) NULL,
+    height_min DECIMAL(6,2) NULL,
+    height_max DECIMAL(6,2) NULL,
+    weight_min DECIMAL(6,2) NULL,
+    weight_max DECIMAL(6,2) NULL,
+    PRIMARY KEY (garment_id, position),
+    FOREIGN KEY (garment_id) REFERENCES garments(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Precomputed profile responses (owner and public view) per avatar, with the
+-- source versions they were built from
+CREATE TABLE IF NOT EXISTS profile_documents (
+    avatar_id INT PRIMARY KEY,
+    user_id INT NOT NULL UNIQUE,
+    owner_body MEDIUMBLOB NOT NULL,
+    public_body MEDIUMBLOB NULL,
+    avatar_version BIGINT NOT NULL,
+    measurements_version BIGINT NULL,
+    wardrobe_version BIGINT NOT NULL DEFAULT 0,
+    built_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Precomputed "for you" feeds (flask build-feeds): garment ids as uint32 and
+-- scores as float16, little-endian, best first; a row with only
+-- requested_at marks an avatar waiting for its first feed
+CREATE TABLE IF NOT EXISTS avatar_feeds (
+    avatar_id INT PRIMARY KEY,
+    garment_ids BLOB NULL,
+    scores BLOB NULL,
+    avatar_version BIGINT NULL,
+    measurements_version BIGINT NULL,
+    wardrobe_version BIGINT NOT NULL DEFAULT 0,
+    catalog_seq BIGINT NOT NULL DEFAULT 0,
+    built_at TIMESTAMP NULL,
+    requested_at TIMESTAMP NULL,
+    FOREIGN KEY (avatar_id) REFERENCES avatars(id) ON DELETE CASCADE,
+    INDEX idx_requested_at (requested_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Price quantile sketches of the available garments, overall (dimension
+-- 'all', value_id 0) and per brand/category/style id: log-spaced price
+-- buckets as int16 bucket indexes followed by int64 counts, little-endian
+-- (see price_stats.py). Rebuilt from garments by `flask rebuild-price-stats`.
+CREATE TABLE IF NOT EXISTS price_sketches (
+    dimension ENUM('all', 'brand', 'category', 'style') NOT NULL,
+    value_id INT NOT NULL,
+    price_sum DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    buckets BLOB NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (dimension, value_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Insert sample garments
-INSERT INTO garments (name, brand, price, rating, image_url, description, category, style) VALUES
-('Classic White T-Shirt', 'Uniqlo', 19.99, 4.5, '👕', 'A timeless white t-shirt made from premium cotton', 'tops', 'casual'),
-('Slim Fit Jeans', 'Zara', 49.99, 4.3, '👖', 'Modern slim fit jeans with stretch fabric', 'bottoms', 'casual'),
-('Running Shorts', 'Nike', 34.99, 4.7, '🩳', 'Performance running shorts with moisture-wicking technology', 'bottoms', 'sporty'),
-('Blazer Jacket', 'H&M', 79.99, 4.2, '🧥', 'Professional blazer for business and formal occasions', 'outerwear', 'modern'),
-('Summer Dress', 'Zara', 59.99, 4.6, '👗', 'Light and breezy summer dress perfect for warm weather', 'dresses', 'casual'),
-('Hoodie', 'Adidas', 64.99, 4.4, '🧥', 'Comfortable hoodie with kangaroo pocket', 'outerwear', 'sporty');
\ No newline at end of file
+INSERT IGNORE INTO brands (name) VALUES ('Uniqlo'), ('Zara'), ('Nike'), ('H&M'), ('Adidas');
+INSERT IGNORE INTO categories (name) VALUES ('tops'), ('bottoms'), ('outerwear'), ('dresses');
+INSERT IGNORE INTO styles (name) VALUES ('casual'), ('sporty'), ('modern');
+
+INSERT INTO garments (name, brand_id, price, rating, image_url, description, category_id, style_id)
+SELECT v.name, b.id, v.price, v.rating, v.image_url, v.description, c.id, s.id
+FROM (
+    SELECT 1 AS position, 'Classic White T-Shirt' AS name, 'Uniqlo' AS brand, 19.99 AS price, 4.5 AS rating, '👕' AS image_url, 'A timeless white t-shirt made from premium cotton' AS description, 'tops' AS category, 'casual' AS style
+    UNION ALL SELECT 2, 'Slim Fit Jeans', 'Zara', 49.99, 4.3, '👖', 'Modern slim fit jeans with stretch fabric', 'bottoms', 'casual'
+    UNION ALL SELECT 3, 'Running Shorts', 'Nike', 34.99, 4.7, '🩳', 'Performance running shorts with moisture-wicking technology', 'bottoms', 'sporty'
+    UNION ALL SELECT 4, 'Blazer Jacket', 'H&M', 79.99, 4.2, '🧥', 'Professional blazer for business and formal occasions', 'outerwear', 'modern'
+    UNION ALL SELECT 5, 'Summer Dress', 'Zara', 59.99, 4.6, '👗', 'Light and breezy summer dress perfect for warm weather', 'dresses', 'casual'
+    UNION ALL SELECT 6, 'Hoodie', 'Adidas', 64.99, 4.4, '🧥', 'Comfortable hoodie with kangaroo pocket', 'outerwear', 'sporty'
+) v
+JOIN brands b ON b.name = v.brand
+JOIN categories c ON c.name = v.category
+JOIN styles s ON s.name = v.style
+ORDER BY v.position;
+
+-- Seed the garment change log with the existing catalog (run once, after
+-- the garments above exist)
+INSERT IGNORE INTO garment_changes (seq, garment_id, action)
+SELECT id, id, 'create' FROM garments;
+
+INSERT INTO change_sequences (name, value)
+SELECT 'garments', COALESCE(MAX(seq), 0) FROM garment_changes
+ON DUPLICATE KEY UPDATE value = GREATEST(value, VALUES(value));
+
+-- Databases created before garments.wardrobe_count: add it, then backfill
+-- the counts with `flask reconcile-popularity`
+-- ALTER TABLE garments
+--     ADD COLUMN wardrobe_count INT NOT NULL DEFAULT 0 AFTER available,
+--     ADD INDEX idx_popular (available, wardrobe_count);
+
+-- Databases created before the dimension tables: create brands, categories
+-- and styles (above), then
+-- 1. add the keys next to the string columns, and let brand go NULL so the
+--    new release can insert garments without it:
+-- ALTER TABLE garments
+--     ADD COLUMN brand_id INT NULL AFTER brand,
+--     ADD COLUMN category_id SMALLINT UNSIGNED NULL AFTER category,
+--     ADD COLUMN style_id SMALLINT UNSIGNED NULL AFTER style,
+--     MODIFY brand VARCHAR(255) NULL,
+--     ADD INDEX idx_brand_listing (brand_id, available, rating),
+--     ADD INDEX idx_category_listing (category_id, available, rating),
+--     ADD INDEX idx_style_listing (style_id, available, rating);
+-- 2. deploy, then fill the tables and backfill the keys (chunked, rerunnable;
+--    rows still without keys are served from their string columns):
+--    flask migrate-dimensions
+-- 3. drop the string columns and their indexes:
+-- ALTER TABLE garments
+--     DROP INDEX idx_search, DROP INDEX idx_brand, DROP INDEX idx_category,
+--     DROP INDEX idx_style,
+--     DROP COLUMN brand, DROP COLUMN category, DROP COLUMN style,
+--     MODIFY brand_id INT NOT NULL,
+--     ADD FOREIGN KEY (brand_id) REFERENCES brands(id),
+--     ADD FOREIGN KEY (category_id) REFERENCES categories(id),
+--     ADD FOREIGN KEY (style_id) REFERENCES styles(id),
+--     ADD FULLTEXT idx_search (name, description);
+
+-- Databases created before garments_archive: create it (above), then drop
+-- the wardrobe's foreign key to garments, which would otherwise delete the
+-- wardrobe entries of archived garments (look its name up with
+-- SHOW CREATE TABLE avatar_garments):
+-- ALTER TABLE avatar_garments DROP FOREIGN KEY avatar_garments_ibfk_2;
+
+-- Databases created before avatars.version: add the versions, and recreate
+-- the documents and feeds keyed by them (both are rebuilt on demand):
+-- ALTER TABLE avatars ADD COLUMN version BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
+-- ALTER TABLE body_measurements ADD COLUMN version BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
+-- DROP TABLE profile_documents, avatar_feeds;
+-- then run this file again to create them
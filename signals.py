@@ -0,0 +1,30 @@
+"""
+Domain signals sent by the repositories after a write is committed
+
+Inside a ``mysql.transaction()`` unit of work they are held back until the
+outermost commit, and dropped if it rolls back.
+
+Subscribers (caches, derived in-memory indexes) use them to invalidate or
+update state without the repositories knowing about them.
+"""
+from blinker import Namespace
+
+_signals = Namespace()
+
+# sender=repository, garment_id=int, action='create'|'update'|'delete',
+# fields=set of updated column names (create/update only),
+# prices=(before, after) PRICED_COLUMNS values of the row, None for no row,
+# or prices=None if the write left them alone (see price_stats.py)
+garment_changed = _signals.signal('garment-changed')
+
+# sender=repository, avatar_id=int, action='create'|'update'|'delete',
+# fields=set of updated column names, public=bool or None if unknown
+avatar_changed = _signals.signal('avatar-changed')
+
+# sender=repository, avatar_id=int, garment_id=int or None (clear),
+# action='add'|'remove'|'clear', garment_ids=tuple of removed ids (clear only;
+# also sent on avatar delete, whose wardrobe goes with the avatar)
+wardrobe_changed = _signals.signal('wardrobe-changed')
+
+# sender=repository, avatar_id=int, action='create'|'update'
+measurements_changed = _signals.signal('measurements-changed')
@@ -0,0 +1,102 @@
+"""
+Request coalescing: concurrent callers with the same key share one execution
+"""
+import threading
+from functools import wraps
+
+
+def _freeze(value):
+    """Hashable form of call arguments (dicts and lists included)"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def coalesced(method):
+    """
+    Repository method decorator: identical concurrent calls share one query.
+
+    Expects the repository to expose ``self.singleflight`` (a SingleFlight or
+    None to disable) and ``self.mysql``. Callers that must read their own
+    writes from the primary bypass coalescing, since the in-flight leader
+    may be reading from a replica or from before their write.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.singleflight is None or self.mysql.reads_pinned_to_primary():
+            return method(self, *args, **kwargs)
+        key = (method.__qualname__, _freeze(args), _freeze(kwargs))
+        return self.singleflight.do(key, method, self, *args, **kwargs)
+    return wrapper
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a follower gave up waiting for the leader's result"""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent executions of the same work.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight wait for the leader and receive the same
+    result, or the same exception. Nothing is cached once the call returns.
+    """
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` once for all concurrent callers of ``key``"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.executions += 1
+            else:
+                call.followers += 1
+                leader = False
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                raise SingleFlightTimeout(f'Timed out after {self.timeout}s waiting for {key!r}')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'shared': self.shared
+            }
@@ -0,0 +1,368 @@
+"""
+Typeahead suggestions over garment names, brands and categories
+
+GET /api/garments/suggest?prefix= completes what a shopper is typing from an
+in-memory sorted prefix array, running no SQL. Every garment name, brand and
+category is a term, stored under its normalized (accent- and case-folded)
+text starting at each of its first ``SUGGEST_MAX_WORDS`` words, so "jea"
+finds "Slim Fit Jeans". A prefix is a contiguous range of the sorted keys,
+found by binary search; its terms are ranked by weight: garments by rating
+and wardrobe popularity, brands and categories by their best garment and
+their size.
+
+The best terms of every prefix matching more than ``SUGGEST_SCAN_LIMIT``
+keys are ranked ahead of time, each from the lists of its one character
+longer extensions (a trie's nodes, without the trie), so a lookup reads a
+ranked list or scans at most that many keys. Memory stays proportional to
+the catalog: keys are cut to ``SUGGEST_KEY_LENGTH`` characters, ranked lists
+to ``MAX_LIMIT`` terms, and each key length has at most one ranked prefix
+per ``SUGGEST_SCAN_LIMIT`` keys.
+
+The index is loaded lazily in each process. Garment writes re-read only the
+changed garments on a background queue, which splices their keys into a
+copy of the array and re-ranks the prefixes of the keys they touch. A full
+rebuild every ``SUGGEST_REBUILD_INTERVAL`` seconds picks up popularity,
+which changes without a garment write.
+"""
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+
+import signals
+from background import CoalescingQueue
+from dimensions import decode_garment
+
+logger = logging.getLogger(__name__)
+
+# Largest number of suggestions per request
+MAX_LIMIT = 20
+
+_REBUILD = ('rebuild',)
+_REFRESH = ('refresh',)
+# garments columns a suggestion depends on
+_SUGGEST_FIELDS = {'name', 'brand', 'category', 'rating', 'available'}
+_WORD = re.compile(r'\w+')
+# Sorts after any key character: (prefix + _END,) bounds the prefix's range
+_END = '\U0010ffff'
+
+
+def normalize(text):
+    """Accent- and case-folded words of ``text``, separated by single spaces"""
+    text = text or ''
+    if not text.isascii():
+        decomposed = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(_WORD.findall(text.casefold()))
+
+
+def garment_weight(rating, wardrobe_count):
+    """Ranking weight of a garment: its rating (0-1) plus damped popularity"""
+    return float(rating or 0) / 5 + math.log1p(wardrobe_count or 0) / 10
+
+
+def _groups(brand, category):
+    """Brand and category terms a garment counts towards"""
+    groups = []
+    if brand:
+        groups.append(('brand', normalize(brand)))
+    if category:
+        groups.append(('category', normalize(category)))
+    return [group for group in groups if group[1]]
+
+
+class GarmentSuggestions:
+    """Flask extension holding the in-memory typeahead index"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self.key_length = 24
+        self.max_words = 3
+        self.scan_limit = 256
+        self.rebuild_interval = 3600
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._index = None
+        self._built_at = None
+        self._requested = False
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.key_length = app.config.get('SUGGEST_KEY_LENGTH', 24)
+        self.max_words = app.config.get('SUGGEST_MAX_WORDS', 3)
+        self.scan_limit = app.config.get('SUGGEST_SCAN_LIMIT', 256)
+        self.rebuild_interval = app.config.get('SUGGEST_REBUILD_INTERVAL', 3600)
+        self.queue = CoalescingQueue(
+            'garment-suggestions', self._process, app,
+            delay=app.config.get('SUGGEST_UPDATE_DELAY', 0.5)
+        )
+        app.extensions['suggestions'] = self
+
+        signals.garment_changed.connect(self._on_garment_changed, weak=False)
+
+    # -- serving -----------------------------------------------------------
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    def suggest(self, prefix, limit=8):
+        """
+        Up to ``limit`` ``(kind, text, garment_id, brand)`` completions of
+        ``prefix``, best first, or None while the index is loading. ``kind``
+        is 'garment', 'brand' or 'category'; garment_id and brand are None
+        for brands and categories.
+        """
+        index = self._index
+        if index is None:
+            if not self._requested:
+                self._requested = True
+                self.queue.submit(_REBUILD)
+            return None
+        if time.monotonic() - self._built_at > self.rebuild_interval:
+            self._built_at = time.monotonic()  # submit once; the rebuild resets it
+            self.queue.submit(_REBUILD)
+        return index.suggest(normalize(prefix), min(limit, MAX_LIMIT))
+
+    # -- change tracking ---------------------------------------------------
+
+    def _on_garment_changed(self, sender, garment_id=None, action=None, fields=None, **kwargs):
+        if self._index is None and not self._requested:
+            # Not loaded in this process: the build will read the change
+            return
+        if action != 'update' or _SUGGEST_FIELDS & set(fields or ()):
+            with self._lock:
+                self._changed.add(garment_id)
+            self.queue.submit(_REFRESH)
+
+    def _process(self, keys):
+        if _REBUILD in keys or self._index is None:
+            try:
+                self.rebuild()
+            except Exception:
+                if self._index is None:
+                    self._requested = False  # let the next request try again
+                raise
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if changed:
+            fresh = self._read_garments(sorted(changed))
+            self._index = self._index.update(
+                {garment_id: fresh.get(garment_id) for garment_id in changed}
+            )
+
+    # -- building ----------------------------------------------------------
+
+    def rebuild(self):
+        """Load the available garments and index them from scratch"""
+        started = time.monotonic()
+        index = _Index(self.key_length, self.max_words, self.scan_limit)
+        index.load(self._read_garments())
+        self._index = index
+        self._built_at = time.monotonic()
+        logger.info('suggestions: indexed %d terms under %d keys in %.2fs',
+                    len(index.terms), len(index.keys), time.monotonic() - started)
+
+    def _read_garments(self, garment_ids=None):
+        """``{garment id: (name, brand, category, weight)}`` of available garments"""
+        query = (
+            "SELECT id, name, brand_id, category_id, rating, wardrobe_count "
+            "FROM garments WHERE available = TRUE"
+        )
+        params = ()
+        if garment_ids is not None:
+            query += f" AND id IN ({', '.join(['%s'] * len(garment_ids))})"
+            params = tuple(garment_ids)
+        cursor = self.mysql.read_connection.cursor()
+        cursor.execute(query, params)
+        rows = [decode_garment(row, cursor) for row in cursor.fetchall()]
+        cursor.close()
+        return {
+            row['id']: (row['name'], row.get('brand'), row.get('category'),
+                        garment_weight(row['rating'], row['wardrobe_count']))
+            for row in rows
+        }
+
+
+class _Index:
+    """Sorted ``(key, term)`` array with term weights and ranked large prefixes"""
+
+    def __init__(self, key_length, max_words, scan_limit):
+        self.key_length = key_length
+        self.max_words = max_words
+        self.scan_limit = scan_limit
+        self.keys = []         # sorted (key, term)
+        self.terms = {}        # term -> (weight, kind, text, garment id, brand)
+        self.garments = {}     # garment id -> (name, brand, category, weight)
+        self.groups = {}       # ('brand' | 'category', normalized name) -> {garment id: weight}
+        self.ranked = {}       # prefix of over scan_limit keys -> best terms
+
+    def _keys(self, text):
+        words = normalize(text).split(' ')
+        keys = {' '.join(words[start:])[:self.key_length]
+                for start in range(min(len(words), self.max_words))}
+        keys.discard('')
+        return keys
+
+    def _term(self, term):
+        """Entry of ``term`` in ``terms``, or None if it no longer exists"""
+        kind, ref = term
+        if kind == 'garment':
+            garment = self.garments.get(ref)
+            if garment is None:
+                return None
+            name, brand, _, weight = garment
+            return (weight, kind, name, ref, brand)
+        members = self.groups.get(term)
+        if not members:
+            return None
+        # Displayed as spelled on one of its garments (they fold alike)
+        garment = self.garments[next(iter(members))]
+        text = garment[1] if kind == 'brand' else garment[2]
+        weight = max(members.values()) + math.log1p(len(members)) / 10
+        return (weight, kind, text, None, None)
+
+    def load(self, garments):
+        """Index ``{garment id: (name, brand, category, weight)}``"""
+        self.garments = dict(garments)
+        for garment_id, (_, brand, category, weight) in self.garments.items():
+            for group in _groups(brand, category):
+                self.groups.setdefault(group, {})[garment_id] = weight
+        terms = [('garment', garment_id) for garment_id in self.garments] + list(self.groups)
+        for term in terms:
+            entry = self._term(term)
+            if entry is not None:
+                self.terms[term] = entry
+        self.keys = sorted((key, term) for term, entry in self.terms.items()
+                           for key in self._keys(entry[2]))
+        self._build('', 0, len(self.keys))
+
+    def _build(self, prefix, low, high):
+        """Rank ``prefix`` (keys[low:high]) and its extensions, longest first, if large"""
+        if high - low <= self.scan_limit:
+            return
+        for child, child_low, child_high in self._children(prefix, low, high):
+            self._build(child, child_low, child_high)
+        self.ranked[prefix] = self._rank(prefix, low, high)
+
+    def update(self, changed):
+        """
+        Copy of the index with ``{garment id: garment, or None if gone}``
+        applied; the served index is never modified in place
+        """
+        index = _Index(self.key_length, self.max_words, self.scan_limit)
+        index.keys = list(self.keys)
+        index.terms = dict(self.terms)
+        index.garments = dict(self.garments)
+        index.groups = dict(self.groups)
+        index.ranked = dict(self.ranked)
+
+        dirty = set()
+        for garment_id, garment in changed.items():
+            previous = index.garments.pop(garment_id, None)
+            if previous is not None:
+                for group in _groups(previous[1], previous[2]):
+                    members = dict(index.groups[group])
+                    del members[garment_id]
+                    index.groups[group] = members
+                    dirty.add(group)
+            if garment is not None:
+                index.garments[garment_id] = garment
+                for group in _groups(garment[1], garment[2]):
+                    index.groups[group] = {**index.groups.get(group, {}), garment_id: garment[3]}
+                    dirty.add(group)
+            dirty.add(('garment', garment_id))
+
+        touched = set()
+        for term in dirty:
+            if not index.groups.get(term, True):
+                del index.groups[term]
+            previous = index.terms.pop(term, None)
+            if previous is not None:
+                for key in index._keys(previous[2]):
+                    entry = (key, term)
+                    position = bisect.bisect_left(index.keys, entry)
+                    if position < len(index.keys) and index.keys[position] == entry:
+                        del index.keys[position]
+                    touched.add(key)
+            entry = index._term(term)
+            if entry is not None:
+                index.terms[term] = entry
+                for key in index._keys(entry[2]):
+                    bisect.insort(index.keys, (key, term))
+                    touched.add(key)
+
+        # Extensions first: a prefix is ranked from its extensions' lists
+        prefixes = {key[:length] for key in touched for length in range(len(key) + 1)}
+        for prefix in sorted(prefixes, key=len, reverse=True):
+            low, high = index._range(prefix)
+            if high - low > self.scan_limit:
+                index.ranked[prefix] = index._rank(prefix, low, high)
+            else:
+                index.ranked.pop(prefix, None)
+        return index
+
+    def _range(self, prefix):
+        """``(low, high)`` bounds of the keys starting with ``prefix``"""
+        low = bisect.bisect_left(self.keys, (prefix,))
+        return low, bisect.bisect_left(self.keys, (prefix + _END,), low)
+
+    def _children(self, prefix, low, high):
+        """``(prefix + next character, low, high)`` ranges within keys[low:high]"""
+        keys = self.keys
+        depth = len(prefix)
+        while low < high and len(keys[low][0]) == depth:
+            low += 1
+        while low < high:
+            child = keys[low][0][:depth + 1]
+            end = bisect.bisect_left(keys, (child + _END,), low, high)
+            yield child, low, end
+            low = end
+
+    def _best(self, candidates, limit):
+        terms = self.terms
+        # Heaviest first, ties alphabetically
+        return heapq.nsmallest(limit, candidates,
+                               key=lambda term: (-terms[term][0], terms[term][2], term))
+
+    def _rank(self, prefix, low, high):
+        """
+        Best terms of ``prefix``: its exact keys plus the ranked lists of its
+        large extensions and the keys of its small ones. A term among the
+        best of a prefix is among the best of every extension it is under.
+        """
+        keys = self.keys
+        candidates = set()
+        start = low
+        while start < high and len(keys[start][0]) == len(prefix):
+            candidates.add(keys[start][1])
+            start += 1
+        for child, child_low, child_high in self._children(prefix, start, high):
+            ranked = self.ranked.get(child)
+            if ranked is None:
+                ranked = [term for _, term in keys[child_low:child_high]]
+            candidates.update(ranked)
+        return self._best(candidates, MAX_LIMIT)
+
+    def suggest(self, prefix, limit):
+        if not prefix:
+            return []
+        start = prefix[:self.key_length]
+        best = self.ranked.get(start) if len(prefix) <= self.key_length else None
+        if best is None:
+            # A small range (or a prefix longer than the keys): scanned
+            low, high = self._range(start)
+            candidates = {term for _, term in self.keys[low:high]}
+            if len(prefix) > self.key_length:
+                # Keys are cut short: match the rest against the whole text
+                candidates = {term for term in candidates
+                              if f' {prefix}' in f' {normalize(self.terms[term][2])}'}
+            best = self._best(candidates, limit)
+        return [self.terms[term][1:] for term in best[:limit]]
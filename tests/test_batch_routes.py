@@ -0,0 +1,80 @@
+"""
+Nested batch requests are rejected however their path is spelled, and
+sub-request cookies are passed on
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask, jsonify, request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batch_routes import SUBREQUEST_KEY, _validate, init_batch_routes  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(init_batch_routes(max_requests=5, max_workers=2))
+
+    @app.route('/api/ping')
+    def ping():
+        return jsonify({'pong': True})
+
+    @app.route('/api/write', methods=['POST'])
+    def write():
+        response = jsonify({'written': True})
+        response.set_cookie('db_sticky_until', '1700000005.000', max_age=5, httponly=True)
+        return response
+
+    @app.route('/api/sticky')
+    def sticky():
+        return jsonify({'sticky': request.cookies.get('db_sticky_until')})
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize('path', [
+    '/api/batch', '/api/batch/', '/api/batch?x=1', '/api/%62atch', '/api/%62%61tch/',
+    '/api//batch', '/api/ping/../batch',
+])
+def test_validate_rejects_batch_paths(path):
+    assert _validate({'method': 'POST', 'path': path}) == 'batch requests cannot be nested'
+
+
+def test_encoded_nested_batch_is_not_dispatched(client):
+    inner = {'requests': [{'method': 'GET', 'path': '/api/ping'}]}
+    response = client.post('/api/batch', json={'requests': [
+        {'id': 'nested', 'method': 'POST', 'path': '/api/%62atch', 'body': inner},
+        {'id': 'ping', 'method': 'GET', 'path': '/api/ping'},
+    ]})
+    assert response.status_code == 200
+    nested, ping = response.get_json()['responses']
+    assert nested['status'] == 400
+    assert nested['body'] == {'error': 'batch requests cannot be nested'}
+    assert ping == {'id': 'ping', 'status': 200, 'body': {'pong': True}}
+
+
+def test_subrequest_cannot_reach_batch_view(client):
+    # A spelling _validate does not catch still lands on the guard
+    body = {'requests': [{'method': 'GET', 'path': '/api/ping'}]}
+    response = client.post('/api/batch', json=body, environ_base={SUBREQUEST_KEY: True})
+    assert response.status_code == 400
+
+
+
+def test_subrequest_cookies_reach_the_client_and_later_subrequests(client):
+    client.set_cookie('db_sticky_until', '1600000000.000')
+    response = client.post('/api/batch', json={'requests': [
+        {'id': 'before', 'method': 'GET', 'path': '/api/sticky'},
+        {'id': 'write', 'method': 'POST', 'path': '/api/write'},
+        {'id': 'after', 'method': 'GET', 'path': '/api/sticky'},
+    ]})
+    assert response.status_code == 200
+    before, write, after = response.get_json()['responses']
+    assert before['body'] == {'sticky': '1600000000.000'}
+    assert after['body'] == {'sticky': '1700000005.000'}
+    cookies = response.headers.getlist('Set-Cookie')
+    assert len(cookies) == 1 and cookies[0].startswith('db_sticky_until=1700000005.000;')
+    assert 'HttpOnly' in cookies[0]
@@ -0,0 +1,87 @@
+"""
+Query budgets and captures of the SQL inspector
+"""
+import logging
+import os
+import sys
+
+import pytest
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from query_inspector import QueryBudgetExceeded, QueryInspector, fingerprint  # noqa: E402
+
+
+class FakeMySQL:
+    """Stands in for PooledMySQL: statements are reported to the listeners directly"""
+
+    def __init__(self):
+        self.listeners = []
+
+    def add_query_listener(self, listener):
+        self.listeners.append(listener)
+
+    def execute(self, statement, params=None):
+        for listener in self.listeners:
+            listener(statement, params, 0.001, 1, None)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(QUERY_INSPECTOR_ENABLED=True, QUERY_BUDGETS={'listing': 1})
+    mysql = FakeMySQL()
+    QueryInspector(app, mysql)
+
+    @app.route('/listing/<int:statements>')
+    def listing(statements):
+        for garment_id in range(statements):
+            mysql.execute('SELECT * FROM garments WHERE id = %s', (garment_id,))
+        return jsonify({'count': statements})
+
+    app.mysql = mysql
+    return app
+
+
+def test_fingerprint_ignores_values():
+    assert (fingerprint("SELECT * FROM garments WHERE id IN (1, 2, 3) AND name = 'x'")
+            == fingerprint('select *  from garments where id in (%s) and name = %s'))
+
+
+def test_budget_within_limit(app):
+    inspector = app.extensions['query_inspector']
+    with inspector.budget(1) as queries:
+        app.mysql.execute('SELECT * FROM garments WHERE id = %s', (1,))
+    assert [q['fingerprint'] for q in queries] == ['select * from garments where id = ?']
+
+
+def test_budget_exceeded_lists_statements(app):
+    inspector = app.extensions['query_inspector']
+    with pytest.raises(QueryBudgetExceeded, match='2 queries executed, budget was 1'):
+        with inspector.budget(1):
+            app.mysql.execute('SELECT * FROM avatars WHERE user_id = %s', (5,))
+            app.mysql.execute('SELECT version FROM wardrobe_versions WHERE avatar_id = %s', (7,))
+
+
+def test_nested_captures_see_inner_statements(app):
+    inspector = app.extensions['query_inspector']
+    with inspector.capture() as outer:
+        app.mysql.execute('SELECT 1')
+        with inspector.capture() as inner:
+            app.mysql.execute('SELECT 2')
+    assert len(outer) == 2 and len(inner) == 1
+    assert inspector._active_captures() == []
+
+
+def test_request_counts_and_budget_warning(app, caplog):
+    client = app.test_client()
+    with app.extensions['query_inspector'].capture() as queries:
+        response = client.get('/listing/1')
+    assert response.headers['X-Query-Count'] == '1' and len(queries) == 1
+
+    with caplog.at_level(logging.WARNING, logger='query_inspector'):
+        response = client.get('/listing/3')
+    assert response.headers['X-Query-Count'] == '3'
+    assert 'Query budget exceeded in listing: 3 statements (budget 1)' in caplog.text
+    assert 'Possible N+1 in listing' in caplog.text
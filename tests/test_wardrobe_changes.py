@@ -0,0 +1,67 @@
+"""
+Wardrobe delta sync nets out garments changed several times since a version
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+pytest.importorskip('MySQLdb')
+
+from avatar_models import AvatarGarmentRepository  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeMySQL:
+    def __init__(self, rows):
+        self.rows = rows
+
+    @property
+    def read_connection(self):
+        return self
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+def changes_since(since_version, log):
+    """``get_wardrobe_changes`` over ``log``: (version, garment id, action) after since_version"""
+    rows = [{'current_version': log[-1][0], 'version': version, 'garment_id': garment_id,
+             'action': action} for version, garment_id, action in log]
+    repo = AvatarGarmentRepository(FakeMySQL(rows))
+    repo.get_avatar_garments = lambda avatar_id, garment_ids=None: [
+        {'id': garment_id} for garment_id in garment_ids]
+    return repo.get_wardrobe_changes(7, since_version)
+
+
+def test_remove_add_remove_is_removed():
+    changes = changes_since(3, [(4, 10, 'remove'), (5, 10, 'add'), (6, 10, 'remove')])
+    assert changes['added'] == [] and changes['removed'] == [10]
+    assert changes['version'] == 6 and not changes['reset']
+
+
+def test_add_remove_add_is_added():
+    changes = changes_since(3, [(4, 10, 'add'), (5, 10, 'remove'), (6, 10, 'add')])
+    assert changes['added'] == [10] and changes['removed'] == []
+    assert changes['garments'] == [{'id': 10}]
+
+
+def test_round_trips_cancel_out():
+    changes = changes_since(3, [(4, 10, 'add'), (5, 11, 'remove'), (6, 10, 'remove'),
+                                (7, 11, 'add'), (8, 12, 'add')])
+    assert changes['added'] == [12] and changes['removed'] == []
@@ -0,0 +1,138 @@
+"""
+Approximate result totals for paginated listings (``withTotal=true``)
+
+A total is exact whenever that is cheap:
+- a page shorter than ``limit`` ends the listing, so offset + page size is
+  the total, with no query;
+- otherwise a bounded count (``COUNT(*)`` over at most
+  ``TOTALS_EXACT_LIMIT`` matching index entries) settles small results.
+
+Larger results are estimated from per-filter counts cached in memory
+(least recently used, at most ``TOTALS_MAX_ENTRIES``). A count older than
+``TOTALS_TTL`` seconds is still served while a background queue recounts
+it. Filter combinations with no count yet are estimated from the counts of
+the whole catalog and of each brand/category/style filter alone, assuming
+they are independent. Estimates are never below the bound that the bounded
+count proved.
+
+Only the whole catalog and brand/category/style combinations are counted in
+the background. Free-text search and the price and wardrobe-count ranges
+have too many distinct values to cache and no count to estimate from, so a
+large result with any of them has no total (None, not exact).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+from avatar_models import AvatarRepository
+from background import CoalescingQueue
+from garment_models import GarmentRepository
+
+# Filters whose counts combine into estimates
+_FACETS = ('brand', 'category', 'style')
+
+
+def wants_total():
+    """Whether the listing request asked for a total (``withTotal=true``)"""
+    return request.args.get('withTotal', 'false').lower() in ('true', '1')
+
+
+def filter_key(filters):
+    """Hashable, order-independent key of listing filters"""
+    return tuple(sorted((name, str(value)) for name, value in (filters or {}).items()))
+
+
+class ListingTotals:
+    """Flask extension computing exact or estimated listing totals"""
+
+    def __init__(self, app=None, mysql=None):
+        self.mysql = None
+        self.queue = None
+        self.exact_limit = 1000
+        self.ttl = 300
+        self.max_entries = 1024
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()    # key -> (count, counted at)
+        if app is not None:
+            self.init_app(app, mysql)
+
+    def init_app(self, app, mysql):
+        self.mysql = mysql
+        self.exact_limit = app.config.get('TOTALS_EXACT_LIMIT', 1000)
+        self.ttl = app.config.get('TOTALS_TTL', 300)
+        self.max_entries = app.config.get('TOTALS_MAX_ENTRIES', 1024)
+        self.garment_repo = GarmentRepository(mysql)
+        self.avatar_repo = AvatarRepository(mysql)
+        self.queue = CoalescingQueue('listing-totals', self._process, app)
+        app.extensions['totals'] = self
+
+    # -- totals --------------------------------------------------------------
+
+    def garments(self, filters, page_count, limit, offset):
+        """``(total, exact)`` of a garment listing; total is None if unknown"""
+        filters = filters or {}
+        key = ('garments', filter_key(filters))
+        if any(value for name, value in filters.items() if name not in _FACETS):
+            return self._total(key, page_count, limit, offset, cached=False)
+        return self._total(key, page_count, limit, offset,
+                           lambda: self._garment_estimate(filters))
+
+    def public_avatars(self, page_count, limit, offset):
+        """``(total, exact)`` of the public avatar listing"""
+        return self._total(('public_avatars', ()), page_count, limit, offset)
+
+    def _total(self, key, page_count, limit, offset, estimate=None, cached=True):
+        if page_count < limit and (page_count or not offset):
+            return offset + page_count, True
+        bounded = self._count(key, self.exact_limit)
+        if bounded < self.exact_limit:
+            return bounded, True
+        if not cached:
+            return None, False
+        total = self._cached(key)
+        if total is None and estimate is not None:
+            total = estimate()
+        return max(total or 0, self.exact_limit), False
+
+    def _garment_estimate(self, filters):
+        catalog = self._cached(('garments', ()))
+        if catalog is None:
+            return None
+        total = float(catalog)
+        for facet in _FACETS:
+            if filters.get(facet):
+                count = self._cached(('garments', filter_key({facet: filters[facet]})))
+                if count is None:
+                    return None
+                total *= count / catalog if catalog else 0
+        return round(total)
+
+    # -- counts --------------------------------------------------------------
+
+    def _count(self, key, bound=None):
+        listing, filters = key
+        if listing == 'garments':
+            return self.garment_repo.count_garments(dict(filters), bound)
+        return self.avatar_repo.count_public_avatars(bound)
+
+    def _cached(self, key):
+        """Cached count of ``key`` (possibly stale) or None; refreshes it if stale"""
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is not None:
+                self._counts.move_to_end(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                return entry[0]
+        self.queue.submit(key)
+        return entry[0] if entry is not None else None
+
+    def _process(self, keys):
+        for key in keys:
+            count = self._count(key)
+            with self._lock:
+                self._counts[key] = (count, time.monotonic())
+                self._counts.move_to_end(key)
+                while len(self._counts) > self.max_entries:
+                    self._counts.popitem(last=False)